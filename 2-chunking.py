@@ -2,13 +2,20 @@ from typing import List, Dict, Any
 from docling.chunking import HybridChunker
 from dotenv import load_dotenv
 from openai import OpenAI
+from utils.metrics import metrics
+from utils.profiling import PROFILING, ProfileReport, profile_document, timed_calls
 from utils.tokenizer import OpenAITokenizerWrapper
+from utils.parent_child import CHILD_MAX_TOKENS, MULTI_GRANULARITY, make_parent_id, split_into_children
+from utils.web_source import load_web_documents
 from utils.zotero_handler import extract_documents_from_zotero
 import pickle
 import os
+import json
 import hashlib
+import socket
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 import multiprocessing
 import time
 
@@ -31,10 +38,38 @@ def load_cached_chunks(cache_path: str) -> List[Dict[str, Any]]:
         return pickle.load(f)
 
 def save_chunks_to_cache(chunks: List[Dict[str, Any]], cache_path: str):
-    """Zapisuje chunki do cache."""
+    """Zapisuje chunki do cache (atomowo)."""
     os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-    with open(cache_path, 'wb') as f:
-        pickle.dump(chunks, f)
+    # Zapis atomowy: inne procesy (także na innych hostach, przy współdzielonym
+    # cache) widzą plik kompletny albo wcale
+    tmp_path = f"{cache_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with metrics.span("cache_write") as span:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(chunks, f)
+            span["bytes"] = f.tell()
+        os.replace(tmp_path, cache_path)
+
+def get_chunk_page_numbers(chunk) -> List[int] | None:
+    """Zwraca posortowane numery stron chunka na podstawie proweniencji elementów."""
+    page_numbers = sorted(
+        set(
+            prov.page_no
+            for item in chunk.meta.doc_items
+            for prov in item.prov
+        )
+    )
+    return page_numbers or None
+
+def add_child_chunks(chunks: List[Dict[str, Any]], encoding, child_max_tokens: int = CHILD_MAX_TOKENS) -> List[Dict[str, Any]]:
+    """Dodaje do chunków (sekcji nadrzędnych) małe fragmenty potomne.
+
+    Każdy chunk dostaje `parent_id` i listę tekstów `children`, które
+    3-embedding.py zapisuje w osobnych tabelach (tryb CHUNKING_MODE=parent_child).
+    """
+    for index, chunk_info in enumerate(chunks):
+        chunk_info['parent_id'] = make_parent_id(chunk_info['zotero_key'], index)
+        chunk_info['children'] = split_into_children(chunk_info['chunk'].text, encoding, child_max_tokens)
+    return chunks
 
 def process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
     """Przetwarza chunking dla pojedynczego dokumentu.
@@ -43,8 +78,30 @@ def process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
         doc_data: Słownik zawierający dane dokumentu i konfigurację
         
     Returns:
-        Słownik z wynikami chunkingu lub informacją o błędzie
+        Słownik z wynikami chunkingu lub informacją o błędzie,
+        metrykami procesu roboczego (`metrics`, do utils.metrics.merge)
+        i profilem dokumentu (`profile`, przy PIPELINE_PROFILE=1)
     """
+    with profile_document("chunking", doc_data['doc_info'].get('zotero_key', '')) as profile:
+        result = _process_single_document_chunks(doc_data)
+    status = ("cached" if result.get('cached') else "ok") if result['success'] else "error"
+    metrics.inc("documents", stage="chunking", status=status)
+    result['metrics'] = metrics.snapshot(reset=True)
+    if profile is not None:
+        profile['title'] = result['title']
+        profile['phases'] = {stage: entry['sum'] for stage, entry in result['metrics']['durations'].items()}
+    result['profile'] = profile
+    return result
+
+def count_chunk_tokens(chunks: List[Dict[str, Any]], encoding) -> int:
+    """Liczy tokeny wszystkich chunków dokumentu (metryka tokens/s etapu chunkingu)."""
+    with metrics.span("token_counting") as span:
+        token_count = sum(len(encoding.encode(chunk_info['chunk'].text)) for chunk_info in chunks)
+        span["tokens"] = token_count
+    metrics.inc("chunk_tokens", token_count)
+    return token_count
+
+def _process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
     try:
         doc_info = doc_data['doc_info']
         max_tokens = doc_data['max_tokens']
@@ -55,7 +112,14 @@ def process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
         # Sprawdź czy chunki już zostały utworzone
         if os.path.exists(chunks_cache_path):
             try:
-                cached_chunks = load_cached_chunks(chunks_cache_path)
+                with metrics.span("cache_load"):
+                    cached_chunks = load_cached_chunks(chunks_cache_path)
+                metrics.inc("cache_requests", cache="chunks", result="hit")
+                if MULTI_GRANULARITY and any('children' not in chunk_info for chunk_info in cached_chunks):
+                    # Cache z trybu płaskiego - dzieci liczymy z gotowych sekcji, bez ponownego chunkingu
+                    with metrics.span("child_chunks"):
+                        add_child_chunks(cached_chunks, OpenAITokenizerWrapper().tokenizer)
+                    save_chunks_to_cache(cached_chunks, chunks_cache_path)
                 return {
                     'success': True,
                     'cached': True,
@@ -70,6 +134,8 @@ def process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
                 except:
                     pass
         
+        metrics.inc("cache_requests", cache="chunks", result="miss")
+        
         # Utwórz tokenizer i chunker dla tego procesu
         tokenizer = OpenAITokenizerWrapper()
         chunker = HybridChunker(
@@ -80,10 +146,21 @@ def process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
         
         try:
             # Wykonaj chunking
-            chunk_iter = chunker.chunk(dl_doc=doc_info['document'])
-            doc_chunks = list(chunk_iter)
+            # Przy profilowaniu osobno mierzony jest czas liczenia tokenów przez HybridChunker
+            tokenizer_time = {}
+            counting = (
+                timed_calls(tokenizer, "tokenize", tokenizer_time, "chunker_token_counting")
+                if PROFILING else nullcontext()
+            )
+            with metrics.span("chunking", zotero_key=zotero_key) as span, counting:
+                chunk_iter = chunker.chunk(dl_doc=doc_info['document'])
+                doc_chunks = list(chunk_iter)
+                span["chunks"] = len(doc_chunks)
+            metrics.inc("chunks", len(doc_chunks))
+            for phase, seconds in tokenizer_time.items():
+                metrics.observe(phase, seconds)
             
-            # Dodaj metadane Zotero do każdego chunka
+            # Dodaj metadane Zotero (lub strony WWW, utils/web_source.py) do każdego chunka
             chunks_with_metadata = []
             for chunk in doc_chunks:
                 chunk_with_metadata = {
@@ -92,11 +169,21 @@ def process_single_document_chunks(doc_data: Dict[str, Any]) -> Dict[str, Any]:
                     'title': doc_info['title'],
                     'creators': doc_info['creators'],
                     'date': doc_info['date'],
+                    'parsed_date': doc_info.get('parsed_date'),
                     'item_type': doc_info['item_type'],
-                    'pdf_size': doc_info['pdf_size']
+                    'source_type': doc_info.get('source_type', 'zotero'),
+                    'url': doc_info.get('url'),
+                    'pdf_size': doc_info.get('pdf_size'),
+                    'page_numbers': get_chunk_page_numbers(chunk)
                 }
                 chunks_with_metadata.append(chunk_with_metadata)
             
+            count_chunk_tokens(chunks_with_metadata, tokenizer.tokenizer)
+            
+            if MULTI_GRANULARITY:
+                with metrics.span("child_chunks"):
+                    add_child_chunks(chunks_with_metadata, tokenizer.tokenizer)
+            
             # Zapisz chunki do cache
             save_chunks_to_cache(chunks_with_metadata, chunks_cache_path)
             
@@ -146,6 +233,7 @@ def chunk_zotero_documents(docs: List[Dict[str, Any]], max_workers: int = None)
     processed_count = 0
     skipped_count = 0
     error_count = 0
+    report = ProfileReport("chunking") if PROFILING else None
     
     # Przygotuj dane dla procesów roboczych
     docs_data = [{
@@ -164,6 +252,9 @@ def chunk_zotero_documents(docs: List[Dict[str, Any]], max_workers: int = None)
             for future in as_completed(future_to_doc):
                 try:
                     result = future.result()
+                    metrics.merge(result.pop('metrics', None))
+                    if report:
+                        report.add(result.pop('profile', None))
                     
                     if result['success']:
                         all_chunks.extend(result['chunks'])
@@ -190,6 +281,10 @@ def chunk_zotero_documents(docs: List[Dict[str, Any]], max_workers: int = None)
     print(f"  Błędów: {error_count}")
     print(f"  Łącznie chunków: {len(all_chunks)}")
     print(f"  Użyto procesów: {max_workers}")
+    print(metrics.format_summary())
+    print(f"Metryki zapisano do {metrics.write_prometheus('chunking')}")
+    if report:
+        print(f"Raport profilowania: {report.write()}")
     return all_chunks
 
 def save_chunks(chunks: List[Dict[str, Any]], filename: str = "data/zotero_chunks.pkl"):
@@ -198,6 +293,30 @@ def save_chunks(chunks: List[Dict[str, Any]], filename: str = "data/zotero_chunk
     with open(filename, 'wb') as f:
         pickle.dump(chunks, f)
     print(f"Zapisano {len(chunks)} chunków do {filename}")
+    save_chunks_manifest(chunks)
+
+def save_chunks_manifest(chunks: List[Dict[str, Any]], filename: str = "data/zotero_chunks_manifest.json"):
+    """Zapisuje listę plików cache chunków, z których składa się bieżący zbiór.
+
+    Pozwala 3-embedding.py czytać chunki dokument po dokumencie zamiast
+    wczytywać cały plik pickle do pamięci.
+    """
+    chunk_counts = {}
+    for chunk_info in chunks:
+        chunk_counts[chunk_info['zotero_key']] = chunk_counts.get(chunk_info['zotero_key'], 0) + 1
+    
+    manifest = {
+        'documents': [
+            {
+                'zotero_key': zotero_key,
+                'cache_path': get_chunks_cache_filename(zotero_key),
+                'chunk_count': chunk_count
+            }
+            for zotero_key, chunk_count in chunk_counts.items()
+        ]
+    }
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
 
 def load_chunks(filename: str = "data/zotero_chunks.pkl") -> List[Dict[str, Any]]:
     """Wczytuje chunki z pliku."""
@@ -229,6 +348,12 @@ if __name__ == "__main__":
             pickle.dump(docs, f)
         print(f"Zapisano {len(docs)} dokumentów do {docs_file}")
     
+    # Strony WWW pobrane przez python -m utils.web_source przechodzą ten sam chunking
+    web_docs = load_web_documents()
+    if web_docs:
+        print(f"Dołączanie {len(web_docs)} stron WWW...")
+        docs += web_docs
+    
     # Sprawdź czy główny plik chunków już istnieje
     if os.path.exists(chunks_file):
         print(f"\nGłówny plik chunków {chunks_file} już istnieje.")
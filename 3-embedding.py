@@ -1,30 +1,54 @@
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List
+import json
 import pickle
 import os
 
 import lancedb
-from docling.chunking import HybridChunker
+import pyarrow as pa
 from dotenv import load_dotenv
 from lancedb.embeddings import get_registry
 from lancedb.pydantic import LanceModel, Vector
-from openai import OpenAI
-from utils.tokenizer import OpenAITokenizerWrapper
+from tqdm import tqdm
+from utils.dates import parse_date
+from utils.document_index import SCAN_BATCH_SIZE, build_document_table
+from utils.indexes import create_indexes, sql_literal
+from utils.maintenance import OPTIMIZE_AFTER_INGEST, optimize_table
+from utils.metrics import metrics
+from utils.parent_child import CHILDREN_TABLE_NAME, MULTI_GRANULARITY, PARENTS_TABLE_NAME
+from utils.related_items import sync_related_items
 
 load_dotenv()
 
-# Initialize OpenAI client (make sure you have OPENAI_API_KEY in your environment variables)
-client = OpenAI()
-
-tokenizer = OpenAITokenizerWrapper()  # Load our custom tokenizer for OpenAI
 MAX_TOKENS = 8191  # text-embedding-3-large's maximum context length
 
+# Kodowanie do liczenia tokenów wysyłanych do API embeddingów (to samo co
+# OpenAITokenizerWrapper w utils/tokenizer.py, ale bez transformers i docling)
+ENCODING_NAME = "cl100k_base"
+_encoding = None
+
+def get_encoding():
+    """Ładuje kodowanie tiktoken przy pierwszym użyciu."""
+    global _encoding
+    if _encoding is None:
+        from tiktoken import get_encoding as load_encoding
+
+        _encoding = load_encoding(ENCODING_NAME)
+    return _encoding
+
 # --------------------------------------------------------------
 # Load chunks from Zotero documents
 # --------------------------------------------------------------
 
+CHUNKS_FILE = "data/zotero_chunks.pkl"
+CHUNKS_MANIFEST_FILE = "data/zotero_chunks_manifest.json"
+
+# Liczba fragmentów w jednej partii zapisu (jedna partia = jedna transakcja LanceDB).
+# 32 fragmenty po maks. 8191 tokenów mieszczą się w limicie jednego żądania embeddingów.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
 def load_zotero_chunks():
     """Wczytuje fragmenty dokumentów z Zotero."""
-    chunks_file = "data/zotero_chunks.pkl"
+    chunks_file = CHUNKS_FILE
     
     if not os.path.exists(chunks_file):
         print("Plik z fragmentami nie istnieje. Uruchom najpierw 2-chunking.py")
@@ -36,6 +60,37 @@ def load_zotero_chunks():
     print(f"Wczytano {len(chunks_data)} fragmentów z pliku {chunks_file}")
     return chunks_data
 
+def iter_zotero_documents_chunks() -> Iterator[List[Dict[str, Any]]]:
+    """Zwraca chunki dokument po dokumencie.
+
+    Jeśli istnieje manifest z 2-chunking.py, chunki są czytane z plików cache
+    pojedynczych dokumentów, więc w pamięci jest naraz tylko jeden dokument.
+    W przeciwnym razie wczytywany jest główny plik pickle.
+    """
+    if os.path.exists(CHUNKS_MANIFEST_FILE):
+        with open(CHUNKS_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        
+        documents = manifest['documents']
+        print(f"Wczytywanie fragmentów {len(documents)} dokumentów z cache ({CHUNKS_MANIFEST_FILE})")
+        for entry in documents:
+            try:
+                with open(entry['cache_path'], 'rb') as f:
+                    yield pickle.load(f)
+            except Exception as e:
+                print(f"  ❌ Nie można wczytać chunków {entry['zotero_key']}: {e}")
+        return
+    
+    chunks_data = load_zotero_chunks()
+    document_chunks = []
+    for chunk_info in chunks_data:
+        if document_chunks and chunk_info.get('zotero_key') != document_chunks[-1].get('zotero_key'):
+            yield document_chunks
+            document_chunks = []
+        document_chunks.append(chunk_info)
+    if document_chunks:
+        yield document_chunks
+
 # Get the OpenAI embedding function
 func = get_registry().get("openai").create(name="text-embedding-3-large")
 
@@ -50,8 +105,11 @@ class ChunkMetadata(LanceModel):
     date: str | None
     item_type: str | None
     page_numbers: List[int] | None
+    parsed_date: str | None  # data znormalizowana do RRRR[-MM[-DD]] (utils/dates.py), na niej działają filtry dat
+    source_type: str | None  # "zotero" lub "web" (utils/web_source.py)
     title: str | None
-    zotero_key: str | None
+    url: str | None  # adres strony WWW
+    zotero_key: str | None  # dla stron WWW klucz utils.web_source.get_page_key
 
 # Define the main Schema
 class Chunks(LanceModel):
@@ -59,15 +117,82 @@ class Chunks(LanceModel):
     vector: Vector(func.ndims()) = func.VectorField()  # type: ignore
     metadata: ChunkMetadata
 
+# Schematy trybu parent_child: małe fragmenty potomne z embeddingami
+# i sekcje nadrzędne (bez wektorów), na które są rozwijane trafienia
+class ChildChunks(LanceModel):
+    text: str = func.SourceField()
+    vector: Vector(func.ndims()) = func.VectorField()  # type: ignore
+    metadata: ChunkMetadata
+    parent_id: str
+
+class ParentChunks(LanceModel):
+    text: str
+    metadata: ChunkMetadata
+    parent_id: str
+
+# Schemat partii wejściowych: wszystko poza wektorem, który dołącza embed_batch()
+INPUT_SCHEMA = pa.schema([field for field in Chunks.to_arrow_schema() if field.name != "vector"])
+CHILD_INPUT_SCHEMA = pa.schema([field for field in ChildChunks.to_arrow_schema() if field.name != "vector"])
+PARENT_SCHEMA = ParentChunks.to_arrow_schema()
+VECTOR_FIELD = Chunks.to_arrow_schema().field("vector")
+
+# Wartości brakujących pól metadanych w wierszach sprzed ich dodania
+MIGRATION_DEFAULTS = {"source_type": "zotero"}
+
+# Brakujące pola metadanych wyliczane z innego pola struktury (pole -> (źródło, funkcja))
+MIGRATION_DERIVED = {"parsed_date": ("date", parse_date)}
+
+def _missing_field(array, field: pa.Field):
+    """Wartości pola, którego nie ma w strukturze `array` (wyliczone lub domyślne)."""
+    if field.name in MIGRATION_DERIVED:
+        source, derive = MIGRATION_DERIVED[field.name]
+        if array.type.get_field_index(source) >= 0:
+            return pa.array([derive(value) for value in array.field(source).to_pylist()], field.type)
+    return pa.array([MIGRATION_DEFAULTS.get(field.name)] * len(array), field.type)
+
+def _conform(array, field: pa.Field):
+    """Dopasowuje kolumnę do typu pola; brakujące pola struktury wylicza, wypełnia domyślną wartością lub null."""
+    if pa.types.is_struct(field.type):
+        children = [
+            _conform(array.field(child.name), child) if array.type.get_field_index(child.name) >= 0
+            else _missing_field(array, child)
+            for child in field.type
+        ]
+        return pa.StructArray.from_arrays(children, fields=list(field.type), mask=array.is_null())
+    return array.cast(field.type)
+
+def migrate_table_schema(db, table, model):
+    """Dopasowuje tabelę utworzoną starszą wersją do bieżącego schematu (np. nowe pola metadanych).
+
+    Tabela jest przepisywana partiami z zachowaniem wektorów, więc embeddingi
+    nie są liczone ponownie. Indeksy odtwarza process_and_add_*() po dodaniu
+    fragmentów. Dodanie pól przez table.add_columns() nie wystarcza - filtry
+    na dodanych polach zagnieżdżonych nie działają przed kompakcją.
+    """
+    target = model.to_arrow_schema()
+    if table.schema.field("metadata").type == target.field("metadata").type:
+        return table
+    
+    print(f"Aktualizacja schematu tabeli {table.name} (nowe pola metadanych, bez ponownych embeddingów)...")
+    dataset = table.to_lance()
+    batches = (
+        pa.RecordBatch.from_arrays([_conform(batch.column(field.name), field) for field in target], schema=target)
+        for batch in dataset.to_batches(batch_size=SCAN_BATCH_SIZE)
+    )
+    # Odczyt idzie z wersji sprzed nadpisania, więc zapis do tej samej tabeli jest bezpieczny
+    return db.create_table(table.name, batches, schema=target, mode="overwrite")
+
 def create_embeddings():
     """Tworzy embeddingi z chunków i zapisuje do bazy LanceDB."""
-    chunks_data = load_zotero_chunks()
-    if not chunks_data:
+    if not os.path.exists(CHUNKS_MANIFEST_FILE) and not os.path.exists(CHUNKS_FILE):
         print("Brak fragmentów do przetworzenia. Uruchom najpierw 2-chunking.py")
         return None
 
     # Create a LanceDB database
     db = lancedb.connect("data/lancedb")
+    if MULTI_GRANULARITY:
+        return create_parent_child_embeddings(db)
+    resume = False
     
     # Sprawdź czy tabela już istnieje
     try:
@@ -77,11 +202,16 @@ def create_embeddings():
         print("Czy chcesz:")
         print("1. Użyć istniejącej bazy danych")
         print("2. Utworzyć nową bazę danych (nadpisze istniejącą)")
-        choice = input("Wybierz opcję (1/2): ").strip()
+        print("3. Dokończyć przerwane dodawanie (pomija już zapisane dokumenty)")
+        choice = input("Wybierz opcję (1/2/3): ").strip()
         
         if choice == "1":
             print("Używam istniejącej bazy danych.")
             return existing_table
+        elif choice == "3":
+            print("Wznawiam dodawanie do istniejącej bazy danych...")
+            table = migrate_table_schema(db, existing_table, Chunks)
+            resume = True
         else:
             print("Tworzę nową bazę danych...")
             table = db.create_table("docling", schema=Chunks, mode="overwrite")
@@ -89,72 +219,394 @@ def create_embeddings():
         print("Tworzę nową bazę danych...")
         table = db.create_table("docling", schema=Chunks, mode="overwrite")
     
-    return process_and_add_chunks(chunks_data, table)
+    return process_and_add_chunks(iter_zotero_documents_chunks(), table, resume=resume)
+
+def create_parent_child_embeddings(db):
+    """Tworzy tabele fragmentów potomnych i sekcji nadrzędnych (CHUNKING_MODE=parent_child)."""
+    resume = False
+    try:
+        child_table = db.open_table(CHILDREN_TABLE_NAME)
+        parent_table = db.open_table(PARENTS_TABLE_NAME)
+        print(f"\nZnaleziono istniejące tabele z {child_table.count_rows()} fragmentami potomnymi "
+              f"i {parent_table.count_rows()} sekcjami.")
+        print("Czy chcesz:")
+        print("1. Użyć istniejącej bazy danych")
+        print("2. Utworzyć nową bazę danych (nadpisze istniejącą)")
+        print("3. Dokończyć przerwane dodawanie (pomija już zapisane dokumenty)")
+        choice = input("Wybierz opcję (1/2/3): ").strip()
+        
+        if choice == "1":
+            print("Używam istniejącej bazy danych.")
+            return child_table
+        elif choice == "3":
+            print("Wznawiam dodawanie do istniejącej bazy danych...")
+            child_table = migrate_table_schema(db, child_table, ChildChunks)
+            parent_table = migrate_table_schema(db, parent_table, ParentChunks)
+            resume = True
+    except Exception:
+        pass
+    
+    if not resume:
+        print("Tworzę nową bazę danych (fragmenty potomne i sekcje nadrzędne)...")
+        child_table = db.create_table(CHILDREN_TABLE_NAME, schema=ChildChunks, mode="overwrite")
+        parent_table = db.create_table(PARENTS_TABLE_NAME, schema=ParentChunks, mode="overwrite")
+    
+    return process_and_add_parent_child_chunks(
+        iter_zotero_documents_chunks(), child_table, parent_table, resume=resume
+    )
+
+def sync_embeddings(stale_keys: Iterable[str] = (), rebuild: bool = False):
+    """Nieinteraktywna aktualizacja bazy (utils.pipeline).
+
+    Usuwa z tabel fragmenty dokumentów `stale_keys` (zmienione lub usunięte
+    z biblioteki) i dodaje fragmenty dokumentów, których brakuje w bazie,
+    tak jak opcja "3" w create_embeddings(). Przy `rebuild=True` tabele są
+    tworzone od nowa.
+    """
+    if not os.path.exists(CHUNKS_MANIFEST_FILE) and not os.path.exists(CHUNKS_FILE):
+        print("Brak fragmentów do przetworzenia. Uruchom najpierw 2-chunking.py")
+        return None
+
+    db = lancedb.connect("data/lancedb")
+    schemas = (
+        [(CHILDREN_TABLE_NAME, ChildChunks), (PARENTS_TABLE_NAME, ParentChunks)]
+        if MULTI_GRANULARITY else [("docling", Chunks)]
+    )
+    tables = []
+    for name, schema in schemas:
+        table = None
+        if not rebuild:
+            try:
+                table = db.open_table(name)
+            except Exception:
+                pass
+        if table is None:
+            print(f"Tworzę tabelę {name}...")
+            table = db.create_table(name, schema=schema, mode="overwrite")
+        else:
+            table = migrate_table_schema(db, table, schema)
+        tables.append(table)
+
+    stale_keys = sorted(set(stale_keys))
+    if stale_keys and not rebuild:
+        print(f"Usuwanie fragmentów {len(stale_keys)} zmienionych lub usuniętych dokumentów...")
+        keys = ", ".join(sql_literal(key) for key in stale_keys)
+        for table in tables:
+            table.delete(f"metadata.zotero_key IN ({keys})")
+
+    if MULTI_GRANULARITY:
+        return process_and_add_parent_child_chunks(iter_zotero_documents_chunks(), *tables, resume=True)
+    return process_and_add_chunks(iter_zotero_documents_chunks(), tables[0], resume=True)
+
+def format_creators(creators_list):
+    """Formatuje listę twórców do stringa."""
+    if not creators_list:
+        return None
+    
+    formatted = []
+    for creator in creators_list:
+        if isinstance(creator, dict):
+            name_parts = []
+            if 'firstName' in creator:
+                name_parts.append(creator['firstName'])
+            if 'lastName' in creator:
+                name_parts.append(creator['lastName'])
+            if name_parts:
+                formatted.append(' '.join(name_parts))
+        else:
+            formatted.append(str(creator))
+    
+    return ', '.join(formatted) if formatted else None
 
-def process_and_add_chunks(chunks_data, table):
-    """Przetwarza chunki i dodaje je do tabeli."""
+def get_page_numbers(chunk_info: Dict[str, Any]) -> List[int] | None:
+    """Zwraca numery stron chunka (wyliczone w 2-chunking.py lub z proweniencji)."""
+    if 'page_numbers' in chunk_info:
+        return chunk_info['page_numbers']
+    
+    # Starsze pliki cache nie mają wyliczonych numerów stron
+    page_numbers = sorted(
+        set(
+            prov.page_no
+            for item in chunk_info['chunk'].meta.doc_items
+            for prov in item.prov
+        )
+    )
+    return page_numbers or None
+
+def get_chunk_metadata(chunk_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Zwraca metadane fragmentu w układzie ChunkMetadata."""
+    return {
+        "zotero_key": chunk_info.get('zotero_key'),
+        "title": chunk_info.get('title'),
+        "creators": format_creators(chunk_info.get('creators')),
+        "date": chunk_info.get('date'),
+        "item_type": chunk_info.get('item_type'),
+        "page_numbers": get_page_numbers(chunk_info),
+        # Starsze pliki cache nie mają znormalizowanej daty
+        "parsed_date": chunk_info.get('parsed_date') or parse_date(chunk_info.get('date')),
+        "source_type": chunk_info.get('source_type', 'zotero'),
+        "url": chunk_info.get('url'),
+    }
+
+def get_existing_chunk_counts(table) -> Dict[str, int]:
+    """Zwraca liczbę zapisanych fragmentów dla każdego klucza Zotero."""
+    row_count = table.count_rows()
+    if row_count == 0:
+        return {}
+    
+    keys = (
+        table.search()
+        .select(["metadata"])
+        .limit(row_count)
+        .to_arrow()
+        .flatten()
+        .column("metadata.zotero_key")
+    )
+    return {
+        entry["values"].as_py(): entry["counts"].as_py()
+        for entry in keys.value_counts()
+    }
+
+def iter_chunk_batches(
+    documents_chunks: Iterable[List[Dict[str, Any]]],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    existing_counts: Dict[str, int] | None = None,
+    table=None,
+) -> Iterator[pa.RecordBatch]:
+    """Zamienia chunki na partie Arrow o stałym rozmiarze.
 
-    def format_creators(creators_list):
-        """Formatuje listę twórców do stringa."""
-        if not creators_list:
-            return None
+    Args:
+        documents_chunks: Chunki pogrupowane po dokumentach
+        batch_size: Liczba fragmentów w partii
+        existing_counts: Liczby fragmentów już zapisanych w tabeli (tryb wznawiania).
+            Kompletne dokumenty są pomijane, a niekompletne usuwane z `table`
+            i dodawane ponownie.
+        table: Tabela LanceDB (wymagana tylko w trybie wznawiania)
+    """
+    existing_counts = existing_counts or {}
+    texts = []
+    metadata = []
+    
+    for doc_chunks in documents_chunks:
+        if not doc_chunks:
+            continue
         
-        formatted = []
-        for creator in creators_list:
-            if isinstance(creator, dict):
-                name_parts = []
-                if 'firstName' in creator:
-                    name_parts.append(creator['firstName'])
-                if 'lastName' in creator:
-                    name_parts.append(creator['lastName'])
-                if name_parts:
-                    formatted.append(' '.join(name_parts))
-            else:
-                formatted.append(str(creator))
+        zotero_key = doc_chunks[0].get('zotero_key')
+        stored_count = existing_counts.get(zotero_key, 0)
+        if stored_count == len(doc_chunks):
+            continue
+        if stored_count:
+            # Dokument przerwany w połowie - usuń go i dodaj od nowa
+            table.delete(f"metadata.zotero_key = {sql_literal(zotero_key)}")
         
-        return ', '.join(formatted) if formatted else None
+        for chunk_info in doc_chunks:
+            texts.append(chunk_info['chunk'].text)
+            metadata.append(get_chunk_metadata(chunk_info))
+            
+            if len(texts) >= batch_size:
+                yield pa.RecordBatch.from_pydict({"text": texts, "metadata": metadata}, schema=INPUT_SCHEMA)
+                texts = []
+                metadata = []
+    
+    if texts:
+        yield pa.RecordBatch.from_pydict({"text": texts, "metadata": metadata}, schema=INPUT_SCHEMA)
+
+def embed_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Dołącza do partii kolumnę wektorów (jedno żądanie embeddingów na partię).
+
+    Wektory są liczone tutaj, a nie przez LanceDB w table.add(), żeby czas
+    żądań do API embeddingów i czas zapisu do bazy były mierzone osobno.
+    LanceDB nie liczy ponownie wektorów obecnych w partii.
+    """
+    texts = batch.column("text").to_pylist()
+    with metrics.span("embedding_request", chunks=len(texts)) as span:
+        vectors = func.compute_source_embeddings_with_retry(texts)
+        span["tokens"] = sum(len(get_encoding().encode(text, disallowed_special=())) for text in texts)
+    metrics.inc("embedding_tokens", span["tokens"])
+    metrics.inc("embedded_chunks", len(texts))
+    return batch.append_column(VECTOR_FIELD, pa.array(vectors, type=VECTOR_FIELD.type))
+
+def add_batch(table, batch: pa.RecordBatch):
+    """Zapisuje partię do tabeli LanceDB (jedna transakcja) i mierzy czas zapisu."""
+    with metrics.span("lancedb_write", table=table.name, rows=batch.num_rows):
+        table.add(batch)
+    metrics.inc("written_rows", batch.num_rows, table=table.name)
 
-    # Create table with processed chunks from Zotero
-    processed_chunks = []
-    print(f"Przetwarzanie {len(chunks_data)} fragmentów...")
+def update_document_tables(chunk_table):
+    """Przelicza wektory dokumentów i przyrostowo aktualizuje graf podobnych dokumentów."""
+    db = lancedb.connect("data/lancedb")
+    document_table = build_document_table(db, chunk_table)
+    if document_table is not None:
+        sync_related_items(db, document_table)
+
+def process_and_add_chunks(documents_chunks, table, batch_size: int = EMBEDDING_BATCH_SIZE, resume: bool = False):
+    """Przetwarza chunki i dodaje je do tabeli partiami.
+
+    Każda partia jest osobną transakcją, więc przerwane uruchomienie zachowuje
+    wszystkie zapisane wcześniej partie, a zużycie pamięci nie zależy od
+    rozmiaru biblioteki.
+
+    Args:
+        documents_chunks: Chunki pogrupowane po dokumentach (np. z iter_zotero_documents_chunks())
+        table: Tabela LanceDB
+        batch_size: Liczba fragmentów w jednej partii
+        resume: Czy pominąć dokumenty już zapisane w tabeli
+    """
+    existing_counts = get_existing_chunk_counts(table) if resume else {}
+    if existing_counts:
+        print(f"W bazie są już fragmenty {len(existing_counts)} dokumentów - zostaną pominięte")
     
-    for chunk_info in chunks_data:
-        chunk = chunk_info['chunk']
-        # Poprawka: metadane są bezpośrednio w chunk_info, nie w chunk_info['metadata']
-        
-        processed_chunk = {
-            "text": chunk.text,
-            "metadata": {
-                "zotero_key": chunk_info.get('zotero_key'),
-                "title": chunk_info.get('title'),
-                "creators": format_creators(chunk_info.get('creators')),
-                "date": chunk_info.get('date'),
-                "item_type": chunk_info.get('item_type'),
-                "page_numbers": [
-                    page_no
-                    for page_no in sorted(
-                        set(
-                            prov.page_no
-                            for item in chunk.meta.doc_items
-                            for prov in item.prov
-                        )
-                    )
-                ] or None,
-            },
-        }
-        processed_chunks.append(processed_chunk)
-
-    print(f"Przygotowano {len(processed_chunks)} fragmentów do dodania do bazy danych")
-    print("Dodawanie fragmentów do bazy danych (tworzenie embeddingów)...")
-    
-    # Add the chunks to the table (automatically embeds the text)
-    table.add(processed_chunks)
-    
-    print(f"Pomyślnie dodano {len(processed_chunks)} fragmentów do bazy danych")
+    print(f"Dodawanie fragmentów do bazy danych partiami po {batch_size} (tworzenie embeddingów)...")
+    added_count = 0
+    
+    with tqdm(desc="Embedding fragmentów", unit="fragm.") as pbar:
+        for batch in iter_chunk_batches(documents_chunks, batch_size, existing_counts, table):
+            # Embed the batch and add it to the table
+            add_batch(table, embed_batch(batch))
+            added_count += batch.num_rows
+            pbar.update(batch.num_rows)
+    
+    print(f"Pomyślnie dodano {added_count} fragmentów do bazy danych")
     print(f"Łączna liczba rekordów w bazie: {table.count_rows()}")
     
+    # Indeksy na metadanych (filtry autor/data/typ) i na treści (BM25)
+    print("Tworzenie indeksów...")
+    with metrics.span("indexing", table=table.name):
+        created = create_indexes(table)
+    print(f"Utworzono indeksy dla kolumn: {', '.join(created) or 'brak'}")
+    
+    # Wektory dokumentów dla wyszukiwania dwuetapowego i graf podobnych dokumentów
+    with metrics.span("document_tables"):
+        update_document_tables(table)
+    
+    # Każda partia tworzy nowy fragment i wersję tabeli - scal je po zakończeniu
+    if OPTIMIZE_AFTER_INGEST:
+        with metrics.span("optimize", table=table.name):
+            optimize_table(table)
+    
+    print(metrics.format_summary())
+    print(f"Metryki zapisano do {metrics.write_prometheus('embedding')}")
     return table
 
+def iter_parent_child_batches(
+    documents_chunks: Iterable[List[Dict[str, Any]]],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    existing_counts: Dict[str, int] | None = None,
+    child_table=None,
+    parent_table=None,
+    child_keys: Iterable[str] = (),
+) -> Iterator[tuple]:
+    """Zamienia chunki z fragmentami potomnymi na pary partii (dzieci, rodzice).
+
+    Partia dzieci ma ok. `batch_size` fragmentów; partia rodziców zawiera
+    sekcje, których dzieci są w tej lub wcześniejszych partiach. Tryb
+    wznawiania działa jak w iter_chunk_batches(), według liczby sekcji
+    zapisanych w `parent_table`; dokument niekompletny w `parent_table`,
+    a obecny w `child_table` (`child_keys` - przerwanie między zapisem
+    dzieci i rodziców), jest usuwany z obu tabel i dodawany od nowa.
+    """
+    existing_counts = existing_counts or {}
+    child_keys = set(child_keys)
+    children = {"text": [], "metadata": [], "parent_id": []}
+    parents = {"text": [], "metadata": [], "parent_id": []}
+    
+    def flush():
+        batches = (
+            pa.RecordBatch.from_pydict(children, schema=CHILD_INPUT_SCHEMA),
+            pa.RecordBatch.from_pydict(parents, schema=PARENT_SCHEMA),
+        )
+        for rows in (children, parents):
+            for column in rows.values():
+                column.clear()
+        return batches
+    
+    for doc_chunks in documents_chunks:
+        if not doc_chunks:
+            continue
+        
+        zotero_key = doc_chunks[0].get('zotero_key')
+        stored_count = existing_counts.get(zotero_key, 0)
+        if stored_count == len(doc_chunks):
+            continue
+        if stored_count or zotero_key in child_keys:
+            # Dokument przerwany w połowie (także same dzieci bez rodziców) - usuń go z obu tabel i dodaj od nowa
+            for table in (child_table, parent_table):
+                table.delete(f"metadata.zotero_key = {sql_literal(zotero_key)}")
+        
+        for chunk_info in doc_chunks:
+            if 'children' not in chunk_info:
+                raise ValueError(
+                    "Chunki nie mają fragmentów potomnych - uruchom 2-chunking.py z CHUNKING_MODE=parent_child"
+                )
+            metadata = get_chunk_metadata(chunk_info)
+            for child_text in chunk_info['children']:
+                children["text"].append(child_text)
+                children["metadata"].append(metadata)
+                children["parent_id"].append(chunk_info['parent_id'])
+            parents["text"].append(chunk_info['chunk'].text)
+            parents["metadata"].append(metadata)
+            parents["parent_id"].append(chunk_info['parent_id'])
+            
+            if len(children["text"]) >= batch_size:
+                yield flush()
+    
+    if parents["text"]:
+        yield flush()
+
+def process_and_add_parent_child_chunks(
+    documents_chunks,
+    child_table,
+    parent_table,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    resume: bool = False,
+):
+    """Dodaje fragmenty potomne (z embeddingami) i sekcje nadrzędne partiami.
+
+    Dzieci każdej partii są zapisywane przed rodzicami, więc sekcja obecna
+    w `parent_table` zawsze ma komplet dzieci (na tym opiera się wznawianie).
+    Przerwanie między oboma zapisami zostawia dzieci bez rodziców; przy
+    wznawianiu takie dokumenty są usuwane z obu tabel i dodawane od nowa.
+    """
+    existing_counts = get_existing_chunk_counts(parent_table) if resume else {}
+    child_keys = get_existing_chunk_counts(child_table).keys() if resume else ()
+    if existing_counts:
+        print(f"W bazie są już fragmenty {len(existing_counts)} dokumentów - zostaną pominięte")
+    
+    print(f"Dodawanie fragmentów potomnych partiami po ok. {batch_size} (tworzenie embeddingów)...")
+    child_count = 0
+    parent_count = 0
+    
+    with tqdm(desc="Embedding fragmentów potomnych", unit="fragm.") as pbar:
+        for child_batch, parent_batch in iter_parent_child_batches(
+            documents_chunks, batch_size, existing_counts, child_table, parent_table, child_keys
+        ):
+            if child_batch.num_rows:
+                add_batch(child_table, embed_batch(child_batch))
+            add_batch(parent_table, parent_batch)
+            child_count += child_batch.num_rows
+            parent_count += parent_batch.num_rows
+            pbar.update(child_batch.num_rows)
+    
+    print(f"Pomyślnie dodano {child_count} fragmentów potomnych i {parent_count} sekcji nadrzędnych")
+    
+    print("Tworzenie indeksów...")
+    with metrics.span("indexing", table=child_table.name):
+        created = create_indexes(child_table)
+        parent_table.create_scalar_index("parent_id", index_type="BTREE", replace=True)
+    print(f"Utworzono indeksy dla kolumn: {', '.join(created) or 'brak'}")
+    
+    with metrics.span("document_tables"):
+        update_document_tables(child_table)
+    
+    if OPTIMIZE_AFTER_INGEST:
+        with metrics.span("optimize", table=child_table.name):
+            optimize_table(child_table)
+            optimize_table(parent_table)
+    
+    print(metrics.format_summary())
+    print(f"Metryki zapisano do {metrics.write_prometheus('embedding')}")
+    return child_table
+
 # --------------------------------------------------------------
 # Main execution
 # --------------------------------------------------------------
@@ -164,6 +616,6 @@ if __name__ == "__main__":
     if table:
         print("\nBaza danych embeddingów jest gotowa do użycia!")
         print(f"Ścieżka do bazy: data/lancedb")
-        print(f"Nazwa tabeli: docling")
+        print(f"Nazwa tabeli: {table.name}")
     else:
         print("Nie udało się utworzyć bazy danych embeddingów.")
@@ -1,96 +1,265 @@
-import lancedb
-import pandas as pd
-from typing import List, Dict, Any
+import argparse
+from typing import Callable, List, Optional
+
+from utils.dates import DATE_COLUMN, date_range_conditions
+from utils.indexes import has_trigram_index, sql_literal
+from utils.metrics import metrics
+from utils.query_cache import format_cache_stats
+from utils.document_index import DOCUMENTS_TABLE_NAME
+from utils.retrieval import DEFAULT_QUERY_TYPE, RESULT_COLUMNS, SearchHit, filter_hits, hits_from_arrow, search_hits
 
 # --------------------------------------------------------------
 # Connect to the database
 # --------------------------------------------------------------
 
 uri = "data/lancedb"
-db = lancedb.connect(uri)
 
-# --------------------------------------------------------------
-# Load the table
-# --------------------------------------------------------------
+# Połączenie i tabele są otwierane przy pierwszym użyciu, więc import modułu
+# nie ładuje LanceDB (pandas, pyarrow.dataset) ani nie dotyka dysku
+db = None
+table = None
+
+# Tabela wektorów dokumentów (wyszukiwanie dwuetapowe)
+documents_table = None
+
+# Ile fragmentów na szukany dokument pobierać na początek przy wyszukiwaniu dokumentów po metadanych
+DOCUMENT_CANDIDATES = 20
 
-table = db.open_table("docling")
+def get_db():
+    """Łączy się z bazą LanceDB przy pierwszym użyciu."""
+    global db
+    if db is None:
+        import lancedb
+
+        db = lancedb.connect(uri)
+    return db
+
+def get_table():
+    """Otwiera tabelę fragmentów przy pierwszym użyciu."""
+    global table
+    if table is None:
+        table = get_db().open_table("docling")
+    return table
+
+def get_documents_table():
+    """Otwiera tabelę wektorów dokumentów tworzoną przez 3-embedding.py."""
+    global documents_table
+    if documents_table is None:
+        documents_table = get_db().open_table(DOCUMENTS_TABLE_NAME)
+    return documents_table
 
 # --------------------------------------------------------------
 # Search functions
 # --------------------------------------------------------------
 
-def search_zotero_knowledge_base(query: str, limit: int = 5) -> pd.DataFrame:
-    """Wyszukuje w bazie wiedzy Zotero i zwraca wyniki z metadanymi."""
+def search_zotero_knowledge_base(
+    query: str,
+    limit: int = 5,
+    where: Optional[str] = None,
+    query_type: str = DEFAULT_QUERY_TYPE,
+    mmr: bool = False,
+    max_per_document: Optional[int] = None,
+    two_stage: bool = False,
+) -> List[SearchHit]:
+    """Wyszukuje w bazie wiedzy Zotero i zwraca wyniki z metadanymi.
+
+    Args:
+        query: Zapytanie użytkownika
+        limit: Liczba wyników
+        where: Opcjonalny filtr SQL na metadanych, stosowany przed wyszukiwaniem
+        query_type: "vector", "fts" lub "hybrid" (BM25 + wektory połączone przez RRF)
+        mmr: Czy różnicować wyniki metodą maximal marginal relevance
+        max_per_document: Maksymalna liczba fragmentów z jednego dokumentu
+        two_stage: Czy najpierw wybrać najbliższe dokumenty, a potem szukać tylko w ich fragmentach
+    """
     print(f"Wyszukiwanie: '{query}'")
     print("-" * 50)
     
-    result = table.search(query=query, query_type="vector").limit(limit)
-    df = result.to_pandas()
+    hits = search_hits(
+        get_table(), query, limit, query_type, where, mmr=mmr, max_per_document=max_per_document,
+        document_table=get_documents_table() if two_stage else None,
+    )
     
-    if df.empty:
+    if not hits:
         print("Nie znaleziono wyników.")
-        return df
+        return hits
     
     # Wyświetl wyniki w czytelnej formie
-    for i, row in df.iterrows():
+    for i, hit in enumerate(hits):
         print(f"\n=== Wynik {i+1} ===")
-        print(f"Tytuł: {row['metadata']['title'] or 'Brak tytułu'}")
-        print(f"Autorzy: {row['metadata']['creators'] or 'Brak autorów'}")
-        print(f"Data: {row['metadata']['date'] or 'Brak daty'}")
-        print(f"Typ: {row['metadata']['item_type'] or 'Nieznany'}")
-        print(f"Strony: {row['metadata']['page_numbers'] or 'Brak informacji o stronach'}")
-        print(f"Klucz Zotero: {row['metadata']['zotero_key'] or 'Brak klucza'}")
+        print(f"Tytuł: {hit.title or 'Brak tytułu'}")
+        print(f"Autorzy: {hit.creators or 'Brak autorów'}")
+        print(f"Data: {hit.date or 'Brak daty'}")
+        print(f"Typ: {hit.item_type or 'Nieznany'}")
+        print(f"Strony: {hit.page_numbers or 'Brak informacji o stronach'}")
+        print(f"Klucz Zotero: {hit.zotero_key or 'Brak klucza'}")
         print(f"\nTreść fragmentu:")
-        print(f"{row['text'][:300]}{'...' if len(row['text']) > 300 else ''}")
+        print(f"{hit.text[:300]}{'...' if len(hit.text) > 300 else ''}")
         print("-" * 50)
     
-    return df
+    print(format_cache_stats())
+    return hits
 
-def search_by_author(author: str, limit: int = 5) -> pd.DataFrame:
-    """Wyszukuje dokumenty według autora."""
+def print_documents(hits: List[SearchHit]):
+    """Wyświetla listę dokumentów zwróconych przez wyszukiwanie po metadanych."""
+    for i, hit in enumerate(hits):
+        print(f"\n=== Dokument {i+1} ===")
+        print(f"Tytuł: {hit.title or 'Brak tytułu'}")
+        print(f"Autorzy: {hit.creators or 'Brak autorów'}")
+        print(f"Data: {hit.date or 'Brak daty'}")
+        print(f"Typ: {hit.item_type or 'Nieznany'}")
+        print("-" * 30)
+
+def first_per_document(fetch: Callable[[int], List[SearchHit]], limit: int,
+                       keep: Callable[[SearchHit], bool] = lambda hit: True) -> List[SearchHit]:
+    """Zwraca pierwszy fragment każdego z `limit` dokumentów.
+
+    `fetch(n)` zwraca n pierwszych fragmentów; dokument ma wiele fragmentów,
+    więc n rośnie, aż wystarczy dokumentów albo fragmenty się skończą.
+    """
+    count = max(limit, 1) * DOCUMENT_CANDIDATES
+    while True:
+        hits = fetch(count)
+        documents = {}
+        for hit in hits:
+            if keep(hit):
+                documents.setdefault(hit.zotero_key or hit.chunk_id, hit)
+        if len(documents) >= limit or len(hits) < count:
+            return list(documents.values())[:limit]
+        count *= 4
+
+def search_by_author(author: str, limit: int = 5) -> List[SearchHit]:
+    """Wyszukuje dokumenty według autora (podciąg pola autorów, bez rozróżniania wielkości liter).
+
+    Kandydatów zwraca indeks FTS na metadata.creators (trigramy), a warunek
+    podciągu sprawdzany jest tylko na nich, więc koszt nie rośnie z liczbą
+    fragmentów w tabeli. Bez takiego indeksu (utils.maintenance odtwarza
+    indeksy) lub dla zapytań krótszych niż trigram filtr LIKE skanuje tabelę.
+    """
     print(f"Wyszukiwanie dokumentów autora: '{author}'")
     print("-" * 50)
     
-    # Wyszukiwanie w metadanych autorów
-    result = table.search(query=author, query_type="vector").limit(limit * 2)
-    df = result.to_pandas()
+    needle = author.strip().lower()
+    hits = None
+    if len(needle) >= 3 and has_trigram_index(get_table(), "metadata.creators"):
+        try:
+            hits = first_per_document(
+                lambda count: hits_from_arrow(
+                    get_table().search(needle, query_type="fts", fts_columns="metadata.creators")
+                    .select(RESULT_COLUMNS)
+                    .limit(count)
+                    .to_arrow()
+                ),
+                limit,
+                # Trigramy zapytania mogą wystąpić osobno - wynikiem są tylko dokładne podciągi
+                keep=lambda hit: needle in (hit.creators or "").lower(),
+            )
+        except Exception as e:
+            print(f"  ⚠ Wyszukiwanie przez indeks autorów nie powiodło się ({e}), filtruję całą tabelę")
+    if hits is None:
+        where = f"lower(metadata.creators) LIKE {sql_literal('%' + needle + '%')}"
+        hits = first_per_document(lambda count: filter_hits(get_table(), where, count), limit)
     
-    if df.empty:
-        print("Nie znaleziono wyników.")
-        return df
+    if not hits:
+        print("Nie znaleziono dokumentów tego autora.")
+        return hits
+    
+    print_documents(hits)
+    return hits
+
+def search_by_date_range(start: Optional[str] = None, end: Optional[str] = None, limit: int = 5) -> List[SearchHit]:
+    """Wyszukuje dokumenty z datą publikacji w zakresie [start, end].
+
+    Pole daty Zotero jest dowolnym tekstem ("15.03.2019", "March 2019"),
+    dlatego filtr działa na dacie znormalizowanej przy ekstrakcji
+    (`metadata.parsed_date`, utils/dates.py). Granice podaje się jako
+    RRRR, RRRR-MM lub RRRR-MM-DD.
+    """
+    print(f"Wyszukiwanie dokumentów z zakresu dat: {start or '...'} - {end or '...'}")
+    print("-" * 50)
     
-    # Filtruj wyniki zawierające autora w metadanych
-    filtered_df = df[df['metadata'].apply(
-        lambda x: author.lower() in (x.get('creators') or '').lower()
-    )].head(limit)
+    conditions = date_range_conditions(start, end) or [f"{DATE_COLUMN} IS NOT NULL"]
+    where = " AND ".join(conditions)
+    hits = first_per_document(lambda count: filter_hits(get_table(), where, count), limit)
     
-    if filtered_df.empty:
-        print("Nie znaleziono dokumentów tego autora.")
-        return filtered_df
+    if not hits:
+        print("Nie znaleziono dokumentów z tego zakresu dat.")
+        return hits
     
-    for i, row in filtered_df.iterrows():
-        print(f"\n=== Dokument {i+1} ===")
-        print(f"Tytuł: {row['metadata']['title'] or 'Brak tytułu'}")
-        print(f"Autorzy: {row['metadata']['creators'] or 'Brak autorów'}")
-        print(f"Data: {row['metadata']['date'] or 'Brak daty'}")
-        print("-" * 30)
+    print_documents(hits)
+    return hits
+
+def search_by_item_type(item_type: str, limit: int = 5) -> List[SearchHit]:
+    """Wyszukuje dokumenty według typu elementu Zotero (np. journalArticle)."""
+    print(f"Wyszukiwanie dokumentów typu: '{item_type}'")
+    print("-" * 50)
+    
+    where = f"metadata.item_type = {sql_literal(item_type)}"
+    hits = first_per_document(lambda count: filter_hits(get_table(), where, count), limit)
     
-    return filtered_df
+    if not hits:
+        print("Nie znaleziono dokumentów tego typu.")
+        return hits
+    
+    print_documents(hits)
+    return hits
 
 # --------------------------------------------------------------
-# Example searches
+# Command line
 # --------------------------------------------------------------
 
-if __name__ == "__main__":
-    # Przykładowe wyszukiwania
+def run_examples():
+    """Przykładowe wyszukiwania (uruchomienie bez argumentów)."""
     print("=== WYSZUKIWANIE W BAZIE WIEDZY ZOTERO ===")
-    print(f"Liczba dokumentów w bazie: {table.count_rows()}")
+    print(f"Liczba dokumentów w bazie: {get_table().count_rows()}")
     print()
     
     # Wyszukiwanie ogólne
-    search_results = search_zotero_knowledge_base("machine learning", limit=3)
+    search_zotero_knowledge_base("machine learning", limit=3)
     
     print("\n" + "=" * 60)
     
     # Wyszukiwanie według autora (przykład)
     # author_results = search_by_author("Smith", limit=3)
+    
+    # Wyszukiwanie według daty i typu (przykład)
+    # date_results = search_by_date_range("2018", "2020", limit=3)
+    # type_results = search_by_item_type("journalArticle", limit=3)
+
+def main(argv: Optional[List[str]] = None):
+    global uri
+
+    parser = argparse.ArgumentParser(description="Wyszukiwanie w bazie wiedzy Zotero")
+    parser.add_argument("query", nargs="?", help="Zapytanie (bez zapytania uruchamiane są przykłady)")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--type", dest="query_type", choices=["vector", "fts", "hybrid"], default=DEFAULT_QUERY_TYPE)
+    parser.add_argument("--where", help="Filtr SQL na metadanych, np. \"metadata.parsed_date >= '2019'\"")
+    parser.add_argument("--mmr", action="store_true", help="Różnicuj wyniki metodą MMR")
+    parser.add_argument("--max-per-document", type=int)
+    parser.add_argument("--two-stage", action="store_true", help="Najpierw wybierz dokumenty, potem fragmenty")
+    parser.add_argument("--author", help="Szukaj dokumentów autora zamiast fragmentów")
+    parser.add_argument("--item-type", help="Szukaj dokumentów danego typu Zotero")
+    parser.add_argument("--db", default=uri, help="Ścieżka do bazy LanceDB")
+    parser.add_argument("--summary", action="store_true", help="Wypisz i zapisz metryki wyszukiwania")
+    args = parser.parse_args(argv)
+    uri = args.db
+
+    if args.author:
+        search_by_author(args.author, limit=args.limit)
+    elif args.item_type:
+        search_by_item_type(args.item_type, limit=args.limit)
+    elif args.query:
+        search_zotero_knowledge_base(
+            args.query, limit=args.limit, where=args.where, query_type=args.query_type,
+            mmr=args.mmr, max_per_document=args.max_per_document, two_stage=args.two_stage,
+        )
+    else:
+        run_examples()
+        args.summary = True
+
+    if args.summary:
+        print(metrics.format_summary())
+        metrics.write_prometheus("search")
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,172 @@
+import html
+import json
+import os
+from typing import Any, Dict, Iterator, List, Tuple
+
+import requests
 import streamlit as st
-import lancedb
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI()
+# Retrieval and the LLM call run in the service (python -m utils.service);
+# this app only renders the conversation
+SERVICE_URL = os.getenv("ZOTERO_RAG_SERVICE_URL", "http://127.0.0.1:8080")
+SERVICE_TIMEOUT = float(os.getenv("ZOTERO_RAG_SERVICE_TIMEOUT", "120"))
+# API key of the service (SERVICE_API_KEYS_FILE); its groups decide which libraries can be searched
+SERVICE_API_KEY = os.getenv("ZOTERO_RAG_SERVICE_API_KEY", "")
 
 
-# Initialize LanceDB connection
 @st.cache_resource
-def init_db():
-    """Initialize database connection.
+def init_session() -> requests.Session:
+    """Create an HTTP session shared by all app reruns (keeps connections to the service open).
+
+    Returns:
+        requests.Session object
+    """
+    session = requests.Session()
+    if SERVICE_API_KEY:
+        session.headers["Authorization"] = f"Bearer {SERVICE_API_KEY}"
+    return session
+
+
+def select_libraries(session: requests.Session) -> List[str]:
+    """Let the user pick the libraries to search, from those the service allows for this API key.
 
     Returns:
-        LanceDB table object
+        Names of the selected libraries (empty - all accessible libraries)
     """
-    db = lancedb.connect("data/lancedb")
-    return db.open_table("docling")
+    try:
+        libraries = session.get(f"{SERVICE_URL}/libraries", timeout=5).json()["libraries"]
+    except (requests.RequestException, ValueError, KeyError):
+        return []
+    if len(libraries) <= 1:
+        return []
 
+    with st.sidebar:
+        return st.multiselect("Libraries", libraries, default=libraries)
 
-def get_context(query: str, table, num_results: int = 5) -> str:
-    """Search the database for relevant context from Zotero documents.
+
+def iter_sse(response: requests.Response) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Parse a Server-Sent Events response into (event, data) pairs.
 
     Args:
-        query: User's question
-        table: LanceDB table object
-        num_results: Number of results to return
+        response: Streaming HTTP response from the service
 
-    Returns:
-        str: Concatenated context from relevant chunks with Zotero source information
+    Yields:
+        Event name and its JSON payload
     """
-    results = table.search(query).limit(num_results).to_pandas()
-    contexts = []
-
-    for _, row in results.iterrows():
-        # Extract Zotero metadata
-        title = row["metadata"]["title"]
-        creators = row["metadata"]["creators"]
-        date = row["metadata"]["date"]
-        item_type = row["metadata"]["item_type"]
-        page_numbers = row["metadata"]["page_numbers"]
-        zotero_key = row["metadata"]["zotero_key"]
-
-        # Build source citation for Zotero document
-        source_parts = []
-        if title:
-            source_parts.append(title)
-        if creators:
-            source_parts.append(f"by {creators}")
-        if date:
-            source_parts.append(f"({date})")
-        if item_type:
-            source_parts.append(f"[{item_type}]")
-        if page_numbers:
-            source_parts.append(f"p. {', '.join(str(p) for p in page_numbers)}")
-
-        source = f"\nSource: {' '.join(source_parts)}"
-        if zotero_key:
-            source += f"\nZotero Key: {zotero_key}"
-
-        contexts.append(f"{row['text']}{source}")
-
-    return "\n\n".join(contexts)
-
-
-def get_chat_response(messages, context: str) -> str:
-    """Get streaming response from OpenAI API.
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+def start_chat(
+    session: requests.Session, messages: List[Dict[str, str]], memory: Dict[str, Any], libraries: List[str]
+) -> Tuple[Dict[str, Any], Iterator]:
+    """Send the conversation to the service and wait for the retrieved context.
 
     Args:
-        messages: Chat history
-        context: Retrieved context from database
+        session: Shared HTTP session
+        messages: Chat history ending with the user's question
+        memory: Conversation memory returned by the previous turn (summary of older turns)
+        libraries: Libraries to search (empty - all accessible libraries)
 
     Returns:
-        str: Model's response
+        The `context` event payload (hits, context token count, related papers)
+        and the iterator over the remaining events
+    """
+    body = {"messages": messages, "memory": memory}
+    if libraries:
+        body["libraries"] = libraries
+    response = session.post(f"{SERVICE_URL}/chat", json=body, stream=True, timeout=SERVICE_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f"Service error {response.status_code}: {response.text}")
+
+    events = iter_sse(response)
+    for event, data in events:
+        if event == "context":
+            return data, events
+        if event == "error":
+            raise RuntimeError(data["error"])
+    raise RuntimeError("Service closed the stream before sending context")
+
+
+def iter_answer(events: Iterator[Tuple[str, Dict[str, Any]]]) -> Iterator[str]:
+    """Yield answer tokens from the service event stream (for st.write_stream).
+
+    The updated conversation memory from the final event is kept in the
+    session state for the next question.
     """
-    system_prompt = f"""You are a helpful assistant that answers questions based on documents from a Zotero library.
-    Use only the information from the provided context to answer questions. When citing information,
-    reference the source document (title, authors, date) when available. If you're unsure or the context
-    doesn't contain the relevant information, say so clearly.
-    
-    Context from Zotero library:
-    {context}
+    for event, data in events:
+        if event == "token":
+            yield data["text"]
+        elif event == "error":
+            yield f"\n\n*Error: {data['error']}*"
+        elif event == "done":
+            st.session_state.memory = data["memory"]
+            print(
+                f"[chat] retrieval {data['retrieval_ms']:.0f} ms, first token "
+                f"{data['first_token_ms'] or 0:.0f} ms, total {data['total_ms']:.0f} ms, "
+                f"history {data['history_tokens']} tokens{' (cached answer)' if data.get('cached') else ''}"
+            )
+
+
+def format_hit_reference(hit: Dict[str, Any]) -> str:
+    """Return the HTML reference line of a search hit: a link for web pages, the Zotero key otherwise."""
+    library = f'Library: {html.escape(hit["library"])} · ' if hit.get("library") else ""
+    if hit.get("url"):
+        url = html.escape(hit["url"])
+        return f'{library}URL: <a href="{url}" target="_blank">{url}</a>'
+    return f'{library}Zotero Key: {html.escape(hit["zotero_key"] or "")}'
+
+
+def render_similar_papers(related: List[Dict[str, Any]]):
+    """Show papers similar to the documents the answer is based on.
+
+    Neighbours come from the precomputed graph (utils.related_items), looked
+    up by the service together with the context.
     """
+    if not related:
+        return
 
-    messages_with_context = [{"role": "system", "content": system_prompt}, *messages]
+    with st.expander("Similar papers"):
+        for entry in related:
+            st.markdown(f"**{entry['title'] or entry['zotero_key']}**")
+            st.markdown(
+                "\n".join(
+                    f"- {item['neighbor_title'] or item['neighbor_key']}"
+                    + (f" ({item['neighbor_date']})" if item["neighbor_date"] else "")
+                    + f" · Zotero Key: `{item['neighbor_key']}` · similarity {item['score']:.2f}"
+                    for item in entry["items"]
+                )
+            )
 
-    # Create the streaming response
-    stream = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages_with_context,
-        temperature=0.7,
-        stream=True,
-    )
 
-    # Use Streamlit's built-in streaming capability
-    response = st.write_stream(stream)
-    return response
+def render_cache_stats(session: requests.Session):
+    """Show query-embedding and search-result cache hit rates in the sidebar."""
+    try:
+        stats = session.get(f"{SERVICE_URL}/stats", timeout=5).json()["cache"]
+    except (requests.RequestException, ValueError, KeyError):
+        return
+
+    with st.sidebar:
+        st.subheader("Cache")
+        for name, label in [("embeddings", "Query embeddings"), ("results", "Search results"), ("answers", "Answers")]:
+            entry = stats[name]
+            st.metric(
+                label,
+                f"{entry['hit_rate']:.0%}",
+                help=f"{entry['hits']} hits, {entry['misses']} misses",
+            )
 
 
 # Initialize Streamlit app
@@ -108,9 +176,12 @@ st.markdown("*Ask questions about your Zotero library documents*")
 # Initialize session state for chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "memory" not in st.session_state:
+    st.session_state.memory = {}
 
-# Initialize database connection
-table = init_db()
+# Initialize the connection to the retrieval service
+session = init_session()
+libraries = select_libraries(session)
 
 # Display chat messages
 for message in st.session_state.messages:
@@ -128,7 +199,12 @@ if prompt := st.chat_input("Ask a question about the document"):
 
     # Get relevant context
     with st.status("Searching document...", expanded=False) as status:
-        context = get_context(prompt, table)
+        try:
+            context, events = start_chat(session, st.session_state.messages, st.session_state.memory, libraries)
+        except (requests.RequestException, RuntimeError) as e:
+            st.error(f"Cannot reach the retrieval service at {SERVICE_URL}: {e}")
+            st.stop()
+
         st.markdown(
             """
             <style>
@@ -156,37 +232,31 @@ if prompt := st.chat_input("Ask a question about the document"):
             unsafe_allow_html=True,
         )
 
-        st.write("Found relevant sections from Zotero library:")
-        for chunk in context.split("\n\n"):
-            # Split into text and metadata parts
-            parts = chunk.split("\n")
-            text = parts[0]
-            metadata = {
-                line.split(": ")[0]: line.split(": ")[1]
-                for line in parts[1:]
-                if ": " in line
-            }
-
-            source = metadata.get("Source", "Unknown source")
-            zotero_key = metadata.get("Zotero Key", "")
-
+        if context["query"] != prompt:
+            st.write(f"Search query: *{context['query']}*")
+        st.write(f"Found relevant sections from Zotero library ({context['context_tokens']} context tokens):")
+        for hit in context["hits"]:
             st.markdown(
                 f"""
                 <div class="search-result">
                     <details>
-                        <summary>{source}</summary>
-                        <div class="metadata">Zotero Key: {zotero_key}</div>
-                        <div style="margin-top: 8px;">{text}</div>
+                        <summary>{html.escape(hit["source"] or "Unknown source")}</summary>
+                        <div class="metadata">{format_hit_reference(hit)}</div>
+                        <div style="margin-top: 8px;">{html.escape(hit["text"])}</div>
                     </details>
                 </div>
             """,
                 unsafe_allow_html=True,
             )
 
+    render_similar_papers(context["related"])
+
     # Display assistant response first
     with st.chat_message("assistant"):
-        # Get model response with streaming
-        response = get_chat_response(st.session_state.messages, context)
+        # Stream the model response relayed by the service
+        response = st.write_stream(iter_answer(events))
 
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": response})
+
+render_cache_stats(session)
@@ -0,0 +1,76 @@
+"""Throughput benchmark for batch search.
+
+Compares queries per second of a plain per-query loop, parallel LanceDB
+queries and the vectorized matrix search for batch sizes from 1 to 1024.
+Query vectors are sampled from the table (with a little noise), so the
+benchmark does not call the embeddings API.
+
+Usage:
+    python -m benchmarks.batch_search_bench --sizes 1 4 16 64 256 1024
+"""
+import argparse
+import json
+import time
+
+import lancedb
+import numpy as np
+
+from utils.batch_search import batch_vector_search
+from utils.retrieval import vector_search
+
+DEFAULT_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+def sample_query_vectors(table, count: int, seed: int = 0) -> np.ndarray:
+    """Sample stored vectors and perturb them slightly to use as queries."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(count, table.count_rows())
+    vectors = table.search().select(["vector"]).limit(sample_size).to_arrow().column("vector")
+    matrix = vectors.flatten().to_numpy().reshape(len(vectors), -1)
+    matrix = matrix[rng.integers(0, len(matrix), size=count)]
+    matrix = matrix + rng.normal(scale=0.01, size=matrix.shape).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def run_loop(table, vectors, limit):
+    for vector in vectors:
+        vector_search(table, vector.tolist(), limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch search throughput benchmark")
+    parser.add_argument("--db", default="data/lancedb")
+    parser.add_argument("--table", default="docling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--methods", nargs="+", default=["loop", "parallel", "matrix"])
+    parser.add_argument("--output", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    table = lancedb.connect(args.db).open_table(args.table)
+    all_vectors = sample_query_vectors(table, max(args.sizes))
+    print(f"Table '{args.table}': {table.count_rows()} rows, limit={args.limit}")
+    print(f"{'batch':>6}" + "".join(f"{method + ' q/s':>16}" for method in args.methods))
+
+    results = []
+    for size in args.sizes:
+        vectors = all_vectors[:size]
+        row = {"batch_size": size}
+        for method in args.methods:
+            start = time.perf_counter()
+            if method == "loop":
+                run_loop(table, vectors, args.limit)
+            else:
+                batch_vector_search(table, vectors, args.limit, method=method)
+            elapsed = time.perf_counter() - start
+            row[method] = size / elapsed
+        results.append(row)
+        print(f"{size:>6}" + "".join(f"{row[method]:>16.1f}" for method in args.methods))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"rows": table.count_rows(), "limit": args.limit, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Tokens sent to the LLM per turn: managed conversation memory vs full history.
+
+Simulates a long conversation with a fake chat client (no network): each
+turn the question is condensed, the history is trimmed to
+HISTORY_TOKEN_BUDGET (utils.conversation) and overflowing turns are folded
+into the summary. Prints prompt tokens per turn (answer, condensation and
+summary calls) for the managed history and for sending the full history,
+as the chat did before.
+
+Usage:
+    python -m benchmarks.conversation_bench --turns 50 --answer-words 250
+"""
+import argparse
+import asyncio
+import random
+from types import SimpleNamespace
+
+from utils.context_packer import count_tokens
+from utils.conversation import (
+    HISTORY_TOKEN_BUDGET,
+    ConversationState,
+    build_history,
+    condense_query,
+    message_tokens,
+    update_summary,
+)
+
+WORDS = ("protein folding membrane receptor kinase pathway cohort trial dose response "
+         "expression sequencing variant mutation phenotype model analysis study").split()
+
+
+class FakeChatClient:
+    """Counts prompt tokens and returns short fixed-size completions."""
+
+    def __init__(self, summary_words: int = 150):
+        self.prompt_tokens = 0
+        self.summary_words = summary_words
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages, **kwargs):
+        self.prompt_tokens += sum(message_tokens(message) for message in messages)
+        words = min(kwargs.get("max_tokens") or 50, self.summary_words)
+        content = " ".join(random.choice(WORDS) for _ in range(words))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def random_text(words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(words)) + "."
+
+
+async def simulate(turns: int, question_words: int, answer_words: int, budget: int):
+    client = FakeChatClient()
+    messages = []
+    state = ConversationState()
+    rows = []
+
+    for turn in range(1, turns + 1):
+        messages.append({"role": "user", "content": random_text(question_words)})
+        before = client.prompt_tokens
+
+        await condense_query(client, messages, state)
+        history, overflow = build_history(messages, state, budget)
+        answer_prompt = sum(message_tokens(message) for message in history)
+        full_prompt = sum(message_tokens(message) for message in messages)
+        state = await update_summary(client, state, overflow)
+
+        rows.append((turn, answer_prompt, client.prompt_tokens - before, full_prompt))
+        messages.append({"role": "assistant", "content": random_text(answer_words)})
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation memory token usage benchmark")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--question-words", type=int, default=20)
+    parser.add_argument("--answer-words", type=int, default=250)
+    parser.add_argument("--budget", type=int, default=HISTORY_TOKEN_BUDGET)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rows = asyncio.run(simulate(args.turns, args.question_words, args.answer_words, args.budget))
+
+    print(f"History budget: {args.budget} tokens (answer of ~{count_tokens(random_text(args.answer_words))} tokens)")
+    print(f"{'turn':>5} {'history':>8} {'memory calls':>13} {'managed total':>14} {'full history':>13}")
+    for turn, history, memory_calls, full in rows:
+        if turn in (1, 2, 3, 5) or turn % 10 == 0:
+            print(f"{turn:>5} {history:>8} {memory_calls:>13} {history + memory_calls:>14} {full:>13}")
+
+
+if __name__ == "__main__":
+    main()
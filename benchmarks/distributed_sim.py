@@ -0,0 +1,181 @@
+"""Simulation of distributed extraction with several local processes as nodes.
+
+Starts N node processes (`utils.distributed.ExtractionNode`) on one shared
+temporary directory. Instead of converting PDFs, each simulated document
+sleeps for a random time and writes a small pickle to the shared cache with
+the same temp-file + os.replace pattern as the real cache. A few documents
+fail on purpose, and one node can be killed mid-run together with its worker
+processes (`--crash-after`) so its leases have to expire and be taken over by
+the others.
+
+Afterwards the run is checked: every document has a complete cache file or a
+failure marker, no lease is left on an unfinished document and every
+document is in the merged manifest, the cache or the failure markers (a
+crashed node may not have flushed its manifest). Reports wall time, throughput, documents per node and how many
+documents were processed more than once.
+
+Usage:
+    python -m benchmarks.distributed_sim --nodes 3 --workers 2 --documents 200 --crash-after 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+from utils.distributed import ExtractionNode, merge_manifests, read_json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_tasks(documents: int, seed: int, cache_dir: str, fail_rate: float) -> Dict[str, Dict[str, Any]]:
+    """The same document list on every node (each node derives it on its own, as it would from Zotero)."""
+    rng = random.Random(seed)
+    return {
+        f"DOC{i:05d}": {
+            "key": f"DOC{i:05d}",
+            "seconds": rng.uniform(0.02, 0.2),
+            "fail": rng.random() < fail_rate,
+            "cache_path": os.path.join(cache_dir, f"DOC{i:05d}.pkl"),
+        }
+        for i in range(documents)
+    }
+
+
+def simulate_document(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Stand-in for process_single_document(): sleeps, then writes the cache file atomically."""
+    time.sleep(task["seconds"])
+    if task["fail"]:
+        return {"success": False, "title": task["key"], "error": "simulated conversion error"}
+    tmp_path = f"{task['cache_path']}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"key": task["key"], "payload": "x" * 10_000}, f)
+    os.replace(tmp_path, task["cache_path"])
+    return {"success": True, "title": task["key"]}
+
+
+def crash():
+    """Simulated host failure: the node and its worker processes disappear with their leases still held."""
+    for child in multiprocessing.active_children():
+        child.kill()
+    os._exit(1)
+
+
+def run_node(args: argparse.Namespace):
+    tasks = make_tasks(args.documents, args.seed, os.path.join(args.shared_dir, "cache"), args.fail_rate)
+    if args.crash_after:
+        threading.Timer(args.crash_after, crash).start()
+    node = ExtractionNode(
+        args.node, args.shared_dir, args.workers, lease_seconds=args.lease_seconds, poll_seconds=0.2
+    )
+    node.run(tasks, simulate_document, lambda key: os.path.exists(tasks[key]["cache_path"]))
+
+
+def verify(args: argparse.Namespace, shared_dir: str) -> Dict[str, Any]:
+    tasks = make_tasks(args.documents, args.seed, os.path.join(shared_dir, "cache"), args.fail_rate)
+    merged = merge_manifests(shared_dir)
+    problems = []
+    for key, task in tasks.items():
+        if task["fail"]:
+            if not os.path.exists(os.path.join(shared_dir, "failed", f"{key}.json")):
+                problems.append(f"{key}: no failure marker")
+            continue
+        try:
+            with open(task["cache_path"], "rb") as f:
+                if pickle.load(f)["key"] != key:
+                    problems.append(f"{key}: cache holds another document")
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            problems.append(f"{key}: cache missing or incomplete ({e})")
+
+    done = {key for key, task in tasks.items() if os.path.exists(task["cache_path"])}
+    failed = {key for key in tasks if os.path.exists(os.path.join(shared_dir, "failed", f"{key}.json"))}
+    leftover_leases = [
+        name for name in os.listdir(os.path.join(shared_dir, "leases"))
+        if name.endswith(".lease") and name[: -len(".lease")] not in done
+    ]
+    if leftover_leases:
+        problems.append(f"{len(leftover_leases)} leases left on unfinished documents")
+    # Documents finished by a crashed node before its last manifest flush are only in the cache
+    # (or, if they failed, only have a failure marker)
+    missing = set(tasks) - set(merged["documents"]) - done - failed
+    if missing:
+        problems.append(f"{len(missing)} documents neither in the merged manifest nor in the cache")
+
+    processed: Dict[str, int] = {}
+    for name in os.listdir(os.path.join(shared_dir, "manifests")):
+        manifest = read_json(os.path.join(shared_dir, "manifests", name)) or {"documents": {}}
+        for key, entry in manifest["documents"].items():
+            if entry["status"] != "processing":
+                processed[key] = processed.get(key, 0) + 1
+    return {
+        "problems": problems,
+        "nodes": {node: summary["documents"] for node, summary in merged["nodes"].items()},
+        "duplicates": sum(1 for count in processed.values() if count > 1),
+        "failed": sum(1 for task in tasks.values() if task["fail"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes per node")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--lease-seconds", type=float, default=2.0)
+    parser.add_argument("--crash-after", type=float, default=0.0, help="Kill the first node after this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    # Internal: run a single node in this process
+    parser.add_argument("--node", help=argparse.SUPPRESS)
+    parser.add_argument("--shared-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.node:
+        run_node(args)
+        return
+
+    with tempfile.TemporaryDirectory() as shared_dir:
+        os.makedirs(os.path.join(shared_dir, "cache"))
+        start = time.perf_counter()
+        nodes = []
+        for i in range(args.nodes):
+            command = [
+                sys.executable, "-m", "benchmarks.distributed_sim", "--node", f"node{i}", "--shared-dir", shared_dir,
+                "--workers", str(args.workers), "--documents", str(args.documents), "--seed", str(args.seed),
+                "--fail-rate", str(args.fail_rate), "--lease-seconds", str(args.lease_seconds),
+            ]
+            if i == 0 and args.crash_after:
+                command += ["--crash-after", str(args.crash_after)]
+            nodes.append(subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL))
+        exit_codes = [node.wait() for node in nodes]
+        elapsed = time.perf_counter() - start
+
+        report = verify(args, shared_dir)
+        report.update(
+            wall_seconds=round(elapsed, 2),
+            documents_per_second=round(args.documents / elapsed, 1),
+            exit_codes=exit_codes,
+        )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{args.documents} documents on {args.nodes} nodes x {args.workers} workers: "
+              f"{report['wall_seconds']:.2f} s ({report['documents_per_second']:.1f} docs/s)")
+        print(f"Node exit codes: {exit_codes}")
+        for node, counts in sorted(report["nodes"].items()):
+            print(f"  {node}: {', '.join(f'{status}={count}' for status, count in sorted(counts.items()))}")
+        print(f"Failed on purpose: {report['failed']}, processed more than once: {report['duplicates']}")
+        print("OK" if not report["problems"] else "FAIL:\n  " + "\n  ".join(report["problems"]))
+    sys.exit(1 if report["problems"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Offline evaluation of hybrid (BM25 + vector) retrieval against vector-only search.
+
+Usage:
+    python -m benchmarks.eval_hybrid data/eval/queries.jsonl --k 1 3 5 10
+
+Each line of the queries file is a JSON object with the question and the
+Zotero keys of documents that answer it:
+
+    {"query": "BRCA1 i rak piersi", "relevant_keys": ["ABCD1234"]}
+"""
+import argparse
+import json
+from typing import Dict, List
+
+import lancedb
+from dotenv import load_dotenv
+
+from utils.retrieval import FTS_WEIGHT, RRF_K, VECTOR_WEIGHT, hybrid_search, vector_search
+
+load_dotenv()
+
+
+def load_queries(path: str) -> List[Dict]:
+    """Load evaluation queries from a JSONL file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def recall_at_k(retrieved_keys: List[str], relevant_keys: List[str], k: int) -> float:
+    """Fraction of relevant documents found among the first k retrieved chunks."""
+    relevant = set(relevant_keys)
+    if not relevant:
+        return 0.0
+    return len(relevant & set(retrieved_keys[:k])) / len(relevant)
+
+
+def retrieved_zotero_keys(results) -> List[str]:
+    """Zotero keys of retrieved chunks, in rank order."""
+    return results.flatten().column("metadata.zotero_key").to_pylist()
+
+
+def evaluate(table, queries: List[Dict], ks: List[int], vector_weight: float, fts_weight: float, rrf_k: int):
+    """Compute mean recall@k for vector-only and hybrid retrieval.
+
+    Returns:
+        Dict mapping mode name to {k: mean recall}
+    """
+    max_k = max(ks)
+    totals = {"vector": {k: 0.0 for k in ks}, "hybrid": {k: 0.0 for k in ks}}
+
+    for entry in queries:
+        runs = {
+            "vector": vector_search(table, entry["query"], max_k),
+            "hybrid": hybrid_search(
+                table, entry["query"], max_k,
+                vector_weight=vector_weight, fts_weight=fts_weight, rrf_k=rrf_k,
+            ),
+        }
+        for mode, results in runs.items():
+            keys = retrieved_zotero_keys(results)
+            for k in ks:
+                totals[mode][k] += recall_at_k(keys, entry["relevant_keys"], k)
+
+    return {
+        mode: {k: total / len(queries) for k, total in recalls.items()}
+        for mode, recalls in totals.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall@k of hybrid and vector-only retrieval")
+    parser.add_argument("queries", help="JSONL file with queries and relevant Zotero keys")
+    parser.add_argument("--db", default="data/lancedb")
+    parser.add_argument("--table", default="docling")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10])
+    parser.add_argument("--vector-weight", type=float, default=VECTOR_WEIGHT)
+    parser.add_argument("--fts-weight", type=float, default=FTS_WEIGHT)
+    parser.add_argument("--rrf-k", type=int, default=RRF_K)
+    parser.add_argument("--output", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    table = lancedb.connect(args.db).open_table(args.table)
+    queries = load_queries(args.queries)
+    results = evaluate(table, queries, args.k, args.vector_weight, args.fts_weight, args.rrf_k)
+
+    print(f"Queries: {len(queries)}  (weights: vector={args.vector_weight}, fts={args.fts_weight}, k={args.rrf_k})")
+    print(f"{'mode':<8}" + "".join(f"{'R@' + str(k):>8}" for k in args.k))
+    for mode, recalls in results.items():
+        print(f"{mode:<8}" + "".join(f"{recalls[k]:>8.3f}" for k in args.k))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"queries": len(queries), "recall": results, "args": vars(args)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
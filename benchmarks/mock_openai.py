@@ -0,0 +1,181 @@
+"""Local mock of the OpenAI embeddings and chat completions APIs.
+
+Serves deterministic embeddings (a unit vector seeded by the md5 of each input)
+and streamed chat completions with configurable latency, so the service and
+the ingest pipeline can be load-tested without network access or API costs.
+
+Optional rate limits (`--rpm` requests and `--tpm` tokens per minute, over a
+sliding 60 s window) answer excess requests with 429 and a Retry-After
+header, like the real API, so client retry behaviour is part of the test.
+
+Usage:
+    python -m benchmarks.mock_openai --port 8900 --embedding-latency 0.05 --token-latency 0.01
+    python -m benchmarks.mock_openai --port 8900 --rpm 3000 --tpm 1000000 --input-latency 0.002
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=mock python -m utils.service
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+from aiohttp import web
+
+# text-embedding-3-large
+EMBEDDING_DIM = 3072
+
+
+def mock_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """Deterministic unit vector for a text."""
+    seed = int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class RateLimiter:
+    """Requests and tokens per minute over a sliding 60 s window (0 = unlimited)."""
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._events: deque = deque()  # (time, tokens)
+        self._tokens = 0
+
+    def check(self, tokens: int):
+        """(seconds to wait, exceeded limit); (0, None) admits the request and records it."""
+        now = time.monotonic()
+        while self._events and self._events[0][0] <= now - self.WINDOW:
+            self._tokens -= self._events.popleft()[1]
+        over_requests = self.rpm and len(self._events) + 1 > self.rpm
+        over_tokens = self.tpm and self._tokens + tokens > self.tpm and self._events
+        if over_requests or over_tokens:
+            return max(0.05, self._events[0][0] + self.WINDOW - now), "requests" if over_requests else "tokens"
+        self._events.append((now, tokens))
+        self._tokens += tokens
+        return 0.0, None
+
+
+def rate_limited(retry_after: float, kind: str) -> web.Response:
+    return web.json_response(
+        {"error": {
+            "message": f"Rate limit reached for {kind}. Please try again in {retry_after:.2f}s.",
+            "type": kind, "param": None, "code": "rate_limit_exceeded",
+        }},
+        status=429,
+        headers={"Retry-After": f"{retry_after:.2f}", "Retry-After-Ms": str(int(retry_after * 1000))},
+    )
+
+
+def create_app(
+    dim: int = EMBEDDING_DIM,
+    embedding_latency: float = 0.05,
+    first_token_latency: float = 0.2,
+    token_latency: float = 0.01,
+    answer_tokens: int = 100,
+    rpm: int = 0,
+    tpm: int = 0,
+    input_latency: float = 0.0,
+) -> web.Application:
+    app = web.Application()
+    app["requests"] = {"embeddings": 0, "chat": 0, "rate_limited": 0}
+    limiter = RateLimiter(rpm, tpm)
+
+    async def embeddings(request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        tokens = sum(len(str(text).split()) for text in inputs)
+        retry_after, kind = limiter.check(tokens)
+        if kind:
+            app["requests"]["rate_limited"] += 1
+            return rate_limited(retry_after, kind)
+        app["requests"]["embeddings"] += 1
+        # Latency grows with the batch size, as with the real API
+        await asyncio.sleep(embedding_latency + input_latency * len(inputs))
+        return web.json_response({
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": mock_embedding(str(text), dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model", "text-embedding-3-large"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        retry_after, kind = limiter.check(0)
+        if kind:
+            app["requests"]["rate_limited"] += 1
+            return rate_limited(retry_after, kind)
+        app["requests"]["chat"] += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o-mini")
+        words = [f"token{i} " for i in range(answer_tokens)]
+
+        def chunk(delta: dict, finish_reason=None) -> dict:
+            return {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        await asyncio.sleep(first_token_latency)
+        if not body.get("stream"):
+            await asyncio.sleep(token_latency * answer_tokens)
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "".join(words)},
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": answer_tokens, "total_tokens": answer_tokens},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n".encode())
+        for word in words:
+            await response.write(f"data: {json.dumps(chunk({'content': word}))}\n\n".encode())
+            await asyncio.sleep(token_latency)
+        await response.write(f"data: {json.dumps(chunk({}, 'stop'))}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(app["requests"])
+
+    app.router.add_post("/v1/embeddings", embeddings)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI embeddings and chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="Seconds before the first chat token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds between chat tokens")
+    parser.add_argument("--answer-tokens", type=int, default=100)
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="Embedding tokens per minute (0 = unlimited)")
+    parser.add_argument("--input-latency", type=float, default=0.0, help="Extra seconds per embedded input")
+    args = parser.parse_args()
+
+    app = create_app(
+        args.dim, args.embedding_latency, args.first_token_latency, args.token_latency, args.answer_tokens,
+        args.rpm, args.tpm, args.input_latency,
+    )
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Mock Zotero Web API (v3) serving a generated library with PDF attachments.
+
+Implements the part of the API the pipeline uses through pyzotero: paged item
+listing with `start`/`limit`/`since`/`itemKey` and the `Link`, `Total-Results`
+and `Last-Modified-Version` headers, item children, deleted items (always
+none) and attachment file download.
+The library has `--items` parent items (journal articles with pseudo-random
+titles and authors), each with one PDF attachment of `--pages` pages of text.
+PDFs are generated deterministically from `--seed` and the attachment key, so
+repeated runs convert exactly the same documents. A fraction of downloads
+(`--broken-rate`) returns an HTML error page instead of a PDF, to exercise the
+validation and error paths.
+
+Point the pipeline at it with ZOTERO_API_URL (see utils/zotero_handler.py):
+    ZOTERO_API_URL=http://127.0.0.1:8901 ZOTERO_USER_ID=1 ZOTERO_LIBRARY_TYPE=user ZOTERO_API_KEY=mock
+
+Usage:
+    python -m benchmarks.mock_zotero --port 8901 --items 200 --pages 8 --latency 0.05 --download-latency 0.2
+"""
+import argparse
+import asyncio
+import random
+import string
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+MAX_LIMIT = 100
+DEFAULT_LIMIT = 25
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 11
+
+
+def pseudo_words(rng: random.Random, count: int) -> List[str]:
+    return ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count)]
+
+
+def escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(title: str, pages: List[List[str]]) -> bytes:
+    """Minimal valid PDF 1.4: one Helvetica text page per list of lines, the title on the first page."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for number, lines in enumerate(pages):
+        commands = ["BT", "/F1 10 Tf", "13 TL", "72 760 Td"]
+        if number == 0:
+            commands += ["/F1 16 Tf", f"({escape_pdf_text(title)}) Tj", "T*", "T*", "/F1 10 Tf"]
+        commands += [f"({escape_pdf_text(line)}) Tj T*" for line in lines]
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_refs))
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def item_key(prefix: str, index: int) -> str:
+    """8-character key like Zotero's (prefix + zero-padded number)."""
+    return f"{prefix}{index:07d}"
+
+
+def build_library(items: int, seed: int) -> List[Dict[str, Any]]:
+    """Parent items followed by their PDF attachments, with increasing library versions."""
+    rng = random.Random(seed)
+    parents, attachments = [], []
+    for i in range(items):
+        key, attachment = item_key("P", i), item_key("A", i)
+        parents.append({
+            "key": key,
+            "version": i + 1,
+            "data": {
+                "key": key,
+                "version": i + 1,
+                "itemType": "journalArticle",
+                "title": " ".join(pseudo_words(rng, rng.randint(4, 10))).capitalize(),
+                "creators": [
+                    {"creatorType": "author", "firstName": first.capitalize(), "lastName": last.capitalize()}
+                    for first, last in zip(pseudo_words(rng, 3), pseudo_words(rng, rng.randint(1, 3)))
+                ],
+                "date": str(rng.randint(1990, 2025)),
+                "abstractNote": " ".join(pseudo_words(rng, 40)),
+                "tags": [],
+            },
+        })
+        attachments.append({
+            "key": attachment,
+            "version": items + i + 1,
+            "data": {
+                "key": attachment,
+                "version": items + i + 1,
+                "itemType": "attachment",
+                "parentItem": key,
+                "linkMode": "imported_file",
+                "title": "Full Text PDF",
+                "contentType": "application/pdf",
+                "filename": f"{attachment}.pdf",
+            },
+        })
+    return parents + attachments
+
+
+def document_pdf(title: str, attachment_key: str, pages: int, seed: int) -> bytes:
+    rng = random.Random(f"{seed}:{attachment_key}")
+    return make_pdf(title, [
+        [" ".join(pseudo_words(rng, WORDS_PER_LINE)) for _ in range(LINES_PER_PAGE)]
+        for _ in range(pages)
+    ])
+
+
+def create_app(
+    items: int = 100,
+    pages: int = 5,
+    seed: int = 0,
+    latency: float = 0.0,
+    download_latency: float = 0.0,
+    broken_rate: float = 0.0,
+) -> web.Application:
+    app = web.Application()
+    app["requests"] = {"items": 0, "children": 0, "files": 0, "broken": 0}
+    library = build_library(items, seed)
+    by_key = {item["key"]: item for item in library}
+    titles = {item["key"]: item["data"]["title"] for item in library if item["data"]["itemType"] != "attachment"}
+    library_version = max((item["version"] for item in library), default=0)
+    broken = {
+        item["key"] for item in library
+        if item["data"]["itemType"] == "attachment" and random.Random(f"{seed}:broken:{item['key']}").random() < broken_rate
+    }
+
+    def versioned(payload: Any, headers: Dict[str, str] = None) -> web.Response:
+        return web.json_response(
+            payload, headers={"Last-Modified-Version": str(library_version), **(headers or {})}
+        )
+
+    async def list_items(request: web.Request) -> web.Response:
+        app["requests"]["items"] += 1
+        await asyncio.sleep(latency)
+        since = int(request.query.get("since", 0))
+        start = int(request.query.get("start", 0))
+        limit = min(int(request.query.get("limit", DEFAULT_LIMIT)), MAX_LIMIT)
+        selected = [item for item in library if item["version"] > since]
+        if request.query.get("itemKey"):
+            keys = set(request.query["itemKey"].split(","))
+            selected = [item for item in selected if item["key"] in keys]
+        page = selected[start:start + limit]
+
+        def link(offset: int) -> str:
+            return str(request.url.update_query(start=offset, limit=limit))
+
+        links = []
+        if start + limit < len(selected):
+            links.append(f'<{link(start + limit)}>; rel="next"')
+            links.append(f'<{link((len(selected) - 1) // limit * limit)}>; rel="last"')
+        headers = {"Total-Results": str(len(selected))}
+        if links:
+            headers["Link"] = ", ".join(links)
+        return versioned(page, headers)
+
+    async def children(request: web.Request) -> web.Response:
+        app["requests"]["children"] += 1
+        await asyncio.sleep(latency)
+        parent = request.match_info["key"]
+        return versioned([item for item in library if item["data"].get("parentItem") == parent])
+
+    async def deleted(request: web.Request) -> web.Response:
+        return versioned({"collections": [], "items": [], "searches": [], "tags": [], "settings": []})
+
+    async def file(request: web.Request) -> web.Response:
+        app["requests"]["files"] += 1
+        await asyncio.sleep(download_latency)
+        attachment = by_key.get(request.match_info["key"])
+        if attachment is None or attachment["data"]["itemType"] != "attachment":
+            raise web.HTTPNotFound(text="Not found")
+        if attachment["key"] in broken:
+            # Like a proxy error page in front of the file storage
+            app["requests"]["broken"] += 1
+            return web.Response(text="<html><body>502 Bad Gateway</body></html>", content_type="application/pdf")
+        title = titles[attachment["data"]["parentItem"]]
+        body = document_pdf(title, attachment["key"], pages, seed)
+        return web.Response(body=body, content_type="application/pdf")
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response({**app["requests"], "library_version": library_version, "items": items})
+
+    for prefix in ("/users/{library}", "/groups/{library}"):
+        app.router.add_get(f"{prefix}/items", list_items)
+        app.router.add_get(f"{prefix}/items/{{key}}/children", children)
+        app.router.add_get(f"{prefix}/items/{{key}}/file", file)
+        app.router.add_get(f"{prefix}/deleted", deleted)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Zotero Web API with generated PDF attachments")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--items", type=int, default=100, help="Parent items, each with one PDF attachment")
+    parser.add_argument("--pages", type=int, default=5, help="Pages per PDF")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per API request")
+    parser.add_argument("--download-latency", type=float, default=0.0, help="Seconds per file download")
+    parser.add_argument("--broken-rate", type=float, default=0.0, help="Fraction of attachments served as non-PDF")
+    args = parser.parse_args()
+
+    app = create_app(args.items, args.pages, args.seed, args.latency, args.download_latency, args.broken_rate)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
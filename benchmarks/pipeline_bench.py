@@ -0,0 +1,279 @@
+"""End-to-end ingest throughput with local Zotero and OpenAI stand-ins.
+
+Starts the mock Zotero API (benchmarks.mock_zotero, generated PDFs) and the
+mock OpenAI server (benchmarks.mock_openai, embeddings with configurable
+latency and rate limits), then runs the real pipeline stages against them:
+extract_documents_from_zotero() (download, validation, docling conversion),
+chunk_zotero_documents() and process_and_add_chunks(). Nothing leaves the
+machine, so runs are repeatable and free.
+
+Each worker count gets a fresh working directory (cold caches) and each stage
+runs in its own child process, so its CPU time and peak memory are measured
+in isolation. Per stage it reports wall time, documents/s, chunks/s, CPU
+seconds (including worker processes), average cores used and the peak RSS of
+the stage process and of its largest worker. Worker counts apply to
+extraction and chunking; embedding is a single process whose throughput is
+set by the mock's latency and rate limits and by `--batch-size`.
+
+The stages still need docling's layout models (downloaded from the Hugging
+Face Hub on first use) and tiktoken's cl100k_base encoding. Before starting,
+the run converts one generated PDF and loads the encoding, and stops with
+an error naming what is missing (offline, fill the Hugging Face cache and
+TIKTOKEN_CACHE_DIR once with network access).
+
+Usage:
+    python -m benchmarks.pipeline_bench --items 50 --pages 8 --workers 1 2 4
+    python -m benchmarks.pipeline_bench --workers 4 --embedding-latency 0.2 --rpm 500 --output data/bench/pipeline.json
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import requests
+
+from benchmarks.service_load_test import wait_until_ready
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ["extraction", "chunking", "embedding"]
+
+
+def run_stage(stage: str, workers: int, batch_size: int) -> Dict[str, Any]:
+    """Runs one stage in the current process (cwd = working directory of the run)."""
+    from utils.pipeline import DOCS_FILE, load_script, write_pickle
+
+    if stage == "extraction":
+        from utils.zotero_handler import extract_documents_from_zotero
+
+        docs = extract_documents_from_zotero(max_workers=workers)
+        write_pickle(docs, DOCS_FILE)
+        return {"documents": len(docs), "pages": sum(len(doc["document"].pages) for doc in docs)}
+    if stage == "chunking":
+        chunking = load_script("2-chunking.py")
+        with open(DOCS_FILE, "rb") as f:
+            docs = pickle.load(f)
+        chunks = chunking.chunk_zotero_documents(docs, max_workers=min(workers, max(len(docs), 1)))
+        chunking.save_chunks(chunks)
+        return {"documents": len(docs), "chunks": len(chunks)}
+
+    import lancedb
+
+    embedding = load_script("3-embedding.py")
+    db = lancedb.connect("data/lancedb")
+    table = db.create_table("docling", schema=embedding.Chunks, mode="overwrite")
+    embedding.process_and_add_chunks(embedding.iter_zotero_documents_chunks(), table, batch_size=batch_size)
+    return {"documents": len(embedding.get_existing_chunk_counts(table)), "chunks": table.count_rows()}
+
+
+def check_requirements(stages: List[str]) -> List[str]:
+    """Models and encodings the stages load on first use; returns what is missing."""
+    missing = []
+    if "extraction" in stages:
+        from docling.document_converter import DocumentConverter
+
+        from benchmarks.mock_zotero import document_pdf
+
+        with tempfile.TemporaryDirectory() as path:
+            pdf_path = os.path.join(path, "check.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(document_pdf("Check", "CHECK", 1, 0))
+            try:
+                DocumentConverter().convert(pdf_path)
+            except Exception as e:
+                missing.append(f"docling cannot convert a PDF, its models are probably not in the Hugging Face "
+                               f"cache ({type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''})")
+    if "chunking" in stages or "embedding" in stages:
+        from tiktoken import get_encoding
+
+        try:
+            get_encoding("cl100k_base")
+        except Exception as e:
+            missing.append(f"tiktoken cannot load cl100k_base, set TIKTOKEN_CACHE_DIR to a directory "
+                           f"holding it ({type(e).__name__})")
+    return missing
+
+
+def measure_stage(args: argparse.Namespace):
+    """Child process entry point: runs the stage and writes its measurements to --result-file."""
+    import resource
+
+    from utils.profiling import peak_rss_mb
+
+    before = os.times()
+    start = time.perf_counter()
+    result = run_stage(args.stage, args.stage_workers, args.batch_size)
+    elapsed = time.perf_counter() - start
+    after = os.times()
+    # Worker pools are shut down by now, so their usage is in RUSAGE_CHILDREN
+    cpu = sum(getattr(after, field) - getattr(before, field)
+              for field in ("user", "system", "children_user", "children_system"))
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    result.update(
+        seconds=elapsed,
+        cpu_seconds=cpu,
+        peak_rss_mb=peak_rss_mb(),
+        worker_peak_rss_mb=children_peak / (1024 * 1024) if sys.platform == "darwin" else children_peak / 1024,
+    )
+    with open(args.result_file, "w") as f:
+        json.dump(result, f)
+
+
+def spawn_mocks(args: argparse.Namespace) -> List[subprocess.Popen]:
+    zotero = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_zotero", "--port", str(args.zotero_port),
+        "--items", str(args.items), "--pages", str(args.pages), "--seed", str(args.seed),
+        "--latency", str(args.zotero_latency), "--download-latency", str(args.download_latency),
+        "--broken-rate", str(args.broken_rate),
+    ], cwd=ROOT)
+    openai = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_openai", "--port", str(args.openai_port),
+        "--embedding-latency", str(args.embedding_latency), "--input-latency", str(args.input_latency),
+        "--rpm", str(args.rpm), "--tpm", str(args.tpm),
+    ], cwd=ROOT)
+    processes = [zotero, openai]
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.zotero_port}/stats", zotero)
+        wait_until_ready(f"http://127.0.0.1:{args.openai_port}/stats", openai)
+    except RuntimeError:
+        stop(processes)
+        raise
+    return processes
+
+
+def stop(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+def openai_stats(args: argparse.Namespace) -> Dict[str, int]:
+    return requests.get(f"http://127.0.0.1:{args.openai_port}/stats", timeout=10).json()
+
+
+def run_level(args: argparse.Namespace, workers: int, workdir: str) -> Dict[str, Any]:
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+        "ZOTERO_API_URL": f"http://127.0.0.1:{args.zotero_port}",
+        "ZOTERO_USER_ID": "1",
+        "ZOTERO_LIBRARY_TYPE": "user",
+        "ZOTERO_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": "mock",
+        "METRICS_DIR": os.path.join(workdir, "data", "metrics"),
+        "TRACE_FILE": "",
+        "PIPELINE_PROFILE": "0",
+    }
+    stages = {}
+    for stage in args.stages:
+        result_file = os.path.join(workdir, f"{stage}.json")
+        log_file = os.path.join(workdir, f"{stage}.log")
+        requests_before = openai_stats(args)
+        with open(log_file, "w") as log:
+            code = subprocess.call([
+                sys.executable, "-m", "benchmarks.pipeline_bench", "--stage", stage,
+                "--stage-workers", str(workers), "--batch-size", str(args.batch_size), "--result-file", result_file,
+            ], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if code != 0 or not os.path.exists(result_file):
+            raise RuntimeError(f"Stage {stage} failed with code {code}, see {log_file} (keep it with --keep)")
+        with open(result_file) as f:
+            result = json.load(f)
+        if stage == "extraction" and not result["documents"]:
+            raise RuntimeError(f"Stage {stage} extracted no documents, see {log_file} (keep it with --keep)")
+        requests_after = openai_stats(args)
+        seconds = result["seconds"]
+        result.update(
+            documents_per_second=result.get("documents", 0) / seconds if seconds else None,
+            chunks_per_second=result["chunks"] / seconds if seconds and "chunks" in result else None,
+            cores_used=result["cpu_seconds"] / seconds if seconds else None,
+            embedding_requests=requests_after["embeddings"] - requests_before["embeddings"],
+            rate_limited=requests_after["rate_limited"] - requests_before["rate_limited"],
+        )
+        stages[stage] = result
+    return {"workers": workers, "stages": stages}
+
+
+def print_level(level: Dict[str, Any]):
+    fmt = lambda value, spec: format(value, spec) if value is not None else "-"
+    for stage, result in level["stages"].items():
+        print(
+            f"workers={level['workers']:<3} {stage:<11} {result['seconds']:8.2f} s  "
+            f"{fmt(result['documents_per_second'], '7.2f')} docs/s  {fmt(result['chunks_per_second'], '8.1f')} chunks/s  "
+            f"cpu {result['cpu_seconds']:7.1f} s ({fmt(result['cores_used'], '.1f')} cores)  "
+            f"rss {fmt(result['peak_rss_mb'], '.0f')} MB / worker {fmt(result['worker_peak_rss_mb'], '.0f')} MB"
+            + (f"  429s {result['rate_limited']}" if result["rate_limited"] else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--items", type=int, default=50, help="Zotero items (one PDF each)")
+    parser.add_argument("--pages", type=int, default=8, help="Pages per PDF")
+    parser.add_argument("--broken-rate", type=float, default=0.0, help="Fraction of attachments served as non-PDF")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zotero-latency", type=float, default=0.05, help="Seconds per Zotero API request")
+    parser.add_argument("--download-latency", type=float, default=0.1, help="Seconds per PDF download")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--input-latency", type=float, default=0.001, help="Extra seconds per embedded chunk")
+    parser.add_argument("--rpm", type=int, default=0, help="Embedding requests per minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="Embedding tokens per minute (0 = unlimited)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Chunks per embeddings request")
+    parser.add_argument("--zotero-port", type=int, default=8901)
+    parser.add_argument("--openai-port", type=int, default=8900)
+    parser.add_argument("--keep", action="store_true", help="Keep the working directories (logs, caches)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    # Internal: run a single stage in this process
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--stage-workers", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        measure_stage(args)
+        return
+
+    missing = check_requirements(args.stages)
+    if missing:
+        sys.exit("Cannot run the benchmark:\n" + "\n".join(f"  - {problem}" for problem in missing))
+
+    processes = spawn_mocks(args)
+    base = tempfile.mkdtemp(prefix="pipeline_bench_")
+    levels = []
+    try:
+        for workers in args.workers:
+            level = run_level(args, workers, os.path.join(base, f"workers{workers}"))
+            levels.append(level)
+            if not args.json:
+                print_level(level)
+    finally:
+        stop(processes)
+        if args.keep:
+            print(f"Working directories: {base}")
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("stage", "stage_workers", "result_file", "json", "output", "keep")},
+        "levels": levels,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""Offline retrieval quality and latency benchmark on a synthetic corpus.
+
+Generates a corpus of documents made of passages with known content: every
+passage has a few rare key terms, its document shares topic terms with
+other documents on the same topic, and filler words are common to all.
+Each query is built from one passage (some key terms inflected, plus topic
+and filler words), so the relevant passage is known. Documents are split
+into chunks of `--chunk-words` words and embedded with a deterministic
+hashed bag-of-words + character-trigram embedder; the query vectors are
+put into the query embedding cache (utils.query_cache) beforehand, so
+nothing is sent to OpenAI and the run needs no network.
+
+For each configuration, every query goes through
+`search_zotero_knowledge_base` (4-search.py) and the hits through
+`pack_context` (utils.context_packer, the context builder of the chat
+service). Reported per configuration:
+
+* recall@k:      share of queries with a chunk covering the source passage in the top k
+* doc_recall@k:  share of queries with the source document in the top k
+* MRR:           mean reciprocal rank of the first chunk covering the passage
+* latency:       p50/p95/p99 of the search call, and of context packing
+* context tokens per query (mean, p95)
+
+When both `hybrid` and `hybrid-mmr` run, MMR must not lower MRR (beyond
+`--mmr-tolerance`): diversification may reorder the tail but not push the
+best chunk down. The run exits with status 1 otherwise. (The per-document
+cap of `hybrid-mmr-cap` trades MRR for document coverage by design and is
+not checked.)
+
+The search result cache is disabled, so every query hits LanceDB. Results
+are written as JSON (with the git commit) to compare runs across commits;
+`--baseline` prints the differences to an earlier result file.
+
+The token counts use tiktoken's cl100k_base encoding. tiktoken downloads it
+on first use, so offline it has to be in the tiktoken cache already (set
+TIKTOKEN_CACHE_DIR to a directory holding it). `--token-counter auto` (the
+default) falls back to an approximate offline counter when the encoding
+cannot be loaded; `--token-counter tiktoken` fails instead. The counter used
+is recorded in the results, and token counts from different counters are
+not comparable.
+
+Usage:
+    python -m benchmarks.retrieval_bench --documents 500 --chunk-words 80 --dimensions 256 \\
+        --configs vector fts hybrid hybrid-mmr hybrid-mmr-cap two-stage --output data/bench/retrieval.json
+    python -m benchmarks.retrieval_bench --baseline data/bench/retrieval.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from utils import context_packer
+from utils.context_packer import CONTEXT_TOKEN_BUDGET, pack_context
+from utils.document_index import build_document_table
+from utils.indexes import create_indexes
+from utils.pipeline import load_script
+from utils.query_cache import EmbeddingCache, embedding_cache, result_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "po", "si", "de", "gu", "ba", "fe", "zo", "wi", "ly", "ost"]
+INFLECTIONS = ["ami", "ach", "owi", "em"]
+SENTENCE_WORDS = 12
+
+# name -> options of search_zotero_knowledge_base
+CONFIGS: Dict[str, Dict[str, Any]] = {
+    "vector": {"query_type": "vector"},
+    "fts": {"query_type": "fts"},
+    "hybrid": {"query_type": "hybrid"},
+    "hybrid-mmr": {"query_type": "hybrid", "mmr": True},
+    "hybrid-mmr-cap": {"query_type": "hybrid", "mmr": True, "max_per_document": 2},
+    "two-stage": {"query_type": "vector", "two_stage": True},
+}
+
+METADATA_TYPE = pa.struct([
+    ("creators", pa.string()),
+    ("date", pa.string()),
+    ("item_type", pa.string()),
+    ("page_numbers", pa.list_(pa.int32())),
+    ("parsed_date", pa.string()),
+    ("source_type", pa.string()),
+    ("title", pa.string()),
+    ("url", pa.string()),
+    ("zotero_key", pa.string()),
+])
+
+
+class HashEmbedder:
+    """Deterministic stand-in for the embedding model.
+
+    Words and their character trigrams are hashed (crc32) into a fixed number
+    of signed buckets and the sum is L2-normalized, so texts sharing words or
+    word stems get similar vectors.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self._features: Dict[str, List[Tuple[int, float]]] = {}
+
+    def _word_features(self, word: str) -> List[Tuple[int, float]]:
+        features = self._features.get(word)
+        if features is None:
+            padded = f"<{word}>"
+            grams = [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+            features = []
+            for gram in grams:
+                digest = zlib.crc32(gram.encode())
+                features.append((digest % self.dimensions, 1.0 if digest & 0x80000000 else -1.0))
+            self._features[word] = features
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().replace(".", " ").split():
+            for index, sign in self._word_features(word):
+                vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+@dataclass
+class Query:
+    text: str
+    zotero_key: str
+    span: Tuple[int, int]  # word offsets of the source passage in its document
+
+
+def make_vocabulary(rng: random.Random, size: int, syllables: Tuple[int, int]) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables))))
+    return sorted(words)
+
+
+def build_corpus(
+    documents: int, passages: int, passage_words: int, queries_count: int, seed: int
+) -> Tuple[Dict[str, List[str]], List[Query]]:
+    """Return document words by Zotero key and queries with their source passages."""
+    rng = random.Random(seed)
+    filler = make_vocabulary(rng, 150, (1, 2))
+    topics = max(1, documents // 10)
+    topic_pool = make_vocabulary(rng, topics * 30, (2, 3))
+    topic_words = [topic_pool[t * 30:(t + 1) * 30] for t in range(topics)]
+    rare_pool = iter(make_vocabulary(rng, documents * passages * 5 + 1, (3, 5)))
+
+    corpus: Dict[str, List[str]] = {}
+    sources = []
+    for d in range(documents):
+        key = f"S{d:06d}"
+        topic = topic_words[d % topics]
+        words: List[str] = []
+        for _ in range(passages):
+            key_terms = [next(rare_pool) for _ in range(5)]
+            start = len(words)
+            length = rng.randint(passage_words // 2, passage_words * 3 // 2)
+            for i in range(length):
+                roll = rng.random()
+                pool = key_terms if roll < 0.12 else topic if roll < 0.45 else filler
+                words.append(rng.choice(pool) + ("." if (i + 1) % SENTENCE_WORDS == 0 else ""))
+            sources.append((key, (start, len(words)), key_terms, topic))
+        corpus[key] = words
+
+    queries = []
+    for key, span, key_terms, topic in rng.sample(sources, min(queries_count, len(sources))):
+        terms = [term + rng.choice(INFLECTIONS) if rng.random() < 0.3 else term for term in rng.sample(key_terms, 3)]
+        terms += rng.sample(topic, 2) + [rng.choice(filler)]
+        rng.shuffle(terms)
+        queries.append(Query(" ".join(terms), key, span))
+    return corpus, queries
+
+
+def build_table(db, corpus: Dict[str, List[str]], chunk_words: int, embedder: HashEmbedder):
+    """Create the chunk table; returns it with the word span of every chunk text."""
+    texts, keys, spans = [], [], {}
+    for key, words in corpus.items():
+        for start in range(0, len(words), chunk_words):
+            text = " ".join(words[start:start + chunk_words])
+            texts.append(text)
+            keys.append(key)
+            spans[(key, text)] = (start, min(start + chunk_words, len(words)))
+
+    vectors = np.stack([embedder.embed(text) for text in texts])
+    table = db.create_table("docling", pa.table({
+        "text": texts,
+        "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), embedder.dimensions),
+        "metadata": pa.array([
+            {
+                "creators": "Jan Kowalski", "date": str(2000 + int(key[1:]) % 25), "item_type": "journalArticle",
+                "page_numbers": [1 + spans[(key, text)][0] // 500],
+                "parsed_date": str(2000 + int(key[1:]) % 25), "source_type": "zotero",
+                "title": f"Synthetic document {key}", "url": None, "zotero_key": key,
+            }
+            for key, text in zip(keys, texts)
+        ], METADATA_TYPE),
+    }), mode="overwrite")
+    return table, spans
+
+
+def covers(chunk: Tuple[int, int], passage: Tuple[int, int]) -> bool:
+    """Whether a chunk holds at least half of the passage (or half of itself lies in the passage)."""
+    overlap = min(chunk[1], passage[1]) - max(chunk[0], passage[0])
+    return overlap > 0 and overlap * 2 >= min(passage[1] - passage[0], chunk[1] - chunk[0])
+
+
+def percentile(values: Sequence[float], q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def run_config(search_module, options: Dict[str, Any], queries: List[Query], spans, ks: List[int]) -> Dict[str, Any]:
+    limit = max(ks)
+    search_ms, pack_ms, tokens, reciprocal_ranks = [], [], [], []
+    found = {k: 0 for k in ks}
+    doc_found = {k: 0 for k in ks}
+
+    def search(query: Query):
+        # The CLI function prints its results; keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            return search_module.search_zotero_knowledge_base(query.text, limit=limit, **options)
+
+    search(queries[0])  # warm-up (opens indexes)
+    for query in queries:
+        start = time.perf_counter()
+        hits = search(query)
+        search_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        packed = pack_context(hits, query.text, CONTEXT_TOKEN_BUDGET)
+        pack_ms.append((time.perf_counter() - start) * 1000)
+        tokens.append(packed.tokens)
+
+        relevant = [
+            hit.zotero_key == query.zotero_key and covers(spans[(hit.zotero_key, hit.text)], query.span)
+            for hit in hits
+        ]
+        first = relevant.index(True) + 1 if True in relevant else None
+        reciprocal_ranks.append(1 / first if first else 0.0)
+        for k in ks:
+            found[k] += first is not None and first <= k
+            doc_found[k] += any(hit.zotero_key == query.zotero_key for hit in hits[:k])
+
+    n = len(queries)
+    return {
+        **{f"recall@{k}": round(found[k] / n, 4) for k in ks},
+        **{f"doc_recall@{k}": round(doc_found[k] / n, 4) for k in ks},
+        "mrr": round(statistics.fmean(reciprocal_ranks), 4),
+        "search_ms_p50": round(percentile(search_ms, 50), 2),
+        "search_ms_p95": round(percentile(search_ms, 95), 2),
+        "search_ms_p99": round(percentile(search_ms, 99), 2),
+        "pack_ms_p50": round(percentile(pack_ms, 50), 2),
+        "pack_ms_p95": round(percentile(pack_ms, 95), 2),
+        "context_tokens_mean": round(statistics.fmean(tokens), 1),
+        "context_tokens_p95": round(percentile(tokens, 95), 1),
+    }
+
+
+class ApproxEncoding:
+    """Offline stand-in for cl100k_base: words split into pieces of up to 4 characters, plus punctuation."""
+
+    _TOKEN = re.compile(r"\w{1,4}|[^\w\s]")
+
+    def encode(self, text: str, disallowed_special=()) -> List[str]:
+        return self._TOKEN.findall(text)
+
+
+def select_token_counter(name: str) -> str:
+    """Loads the encoding used by pack_context; returns the name of the counter in use."""
+    if name == "approx":
+        context_packer._encoding = ApproxEncoding()
+        return "approx"
+    try:
+        context_packer.count_tokens("")
+        return "tiktoken"
+    except Exception as e:
+        message = (
+            f"Cannot load the tiktoken encoding {context_packer.ENCODING_NAME} ({type(e).__name__}). "
+            "Offline it has to be in the tiktoken cache: set TIKTOKEN_CACHE_DIR to a directory holding it"
+        )
+        if name == "tiktoken":
+            sys.exit(f"{message}, or run with --token-counter approx.")
+        print(f"{message}. Using the approximate token counter.")
+        context_packer._encoding = ApproxEncoding()
+        return "approx"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report: Dict[str, Any], baseline: Optional[Dict[str, Any]]):
+    for name, metrics in report["results"].items():
+        print(f"\n[{name}]")
+        previous = (baseline or {}).get("results", {}).get(name, {})
+        for metric, value in metrics.items():
+            line = f"  {metric:<22} {value:>10}"
+            if metric in previous:
+                line += f"   (baseline {previous[metric]}, {value - previous[metric]:+.4g})"
+            print(line)
+
+
+def check_mmr(results: Dict[str, Dict[str, Any]], tolerance: float) -> Optional[bool]:
+    """Whether MMR keeps the MRR of plain hybrid search (None when either config did not run)."""
+    if "hybrid" not in results or "hybrid-mmr" not in results:
+        return None
+    plain, diversified = results["hybrid"]["mrr"], results["hybrid-mmr"]["mrr"]
+    ok = diversified >= plain - tolerance
+    print(f"\nMMR check: MRR {diversified} with MMR vs {plain} without "
+          f"(tolerance {tolerance}): {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--passages-per-document", type=int, default=8)
+    parser.add_argument("--passage-words", type=int, default=60, help="Mean passage length in words")
+    parser.add_argument("--chunk-words", type=int, default=80, help="Chunk size in words")
+    parser.add_argument("--dimensions", type=int, default=256, help="Embedding dimensions")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--no-fts-index", action="store_true", help="Skip the full-text and scalar indexes")
+    parser.add_argument("--ann-index", action="store_true", help="Build an IVF_PQ index on chunk vectors")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Earlier JSON result to compare against")
+    parser.add_argument("--mmr-tolerance", type=float, default=0.01, help="Allowed MRR drop of hybrid-mmr vs hybrid")
+    parser.add_argument(
+        "--token-counter", choices=["auto", "tiktoken", "approx"], default="auto",
+        help="Token counter for context packing (auto: tiktoken if its encoding loads, approx otherwise)",
+    )
+    args = parser.parse_args()
+    token_counter = select_token_counter(args.token_counter)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Same corpus as the baseline unless overridden on the command line
+        defaults = vars(parser.parse_args([]))
+        for name, value in baseline["parameters"].items():
+            if name == "configs":
+                value = [config for config in value if config in CONFIGS]
+            if getattr(args, name, None) == defaults.get(name) and name not in ("output", "baseline"):
+                setattr(args, name, value)
+
+    parameters = {
+        name: getattr(args, name) for name in (
+            "documents", "passages_per_document", "passage_words", "chunk_words", "dimensions",
+            "queries", "k", "configs", "no_fts_index", "ann_index", "seed",
+        )
+    }
+    corpus, queries = build_corpus(
+        args.documents, args.passages_per_document, args.passage_words, args.queries, args.seed
+    )
+    embedder = HashEmbedder(args.dimensions)
+
+    # Offline: query vectors come from the embedding cache, and every search goes to LanceDB
+    embedding_cache.cache_dir = None
+    for query in queries:
+        embedding_cache.put(EmbeddingCache.make_key(query.text), embedder.embed(query.text).tolist())
+    result_cache.maxsize = 0
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        db = lancedb.connect(path)
+        table, spans = build_table(db, corpus, args.chunk_words, embedder)
+        if not args.no_fts_index:
+            create_indexes(table)
+        if args.ann_index:
+            table.create_index(metric="l2", vector_column_name="vector")
+        search_module = load_script("4-search.py")
+        search_module.uri = path
+        search_module.table = table
+        if "two-stage" in args.configs:
+            with contextlib.redirect_stdout(io.StringIO()):
+                search_module.documents_table = build_document_table(db, table)
+        print(f"Corpus: {len(corpus)} documents, {table.count_rows()} chunks, {len(queries)} queries "
+              f"(built in {time.perf_counter() - start:.1f} s)")
+
+        results = {}
+        for name in args.configs:
+            print(f"Running {name}...")
+            results[name] = run_config(search_module, CONFIGS[name], queries, spans, args.k)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "parameters": parameters,
+        "token_counter": token_counter,
+        "corpus": {"documents": len(corpus), "chunks": len(spans), "queries": len(queries)},
+        "results": results,
+    }
+    if baseline and baseline.get("token_counter", "tiktoken") != token_counter:
+        print(f"\nNote: baseline tokens were counted with {baseline.get('token_counter', 'tiktoken')}, "
+              f"this run with {token_counter}; context token counts are not comparable")
+    print_results(report, baseline)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if check_mmr(results, args.mmr_tolerance) is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
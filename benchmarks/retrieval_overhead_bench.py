@@ -0,0 +1,116 @@
+"""Per-query overhead of the projected Arrow retrieval path vs the pandas path.
+
+Builds a synthetic table with 3072-dimensional vectors in a temporary
+directory and times, for the same query vectors:
+
+* pandas:  table.search(v).limit(k).to_pandas() + iterrows() + string
+           serialization and re-parsing (the previous get_context path)
+* arrow:   vector_search() with column projection + hits_from_arrow()
+
+Usage:
+    python -m benchmarks.retrieval_overhead_bench --rows 20000 --queries 200
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from utils.retrieval import hits_from_arrow, vector_search
+
+DIMENSIONS = 3072
+
+
+def build_table(path: str, rows: int, seed: int = 0):
+    """Create a synthetic chunk table with random unit vectors and metadata."""
+    rng = np.random.default_rng(seed)
+    db = lancedb.connect(path)
+    table = None
+    for start in range(0, rows, 2000):
+        count = min(2000, rows - start)
+        vectors = rng.normal(size=(count, DIMENSIONS)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        batch = pa.table({
+            "text": [f"Synthetic chunk {start + i}.\n\nSecond paragraph: key: value." for i in range(count)],
+            "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), DIMENSIONS),
+            "metadata": [
+                {
+                    "creators": "Jan Kowalski, Anna Smith",
+                    "date": "2020",
+                    "item_type": "journalArticle",
+                    "page_numbers": [1 + i % 20],
+                    "title": f"Document {(start + i) // 20}",
+                    "zotero_key": f"K{(start + i) // 20:06d}",
+                }
+                for i in range(count)
+            ],
+        })
+        if table is None:
+            table = db.create_table("docling", batch, mode="overwrite")
+        else:
+            table.add(batch)
+    return table
+
+
+def pandas_path(table, vector, limit):
+    """The previous get_context + renderer path."""
+    results = table.search(vector).limit(limit).to_pandas()
+    contexts = []
+    for _, row in results.iterrows():
+        source = f"\nSource: {row['metadata']['title']} by {row['metadata']['creators']}"
+        source += f"\nZotero Key: {row['metadata']['zotero_key']}"
+        contexts.append(f"{row['text']}{source}")
+    context = "\n\n".join(contexts)
+    for chunk in context.split("\n\n"):
+        parts = chunk.split("\n")
+        {line.split(": ")[0]: line.split(": ")[1] for line in parts[1:] if ": " in line}
+    return context
+
+
+def arrow_path(table, vector, limit):
+    """The projected retrieval path returning SearchHit objects."""
+    hits = hits_from_arrow(vector_search(table, vector, limit))
+    return [(hit.text, hit.source, hit.zotero_key) for hit in hits]
+
+
+def time_path(path, table, vectors, limit):
+    timings = []
+    for vector in vectors:
+        start = time.perf_counter()
+        path(table, vector, limit)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval overhead benchmark")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        table = build_table(path, args.rows)
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(args.queries, DIMENSIONS)).astype(np.float32)
+        vectors = [v.tolist() for v in vectors / np.linalg.norm(vectors, axis=1, keepdims=True)]
+
+        # Warm up both paths before timing
+        time_path(pandas_path, table, vectors[:5], args.limit)
+        time_path(arrow_path, table, vectors[:5], args.limit)
+
+        print(f"rows={args.rows} queries={args.queries} limit={args.limit}")
+        for name, path_fn in [("pandas", pandas_path), ("arrow", arrow_path)]:
+            timings = time_path(path_fn, table, vectors, args.limit)
+            print(
+                f"{name:<8} p50={statistics.median(timings):7.2f} ms  "
+                f"mean={statistics.fmean(timings):7.2f} ms  "
+                f"p95={statistics.quantiles(timings, n=20)[18]:7.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
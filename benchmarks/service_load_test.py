@@ -0,0 +1,196 @@
+"""Load test of the retrieval/chat service (utils.service).
+
+By default (`--spawn`) everything runs locally: a synthetic chunk library is
+built in a temporary directory, the mock OpenAI server
+(benchmarks.mock_openai) and the service are started as subprocesses, and
+concurrent clients send unique questions so neither cache hides the work.
+For each concurrency level it reports throughput, latency percentiles,
+time to first token (chat) and the number of requests rejected with 503.
+
+Usage:
+    python -m benchmarks.service_load_test --spawn --endpoint chat --concurrency 1 8 32 --requests 200
+    python -m benchmarks.service_load_test --service-url http://127.0.0.1:8080 --endpoint search
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+import lancedb
+
+from benchmarks.two_stage_bench import build_library
+from utils.indexes import create_indexes
+
+
+def percentile(values: List[float], q: int) -> Optional[float]:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+async def one_request(session: aiohttp.ClientSession, url: str, endpoint: str, index: int) -> Dict[str, float]:
+    question = f"load test question {index} about protein folding"
+    start = time.perf_counter()
+    if endpoint == "search":
+        async with session.post(f"{url}/search", json={"query": question, "limit": 8}) as response:
+            await response.read()
+            return {"status": response.status, "latency": time.perf_counter() - start, "first_token": None}
+
+    first_token = None
+    async with session.post(f"{url}/chat", json={"messages": [{"role": "user", "content": question}]}) as response:
+        if response.status != 200:
+            await response.read()
+            return {"status": response.status, "latency": time.perf_counter() - start, "first_token": None}
+        event = None
+        async for raw_line in response.content:
+            line = raw_line.decode().strip()
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line.startswith("data:") and event == "error":
+                return {"status": 599, "latency": time.perf_counter() - start, "first_token": first_token}
+    return {"status": 200, "latency": time.perf_counter() - start, "first_token": first_token}
+
+
+async def run_level(url: str, endpoint: str, concurrency: int, total: int, offset: int) -> Dict[str, object]:
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(offset + i)
+    results = []
+
+    async def worker(session):
+        while not queue.empty():
+            index = queue.get_nowait()
+            try:
+                results.append(await one_request(session, url, endpoint, index))
+            except aiohttp.ClientError:
+                results.append({"status": 0, "latency": 0.0, "first_token": None})
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] * 1000 for r in ok]
+    first_tokens = [r["first_token"] * 1000 for r in ok if r["first_token"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "rejected_503": sum(r["status"] == 503 for r in results),
+        "errors": sum(r["status"] not in (200, 503) for r in results),
+        "throughput_rps": len(ok) / elapsed,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+        "latency_p99_ms": percentile(latencies, 99),
+        "first_token_p50_ms": percentile(first_tokens, 50),
+        "first_token_p95_ms": percentile(first_tokens, 95),
+    }
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    async def probe():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                return response.status
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode}: {' '.join(process.args)}")
+        try:
+            if asyncio.run(probe()) == 200:
+                return
+        except aiohttp.ClientError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout} s")
+
+
+def spawn_stack(path: str, args) -> List[subprocess.Popen]:
+    """Build a synthetic library and start the mock OpenAI server and the service."""
+    print(f"Building synthetic library ({args.documents} documents)...")
+    db = lancedb.connect(path)
+    table, _ = build_library(db, args.documents, args.chunks_per_document, args.dim, spread=0.6)
+    create_indexes(table)
+
+    mock = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_openai", "--port", str(args.mock_port), "--dim", str(args.dim),
+        "--embedding-latency", str(args.embedding_latency), "--token-latency", str(args.token_latency),
+    ])
+    wait_until_ready(f"http://127.0.0.1:{args.mock_port}/stats", mock)
+
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OPENAI_API_KEY": "mock",
+        "QUERY_CACHE_DIR": "",
+    }
+    service = subprocess.Popen(
+        [sys.executable, "-m", "utils.service", "--db", path, "--table", "docling", "--port", str(args.service_port)],
+        env=env,
+    )
+    wait_until_ready(f"http://127.0.0.1:{args.service_port}/health", service)
+    return [service, mock]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service load test")
+    parser.add_argument("--service-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--endpoint", choices=["search", "chat"], default="chat")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--spawn", action="store_true", help="Start the mock OpenAI server and the service locally")
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--chunks-per-document", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--mock-port", type=int, default=8900)
+    parser.add_argument("--service-port", type=int, default=8081)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as path:
+        try:
+            url = args.service_url
+            if args.spawn:
+                processes = spawn_stack(path, args)
+                url = f"http://127.0.0.1:{args.service_port}"
+
+            results = []
+            for level, concurrency in enumerate(args.concurrency):
+                result = asyncio.run(run_level(url, args.endpoint, concurrency, args.requests, level * args.requests))
+                results.append(result)
+                if not args.json:
+                    fmt = lambda value: f"{value:8.1f}" if value is not None else "       -"
+                    print(
+                        f"c={concurrency:<4} ok={result['ok']:<5} 503={result['rejected_503']:<4} "
+                        f"err={result['errors']:<3} {result['throughput_rps']:7.1f} req/s  "
+                        f"p50 {fmt(result['latency_p50_ms'])} ms  p95 {fmt(result['latency_p95_ms'])} ms  "
+                        f"p99 {fmt(result['latency_p99_ms'])} ms  ttft p50 {fmt(result['first_token_p50_ms'])} ms"
+                    )
+            if args.json:
+                print(json.dumps({"endpoint": args.endpoint, "levels": results}, indent=2))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
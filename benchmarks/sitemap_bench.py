@@ -0,0 +1,261 @@
+"""SitemapCrawler checks and throughput against a local sitemap server.
+
+Starts an HTTP server in a background thread (http.server, no network
+needed) serving a generated site: a sitemap index at /sitemap.xml that links
+`--sitemaps` child sitemaps of `--urls` URLs each, a nested sitemap index
+with relative <loc>s and a missing sitemap (404). Child sitemaps alternate
+between plain XML, `.xml.gz` files (gzip body, no Content-Encoding) and XML
+sent with `Content-Encoding: gzip`. Every response carries an ETag, and a
+matching If-None-Match is answered with 304 Not Modified. `--latency` adds
+a delay to every request.
+
+The crawler (utils.sitemap.SitemapCrawler) is run against it and checked:
+
+* full crawl:   every URL is yielded exactly once, across the index, the
+                nested index, gzip files and gzip transfer encoding; the 404
+                sitemap is reported as not found
+* conditional:  a second crawl with the same state file sends the stored
+                ETags, gets only 304s and yields nothing
+* changed:      after one child sitemap changes, only its URLs are yielded
+* early close:  closing the generator after `--take` URLs returns quickly,
+                stops the fetch threads, leaves no sitemap requests running
+                and does not save the state file
+
+The run reports crawl time and URLs/s, and exits with status 1 if a check
+fails.
+
+Usage:
+    python -m benchmarks.sitemap_bench
+    python -m benchmarks.sitemap_bench --sitemaps 30 --urls 5000 --latency 0.05 --workers 8
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.sitemap import SitemapCrawler
+
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+SITE = "https://example.org"
+ENCODINGS = ["plain", "gzip-file", "content-encoding"]
+
+
+class SitemapSite:
+    """Generated sitemaps with versions (a new version changes the content and the ETag)."""
+
+    def __init__(self, sitemaps: int, urls: int, latency: float):
+        self.urls = urls
+        self.latency = latency
+        self.base = ""  # URL of the server, set once it is listening
+        self.parts = [
+            f"/sitemaps/part-{i}.xml.gz" if ENCODINGS[i % 3] == "gzip-file" else f"/sitemaps/part-{i}.xml"
+            for i in range(sitemaps)
+        ]
+        # The last two parts are listed by the nested index instead of the top-level one
+        self.nested = self.parts[-2:]
+        self.versions: Dict[str, int] = {path: 1 for path in self.parts}
+        self.requests: Dict[int, int] = {}
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def page_urls(self, path: str) -> List[str]:
+        name = path.rsplit("/", 1)[-1].split(".")[0]
+        return [f"{SITE}/{name}/v{self.versions[path]}/page-{j}" for j in range(self.urls)]
+
+    def expected_urls(self) -> Set[str]:
+        return {url for path in self.parts for url in self.page_urls(path)}
+
+    def touch(self, path: str):
+        with self._lock:
+            self.versions[path] += 1
+
+    def body(self, path: str) -> Optional[bytes]:
+        if path == "/sitemap.xml":
+            locs = [f"{self.base}{part}" for part in self.parts if part not in self.nested]
+            locs += [f"{self.base}/sitemaps/index-2.xml", f"{self.base}/sitemaps/missing.xml"]
+            return self._xml("sitemapindex", "sitemap", locs)
+        if path == "/sitemaps/index-2.xml":
+            # Relative to the index URL, resolved by the crawler with urljoin
+            return self._xml("sitemapindex", "sitemap", [part.rsplit("/", 1)[-1] for part in self.nested])
+        if path in self.versions:
+            return self._xml("urlset", "url", self.page_urls(path))
+        return None
+
+    @staticmethod
+    def _xml(root: str, tag: str, locs: List[str]) -> bytes:
+        entries = "".join(f"<{tag}><loc>{loc}</loc><lastmod>2024-01-01</lastmod></{tag}>" for loc in locs)
+        return f'<?xml version="1.0" encoding="UTF-8"?><{root} xmlns="{SITEMAP_NS}">{entries}</{root}>'.encode()
+
+    def count(self, status: int):
+        with self._lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+
+class SitemapServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The crawler drops keep-alive connections when a session or crawl ends
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(site: SitemapSite):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            with site._lock:
+                site.active += 1
+            try:
+                time.sleep(site.latency)
+                self._respond()
+            finally:
+                with site._lock:
+                    site.active -= 1
+
+        def _respond(self):
+            body = site.body(self.path)
+            if body is None:
+                site.count(404)
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                site.count(304)
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            site.count(200)
+            encoding = ENCODINGS[site.parts.index(self.path) % 3] if self.path in site.parts else "plain"
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            if encoding == "gzip-file":
+                body = gzip.compress(body)
+                self.send_header("Content-Type", "application/x-gzip")
+            else:
+                if encoding == "content-encoding":
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "application/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the crawler closed the connection early
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def crawl(url: str, state_file: str, workers: int) -> Tuple[SitemapCrawler, List[str], float]:
+    crawler = SitemapCrawler(state_file=state_file, max_workers=workers)
+    start = time.perf_counter()
+    urls = [entry.url for entry in crawler.crawl(url)]
+    return crawler, urls, time.perf_counter() - start
+
+
+def fetch_threads() -> int:
+    return sum(thread.name.startswith("ThreadPoolExecutor") for thread in threading.enumerate())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sitemaps", type=int, default=12, help="Child sitemaps (at least 3)")
+    parser.add_argument("--urls", type=int, default=2000, help="URLs per child sitemap")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    parser.add_argument("--workers", type=int, default=8, help="SitemapCrawler max_workers")
+    parser.add_argument("--take", type=int, default=10, help="URLs read before closing the generator early")
+    args = parser.parse_args()
+
+    site = SitemapSite(max(args.sitemaps, 3), args.urls, args.latency)
+    server = SitemapServer(("127.0.0.1", 0), make_handler(site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    site.base = f"http://127.0.0.1:{server.server_port}"
+    url = f"{site.base}/sitemap.xml"
+    checks: List[Tuple[str, bool]] = []
+
+    def check(name: str, ok: bool, detail: str):
+        checks.append((name, ok))
+        print(f"{name:<12} {detail}: {'OK' if ok else 'FAIL'}")
+
+    try:
+        with tempfile.TemporaryDirectory() as path:
+            state_file = os.path.join(path, "state.json")
+            sitemaps = len(site.parts) + 2  # index and nested index
+
+            crawler, urls, seconds = crawl(url, state_file, args.workers)
+            expected = site.expected_urls()
+            check(
+                "full crawl",
+                len(urls) == len(expected) and set(urls) == expected and len(crawler.fetched) == sitemaps
+                and len(crawler.not_found) == 1,
+                f"{len(urls)} URLs ({len(expected)} expected) from {len(crawler.fetched)} sitemaps, "
+                f"{len(crawler.not_found)} not found, {seconds:.2f} s ({len(urls) / seconds:.0f} URLs/s)",
+            )
+
+            before = dict(site.requests)
+            crawler, urls, seconds = crawl(url, state_file, args.workers)
+            not_modified = site.requests.get(304, 0) - before.get(304, 0)
+            check(
+                "conditional",
+                not urls and not_modified == sitemaps and crawler.stats["fetched"] == 0,
+                f"{len(urls)} URLs, {not_modified} responses 304 of {sitemaps} sitemaps, {seconds:.2f} s",
+            )
+
+            changed = site.parts[1]  # a .xml.gz file
+            site.touch(changed)
+            crawler, urls, seconds = crawl(url, state_file, args.workers)
+            check(
+                "changed",
+                set(urls) == set(site.page_urls(changed)) and len(urls) == args.urls and crawler.stats["fetched"] == 1,
+                f"{len(urls)} URLs from {crawler.stats['fetched']} re-fetched sitemap ({changed})",
+            )
+
+            close_state = os.path.join(path, "close.json")
+            threads_before = fetch_threads()
+            crawler = SitemapCrawler(state_file=close_state, max_workers=args.workers)
+            entries = crawler.crawl(url)
+            taken = [next(entries) for _ in range(min(args.take, len(expected)))]
+            start = time.perf_counter()
+            entries.close()
+            close_seconds = time.perf_counter() - start
+            requests_at_close = site.total_requests()
+            time.sleep(max(0.2, 3 * args.latency))
+            late = site.total_requests() - requests_at_close
+            check(
+                "early close",
+                len(taken) == min(args.take, len(expected)) and fetch_threads() == threads_before
+                and site.active == 0 and late == 0 and not os.path.exists(close_state),
+                f"closed after {len(taken)} URLs in {close_seconds:.2f} s, {late} requests after close, "
+                f"{fetch_threads() - threads_before} fetch threads left, "
+                f"state {'saved' if os.path.exists(close_state) else 'not saved'}",
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f"server responses: {dict(sorted(site.requests.items()))}")
+    if not all(ok for _, ok in checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
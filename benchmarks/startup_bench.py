@@ -0,0 +1,168 @@
+"""Start-up time of the search CLI, from interpreter launch to the first results.
+
+Builds a small synthetic chunk table and a pre-filled query embedding cache in
+a temporary directory (so no OpenAI request is made), then runs
+
+    python -X importtime 4-search.py "<query>" --db <tmp> --type vector
+
+several times in fresh interpreters. Reports the median time to the first
+printed results, the bare interpreter start-up for comparison, and the
+cumulative import time of each top-level package from `-X importtime`. Fails
+when the time to first query exceeds the target or when docling,
+transformers or torch end up on the query path.
+
+Usage:
+    python -m benchmarks.startup_bench --runs 5 --target-ms 300
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from utils.query_cache import EmbeddingCache
+
+DIMENSIONS = 256
+QUERY = "machine learning"
+FORBIDDEN_PACKAGES = ["docling", "transformers", "torch"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# Runs the CLI and prints the wall clock time once results have been printed,
+# so interpreter teardown (LanceDB runtime, atexit hooks) is not counted
+CHILD = """
+import runpy, sys, time
+sys.argv = ["4-search.py"] + sys.argv[1:]
+runpy.run_path("4-search.py", run_name="__main__")
+print("__first_query_done__", time.time(), flush=True)
+"""
+
+
+def build_fixture(path: str, rows: int, seed: int = 0) -> Dict[str, str]:
+    """Create the chunk table and cache the query vector; return the child environment."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(rows, DIMENSIONS)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    db = lancedb.connect(os.path.join(path, "lancedb"))
+    db.create_table("docling", pa.table({
+        "text": [f"Synthetic chunk {i} about {QUERY}." for i in range(rows)],
+        "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), DIMENSIONS),
+        "metadata": [
+            {
+                "creators": "Jan Kowalski",
+                "date": "2020",
+                "item_type": "journalArticle",
+                "page_numbers": [1 + i % 20],
+                "title": f"Document {i // 20}",
+                "zotero_key": f"K{i // 20:06d}",
+            }
+            for i in range(rows)
+        ],
+    }), mode="overwrite")
+
+    cache_dir = os.path.join(path, "query_cache")
+    cache = EmbeddingCache(cache_dir=cache_dir)
+    cache.put(EmbeddingCache.make_key(QUERY), vectors[0].tolist())
+
+    env = dict(os.environ)
+    env.update({
+        "QUERY_CACHE_DIR": cache_dir,
+        "METRICS_DIR": os.path.join(path, "metrics"),
+        "TRACE_FILE": "",
+    })
+    return env
+
+
+def interpreter_startup(runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append(time.time() - start)
+    return statistics.median(timings)
+
+
+def run_cli(db_path: str, env: Dict[str, str]) -> Tuple[float, str]:
+    """Run the search CLI once; return (seconds to first results, importtime output)."""
+    start = time.time()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, QUERY, "--db", db_path, "--type", "vector", "--limit", "3"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    done = next(line for line in completed.stdout.splitlines() if line.startswith("__first_query_done__"))
+    return float(done.split()[1]) - start, completed.stderr
+
+
+def import_times(stderr: str) -> Dict[str, float]:
+    """Cumulative import time per top-level package (seconds), from -X importtime output."""
+    totals: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        # One space of indentation = imported directly by the script or a function it called
+        if not match or len(match.group(3)) != 1:
+            continue
+        package = match.group(4).split(".")[0]
+        totals[package] = totals.get(package, 0.0) + int(match.group(2)) / 1e6
+    return totals
+
+
+def imported_modules(stderr: str) -> List[str]:
+    return [match.group(4) for match in map(IMPORT_LINE.match, stderr.splitlines()) if match]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--target-ms", type=float, default=300.0)
+    parser.add_argument("--top", type=int, default=12, help="Packages to list in the import breakdown")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        env = build_fixture(path, args.rows)
+        db_path = os.path.join(path, "lancedb")
+
+        # Warm-up run: compiles .pyc files and fills the OS page cache
+        run_cli(db_path, env)
+        runs = [run_cli(db_path, env) for _ in range(args.runs)]
+
+    baseline = interpreter_startup(args.runs)
+    first_query = statistics.median(seconds for seconds, _ in runs)
+    stderr = runs[-1][1]
+    totals = import_times(stderr)
+    forbidden = sorted({
+        name for name in imported_modules(stderr) if name.split(".")[0] in FORBIDDEN_PACKAGES
+    })
+
+    print(f"Interpreter start-up (python -c pass): {baseline * 1000:8.1f} ms")
+    print(f"Time to first query (median of {args.runs}): {first_query * 1000:8.1f} ms")
+    print(f"Imports (sum of top-level packages):    {sum(totals.values()) * 1000:8.1f} ms")
+    print()
+    print(f"{'package':<28}{'cumulative ms':>14}")
+    for package, seconds in sorted(totals.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<28}{seconds * 1000:>14.1f}")
+    print()
+
+    ok = True
+    if forbidden:
+        ok = False
+        print(f"FAIL: heavy packages on the query path: {', '.join(forbidden[:10])}")
+    if first_query * 1000 > args.target_ms:
+        ok = False
+        print(f"FAIL: time to first query {first_query * 1000:.0f} ms > target {args.target_ms:.0f} ms")
+    if ok:
+        print(f"OK: first query in {first_query * 1000:.0f} ms (target {args.target_ms:.0f} ms)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
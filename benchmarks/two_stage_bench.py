@@ -0,0 +1,115 @@
+"""Two-stage (documents -> chunks) vs flat chunk search on a synthetic library.
+
+Generates a library of documents whose chunks are clustered around a
+per-document topic vector, builds the chunk table and the pooled document
+table (utils.document_index), and compares latency and recall@k against the
+exact brute-force top-k for:
+
+* flat:       ANN/flat search over all chunks
+* two-stage:  search over document vectors, then chunk search prefiltered
+              by metadata.zotero_key IN (...)
+
+Usage:
+    python -m benchmarks.two_stage_bench --documents 2000 --chunks-per-document 50 --dim 384
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from utils.document_index import build_document_table, documents_filter, top_documents
+from utils.retrieval import vector_search
+
+
+def build_library(db, documents: int, chunks_per_document: int, dim: int, spread: float, seed: int = 0):
+    """Create the synthetic chunk table; returns the table and the chunk vector matrix."""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(documents, dim)).astype(np.float32)
+    all_vectors = []
+    table = None
+
+    documents_per_batch = max(1, 20000 // chunks_per_document)
+    for start in range(0, documents, documents_per_batch):
+        doc_ids = np.arange(start, min(documents, start + documents_per_batch))
+        doc_of_chunk = np.repeat(doc_ids, chunks_per_document)
+        vectors = topics[doc_of_chunk] + rng.normal(scale=spread, size=(len(doc_of_chunk), dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        all_vectors.append(vectors)
+
+        offset = start * chunks_per_document
+        batch = pa.table({
+            "text": [f"chunk {offset + i}" for i in range(len(doc_of_chunk))],
+            "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), dim),
+            "metadata": [
+                {"creators": None, "date": None, "item_type": "journalArticle",
+                 "page_numbers": None, "title": f"Document {d}", "zotero_key": f"D{d:07d}"}
+                for d in doc_of_chunk
+            ],
+        })
+        if table is None:
+            table = db.create_table("docling", batch, mode="overwrite")
+        else:
+            table.add(batch)
+
+    table.create_scalar_index("metadata.zotero_key", index_type="BTREE")
+    return table, np.concatenate(all_vectors)
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Two-stage vs flat chunk search benchmark")
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--chunks-per-document", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--spread", type=float, default=0.6, help="Chunk noise around the document topic")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--stage-one", type=int, default=20, help="Documents selected in stage one")
+    parser.add_argument("--ann-index", action="store_true", help="Build an IVF_PQ index on chunk vectors")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        db = lancedb.connect(path)
+        print("Building synthetic library...")
+        table, vectors = build_library(db, args.documents, args.chunks_per_document, args.dim, args.spread)
+        if args.ann_index:
+            table.create_index(metric="l2", vector_column_name="vector")
+        documents_table = build_document_table(db, table)
+
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.integers(0, len(vectors), size=args.queries)]
+        queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        def flat(query):
+            return vector_search(table, query.tolist(), args.k)
+
+        def two_stage(query):
+            keys = top_documents(documents_table, query.tolist(), args.stage_one)
+            return vector_search(table, query.tolist(), args.k, documents_filter(keys))
+
+        print(f"chunks={len(vectors)} documents={args.documents} dim={args.dim} k={args.k} stage_one={args.stage_one}")
+        for name, run in [("flat", flat), ("two-stage", two_stage)]:
+            run(queries[0])  # warm-up
+            timings, recalls = [], []
+            for query in queries:
+                truth = {f"chunk {i}" for i in np.argsort(vectors @ -query)[:args.k]}
+                start = time.perf_counter()
+                results = run(query)
+                timings.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(truth & set(results.column("text").to_pylist())) / args.k)
+            print(
+                f"{name:<10} recall@{args.k}={statistics.fmean(recalls):.3f}  "
+                f"p50={statistics.median(timings):.2f} ms  p95={percentile(timings, 95):.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
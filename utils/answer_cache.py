@@ -0,0 +1,150 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.metrics import metrics
+from utils.query_cache import CacheStats
+
+# Czas życia odpowiedzi w cache (sekundy) i maksymalna liczba odpowiedzi
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+# Minimalne podobieństwo kosinusowe pytań uznawanych za to samo pytanie (0 = tylko identyczne)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+_WHITESPACE = re.compile(r"\s+")
+_REPLAY_CHUNK = re.compile(r"\S+\s*|\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Normalizuje pytanie: Unicode NFKC, małe litery, pojedyncze spacje, bez końcowej interpunkcji."""
+    question = unicodedata.normalize("NFKC", question).lower()
+    return _WHITESPACE.sub(" ", question).strip().rstrip("?!. ")
+
+
+def context_fingerprint(chunk_ids: Sequence[str], model: str, prompt_version: str) -> Tuple:
+    """Odcisk kontekstu odpowiedzi: identyfikatory fragmentów (w kolejności), model i wersja promptu."""
+    return (tuple(chunk_ids), model, prompt_version)
+
+
+def replay_chunks(answer: str) -> List[str]:
+    """Dzieli zapamiętaną odpowiedź na kawałki (słowa ze spacjami) do odtworzenia jako strumień."""
+    return _REPLAY_CHUNK.findall(answer)
+
+
+class AnswerCache:
+    """Cache odpowiedzi czatu.
+
+    Klucz to znormalizowane pytanie i odcisk kontekstu (identyfikatory
+    pobranych fragmentów, model, wersja promptu). Wpisy są przypisane do
+    wersji tabeli i znikają przy jej zmianie, tak jak w ResultCache.
+
+    Przy `similarity > 0` pytanie bez dokładnego trafienia może zostać
+    dopasowane do zapamiętanego pytania o tym samym odcisku kontekstu,
+    jeśli podobieństwo kosinusowe ich wektorów jest co najmniej `similarity`.
+    """
+
+    def __init__(
+        self,
+        ttl: float = ANSWER_CACHE_TTL,
+        maxsize: int = ANSWER_CACHE_SIZE,
+        similarity: float = ANSWER_CACHE_SIMILARITY,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.similarity = similarity
+        self.stats = CacheStats()
+        self.semantic_hits = 0
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._table_versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        table_name: str,
+        table_version: int,
+        question: str,
+        fingerprint: Tuple,
+        question_vector: Optional[Sequence[float]] = None,
+    ) -> Optional[str]:
+        with self._lock:
+            self._check_version(table_name, table_version)
+            key = (table_name, normalize_question(question), fingerprint)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry["answer"]
+            if entry is not None:
+                del self._entries[key]
+
+            if self.similarity > 0 and question_vector is not None:
+                similar = self._find_similar(table_name, fingerprint, question_vector)
+                if similar is not None:
+                    self._entries.move_to_end(similar)
+                    self.stats.hits += 1
+                    self.semantic_hits += 1
+                    return self._entries[similar]["answer"]
+
+            self.stats.misses += 1
+            return None
+
+    def put(
+        self,
+        table_name: str,
+        table_version: int,
+        question: str,
+        fingerprint: Tuple,
+        answer: str,
+        question_vector: Optional[Sequence[float]] = None,
+    ):
+        vector = None
+        if question_vector is not None:
+            # Kopia - wektor z cache zapytań jest tylko do odczytu
+            vector = np.array(question_vector, dtype=np.float32)
+            vector /= max(np.linalg.norm(vector), 1e-12)
+
+        with self._lock:
+            self._check_version(table_name, table_version)
+            key = (table_name, normalize_question(question), fingerprint)
+            self._entries[key] = {"time": time.monotonic(), "answer": answer, "vector": vector}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**self.stats.as_dict(), "semantic_hits": self.semantic_hits, "entries": len(self._entries)}
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.monotonic() - entry["time"] >= self.ttl
+
+    def _find_similar(self, table_name: str, fingerprint: Tuple, question_vector: Sequence[float]) -> Optional[Tuple]:
+        candidates = [
+            key for key, entry in self._entries.items()
+            if key[0] == table_name and key[2] == fingerprint and entry["vector"] is not None
+            and not self._expired(entry)
+        ]
+        if not candidates:
+            return None
+
+        query = np.asarray(question_vector, dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        scores = np.stack([self._entries[key]["vector"] for key in candidates]) @ query
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] >= self.similarity else None
+
+    def _check_version(self, table_name: str, table_version: int):
+        if self._table_versions.get(table_name) != table_version:
+            self._table_versions[table_name] = table_version
+            for cached_key in [k for k in self._entries if k[0] == table_name]:
+                del self._entries[cached_key]
+
+
+answer_cache = AnswerCache()
+metrics.register_cache("answers", answer_cache.stats)
@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.query_cache import embed_queries
+from utils.retrieval import RESULT_COLUMNS, vector_search
+
+# Liczba wierszy tabeli w jednej partii skanu w trybie macierzowym
+SCAN_BATCH_SIZE = 4096
+
+# Liczba równoległych zapytań LanceDB w trybie "parallel"
+BATCH_SEARCH_WORKERS = os.cpu_count() or 4
+
+
+def batch_search(
+    table,
+    queries: Sequence[str],
+    limit: int = 5,
+    method: str = "matrix",
+    where: Optional[str] = None,
+) -> pa.Table:
+    """Wyszukuje fragmenty dla wielu zapytań naraz.
+
+    Zapytania są osadzane partiami (z cache wektorów), a wyszukiwanie
+    wykonywane przez batch_vector_search().
+
+    Returns:
+        Tabela Arrow z kolumną `query_index` (pozycja zapytania w `queries`),
+        kolumnami RESULT_COLUMNS i `_distance`
+    """
+    query_vectors = embed_queries(list(queries))
+    return batch_vector_search(table, query_vectors, limit, method, where)
+
+
+def batch_vector_search(
+    table,
+    query_vectors: Sequence[Sequence[float]],
+    limit: int = 5,
+    method: str = "matrix",
+    where: Optional[str] = None,
+) -> pa.Table:
+    """Wyszukuje najbliższe fragmenty dla wielu wektorów zapytań.
+
+    Args:
+        table: Tabela LanceDB z fragmentami
+        query_vectors: Wektory zapytań
+        limit: Liczba wyników na zapytanie
+        method: "matrix" - dokładne wyszukiwanie jednym mnożeniem macierzy na
+            partię skanu tabeli (jeden odczyt wektorów dla wszystkich zapytań);
+            "parallel" - równoległe zapytania ANN do LanceDB
+        where: Filtr SQL (obsługiwany tylko w trybie "parallel")
+    """
+    if method == "matrix" and where is None:
+        return _matrix_search(table, np.asarray(query_vectors, dtype=np.float32), limit)
+    return _parallel_search(table, query_vectors, limit, where)
+
+
+def _parallel_search(table, query_vectors, limit: int, where: Optional[str]) -> pa.Table:
+    columns = RESULT_COLUMNS + ["_distance"]
+    with ThreadPoolExecutor(max_workers=BATCH_SEARCH_WORKERS) as executor:
+        results = list(executor.map(lambda vector: vector_search(table, vector, limit, where), query_vectors))
+
+    tables = [
+        result.select(columns).add_column(
+            0, "query_index", pa.array([query_index] * result.num_rows, pa.int32())
+        )
+        for query_index, result in enumerate(results)
+    ]
+    return pa.concat_tables(tables)
+
+
+def _matrix_search(table, query_matrix: np.ndarray, limit: int) -> pa.Table:
+    dataset = table.to_lance()
+    query_count = query_matrix.shape[0]
+    query_norms = np.einsum("ij,ij->i", query_matrix, query_matrix)[:, None]
+
+    best_distances = np.empty((query_count, 0), dtype=np.float32)
+    best_indices = np.empty((query_count, 0), dtype=np.int64)
+    offset = 0
+
+    for batch in dataset.to_batches(columns=["vector"], batch_size=SCAN_BATCH_SIZE):
+        vectors = batch.column("vector")
+        matrix = vectors.flatten().to_numpy().reshape(len(vectors), -1)
+
+        # Kwadrat odległości L2, tak jak `_distance` w LanceDB
+        distances = query_norms + np.einsum("ij,ij->i", matrix, matrix)[None, :] - 2 * query_matrix @ matrix.T
+        indices = np.broadcast_to(np.arange(offset, offset + len(vectors)), distances.shape)
+        offset += len(vectors)
+
+        candidate_distances = np.concatenate([best_distances, distances], axis=1)
+        candidate_indices = np.concatenate([best_indices, indices], axis=1)
+        k = min(limit, candidate_distances.shape[1])
+        top = np.argpartition(candidate_distances, k - 1, axis=1)[:, :k]
+        best_distances = np.take_along_axis(candidate_distances, top, axis=1)
+        best_indices = np.take_along_axis(candidate_indices, top, axis=1)
+
+    order = np.argsort(best_distances, axis=1)
+    best_distances = np.take_along_axis(best_distances, order, axis=1)
+    best_indices = np.take_along_axis(best_indices, order, axis=1)
+
+    # Pobierz tekst i metadane tylko dla wierszy z wyników
+    unique_indices = np.unique(best_indices)
+    rows = dataset.take(unique_indices.tolist(), columns=RESULT_COLUMNS)
+    results = rows.take(np.searchsorted(unique_indices, best_indices.ravel()))
+
+    results = results.add_column(
+        0, "query_index", pa.array(np.repeat(np.arange(query_count, dtype=np.int32), best_indices.shape[1]))
+    )
+    return results.append_column("_distance", pa.array(best_distances.ravel(), pa.float32()))
+
+
+def results_for_query(results: pa.Table, query_index: int) -> pa.Table:
+    """Zwraca wyniki jednego zapytania z tabeli batch_search()."""
+    mask = pc.equal(results.column("query_index"), query_index)
+    return results.filter(mask)
+
+
+def split_results(results: pa.Table, query_count: int) -> List[pa.Table]:
+    """Dzieli wyniki batch_search() na osobne tabele dla każdego zapytania."""
+    return [results_for_query(results, query_index) for query_index in range(query_count)]
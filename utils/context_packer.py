@@ -0,0 +1,211 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from tiktoken import get_encoding
+
+from utils.retrieval import SearchHit
+
+# To samo kodowanie co OpenAITokenizerWrapper (utils/tokenizer.py)
+ENCODING_NAME = "cl100k_base"
+
+# Budżet tokenów na kontekst w prompcie systemowym
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Ile najlepszych sekcji trafia do kontekstu w całości; dalsze są skracane
+FULL_SECTIONS = int(os.getenv("CONTEXT_FULL_SECTIONS", "2"))
+
+# Maksymalny rozmiar skróconej sekcji (tokeny)
+TRIMMED_SECTION_TOKENS = int(os.getenv("CONTEXT_TRIMMED_SECTION_TOKENS", "300"))
+
+# Sekcji nie warto skracać poniżej tej liczby tokenów
+MIN_SECTION_TOKENS = 40
+
+# Najdłuższe sprawdzane nakładanie się sąsiednich fragmentów (znaki)
+MAX_OVERLAP_CHARS = 2000
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\w+")
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Liczy tokeny tekstu tokenizerem tiktoken używanym przy chunkingu."""
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+@dataclass
+class ContextSection:
+    """Fragment kontekstu: jeden lub kilka sąsiednich chunków tego samego dokumentu."""
+
+    text: str
+    hits: List[SearchHit]
+    page_numbers: Optional[List[int]] = None
+    trimmed: bool = False
+    tokens: int = 0
+
+    @property
+    def source(self) -> str:
+        first = self.hits[0]
+        return SearchHit(
+            "", first.title, first.creators, first.date, first.item_type, self.page_numbers, first.zotero_key
+        ).source
+
+    @property
+    def zotero_key(self) -> Optional[str]:
+        return self.hits[0].zotero_key
+
+    def format(self, text: Optional[str] = None) -> str:
+        """Formatuje sekcję do promptu: treść, źródło i klucz Zotero (adres dla stron WWW)."""
+        formatted = f"{self.text if text is None else text}\nSource: {self.source}"
+        if self.hits[0].url:
+            formatted += f"\nURL: {self.hits[0].url}"
+        elif self.zotero_key:
+            formatted += f"\nZotero Key: {self.zotero_key}"
+        return formatted
+
+
+@dataclass
+class PackedContext:
+    """Wynik pakowania kontekstu."""
+
+    sections: List[ContextSection] = field(default_factory=list)
+    tokens: int = 0
+    budget: int = CONTEXT_TOKEN_BUDGET
+    input_hits: int = 0
+    dropped_hits: int = 0
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(section.format() for section in self.sections)
+
+    def summary(self) -> str:
+        trimmed = sum(section.trimmed for section in self.sections)
+        return (
+            f"kontekst: {self.tokens}/{self.budget} tokenów, {len(self.sections)} sekcji "
+            f"z {self.input_hits} fragmentów (skróconych: {trimmed}, pominiętych: {self.dropped_hits})"
+        )
+
+
+def merge_texts(first: str, second: str) -> str:
+    """Łączy dwa teksty, usuwając powtórzone nakładanie się końca i początku."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for size in range(min(len(first), len(second), MAX_OVERLAP_CHARS), 19, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def _pages_adjacent(first: Optional[List[int]], second: Optional[List[int]]) -> bool:
+    if not first or not second:
+        return False
+    return min(second) <= max(first) + 1 and min(first) <= max(second) + 1
+
+
+def merge_adjacent_hits(hits: List[SearchHit]) -> List[ContextSection]:
+    """Łączy trafienia z tego samego dokumentu i sąsiednich stron w sekcje.
+
+    Sekcje zachowują kolejność najlepszego trafienia, a treść w sekcji jest
+    ułożona według stron.
+    """
+    sections: List[ContextSection] = []
+    for hit in hits:
+        target = next(
+            (
+                section for section in sections
+                if hit.zotero_key and section.zotero_key == hit.zotero_key
+                and _pages_adjacent(section.page_numbers, hit.page_numbers)
+            ),
+            None,
+        )
+        if target is None:
+            sections.append(ContextSection(hit.text, [hit], hit.page_numbers))
+            continue
+
+        target.hits.append(hit)
+        if min(hit.page_numbers) < min(target.page_numbers):
+            target.text = merge_texts(hit.text, target.text)
+        else:
+            target.text = merge_texts(target.text, hit.text)
+        target.page_numbers = sorted(set(target.page_numbers) | set(hit.page_numbers))
+    return sections
+
+
+def _query_terms(query: str) -> set:
+    # Pięcioznakowe prefiksy dopasowują odmienione formy (np. "białka" / "białkach")
+    return {word[:5] for word in _WORD.findall(query.lower()) if len(word) >= 3}
+
+
+def trim_to_relevant_sentences(text: str, query: str, max_tokens: int) -> str:
+    """Skraca tekst do zdań najlepiej pasujących do zapytania, w oryginalnej kolejności."""
+    sentences = [s for s in _SENTENCE_SPLIT.split(text) if s.strip()]
+    terms = _query_terms(query)
+
+    def score(sentence: str) -> float:
+        words = [word[:5] for word in _WORD.findall(sentence.lower())]
+        return sum(word in terms for word in words) / (len(words) ** 0.5 or 1)
+
+    ranked = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)
+    selected = []
+    used = 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i])
+        if used + tokens > max_tokens:
+            continue
+        selected.append(i)
+        used += tokens
+    return " ".join(sentences[i] for i in sorted(selected))
+
+
+def pack_context(hits: List[SearchHit], query: str, budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """Buduje kontekst dla LLM mieszczący się w budżecie tokenów.
+
+    Trafienia (w kolejności trafności) są łączone w sekcje sąsiednich
+    fragmentów tego samego dokumentu, powtórzenia są usuwane, a sekcje dodawane
+    do wyczerpania budżetu. Pierwsze FULL_SECTIONS sekcji trafia w całości,
+    pozostałe (oraz te, które nie mieszczą się w całości) są skracane do
+    najtrafniejszych zdań.
+    """
+    packed = PackedContext(budget=budget, input_hits=len(hits))
+    seen_texts: List[str] = []
+
+    for position, section in enumerate(merge_adjacent_hits(hits)):
+        if any(section.text in text for text in seen_texts):
+            packed.dropped_hits += len(section.hits)
+            continue
+
+        remaining = budget - packed.tokens
+        # Tokeny samego opisu źródła liczymy razem z treścią
+        overhead = count_tokens(section.format(""))
+        tokens = count_tokens(section.text) + overhead
+
+        limit = remaining if position < FULL_SECTIONS else min(remaining, TRIMMED_SECTION_TOKENS + overhead)
+        if tokens > limit:
+            if limit - overhead < MIN_SECTION_TOKENS:
+                packed.dropped_hits += len(section.hits)
+                continue
+            section.text = trim_to_relevant_sentences(section.text, query, limit - overhead)
+            section.trimmed = True
+            if not section.text:
+                packed.dropped_hits += len(section.hits)
+                continue
+            tokens = count_tokens(section.text) + overhead
+
+        section.tokens = tokens
+        packed.sections.append(section)
+        packed.tokens += tokens
+        seen_texts.append(section.text)
+
+    return packed
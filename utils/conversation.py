@@ -0,0 +1,190 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from utils.context_packer import count_tokens
+
+# Budżet tokenów historii rozmowy wysyłanej do modelu (bez kontekstu z biblioteki)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+
+# Maksymalna długość streszczenia starszej części rozmowy (tokeny)
+SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+
+# Ile ostatnich tokenów historii trafia do przeformułowania pytania
+CONDENSE_HISTORY_TOKENS = int(os.getenv("CONDENSE_HISTORY_TOKENS", "800"))
+
+# Czy przeformułowywać pytania uzupełniające w samodzielne zapytania do wyszukiwania
+CONDENSE_QUERIES = os.getenv("CONDENSE_QUERIES", "1") == "1"
+
+MEMORY_MODEL = os.getenv("MEMORY_MODEL", "gpt-4o-mini")
+
+# Narzut formatu wiadomości czatu (rola, separatory) w tokenach
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CONDENSE_PROMPT = """Given the conversation and a follow-up question, rewrite the follow-up question
+as a standalone search query for a library of scientific documents. Resolve references such as
+"it", "the second study" or "that author" using the conversation. Keep the language of the question.
+Return only the query.
+
+Summary of earlier conversation:
+{summary}
+
+Recent conversation:
+{history}
+
+Follow-up question: {question}"""
+
+SUMMARY_PROMPT = """Update the summary of a conversation between a user and an assistant answering
+questions about a Zotero library. Keep the documents, authors, findings and open questions that later
+questions may refer to. Write at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+
+@dataclass
+class ConversationState:
+    """Pamięć rozmowy przechowywana przez klienta i odsyłana z każdym pytaniem.
+
+    `summarized` to liczba początkowych wiadomości historii zawartych już
+    w streszczeniu `summary`; dalsze wiadomości wysyłane są dosłownie.
+    """
+
+    summary: str = ""
+    summarized: int = 0
+
+    @classmethod
+    def from_dict(cls, data: Dict | None, message_count: int) -> "ConversationState":
+        """Odtwarza stan z żądania; stan niepasujący do historii jest resetowany."""
+        data = data or {}
+        summarized = data.get("summarized", 0)
+        if not isinstance(summarized, int) or not 0 <= summarized < message_count:
+            return cls()
+        return cls(str(data.get("summary", "")), summarized)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def format_messages(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+
+def split_history(
+    messages: List[Dict[str, str]],
+    state: ConversationState,
+    budget: int = HISTORY_TOKEN_BUDGET,
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """Dzieli niestreszczoną część historii na wiadomości wysyłane i nadmiarowe.
+
+    Od końca zachowywane są wiadomości mieszczące się w budżecie (ostatnia,
+    czyli pytanie, zawsze). Starsze wiadomości są zwracane jako nadmiar do
+    dopisania do streszczenia.
+
+    Returns:
+        (wiadomości do wysłania, nadmiarowe wiadomości w kolejności)
+    """
+    pending = messages[state.summarized:]
+    budget -= count_tokens(state.summary)
+
+    kept = 0
+    used = 0
+    for message in reversed(pending):
+        tokens = message_tokens(message)
+        if kept and used + tokens > budget:
+            break
+        used += tokens
+        kept += 1
+
+    # Historia zaczyna się od pytania użytkownika, nie od urwanej odpowiedzi
+    while kept > 1 and pending[len(pending) - kept]["role"] != "user":
+        kept -= 1
+    return pending[len(pending) - kept:], pending[:len(pending) - kept]
+
+
+def build_history(
+    messages: List[Dict[str, str]],
+    state: ConversationState,
+    budget: int = HISTORY_TOKEN_BUDGET,
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """Zwraca historię do wysłania (streszczenie + ostatnie wiadomości) i nadmiar do streszczenia."""
+    recent, overflow = split_history(messages, state, budget)
+    history = []
+    if state.summary:
+        history.append({"role": "system", "content": f"Summary of the earlier conversation:\n{state.summary}"})
+    return history + recent, overflow
+
+
+def _recent_history(messages: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    selected = []
+    used = 0
+    for message in reversed(messages):
+        used += message_tokens(message)
+        if used > max_tokens:
+            break
+        selected.append(message)
+    return selected[::-1]
+
+
+async def condense_query(
+    client,
+    messages: List[Dict[str, str]],
+    state: ConversationState,
+    model: str = MEMORY_MODEL,
+) -> str:
+    """Zamienia ostatnie pytanie i historię w samodzielne zapytanie do wyszukiwania.
+
+    Pierwsze pytanie rozmowy jest zwracane bez zmian. Do modelu trafia
+    streszczenie i maks. CONDENSE_HISTORY_TOKENS ostatnich tokenów historii,
+    więc koszt nie rośnie z długością rozmowy.
+    """
+    question = messages[-1]["content"]
+    earlier = messages[state.summarized:-1]
+    if not CONDENSE_QUERIES or (not earlier and not state.summary):
+        return question
+
+    prompt = CONDENSE_PROMPT.format(
+        summary=state.summary or "-",
+        history=format_messages(_recent_history(earlier, CONDENSE_HISTORY_TOKENS)) or "-",
+        question=question,
+    )
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=100,
+    )
+    return (response.choices[0].message.content or "").strip() or question
+
+
+async def update_summary(
+    client,
+    state: ConversationState,
+    overflow: List[Dict[str, str]],
+    model: str = MEMORY_MODEL,
+) -> ConversationState:
+    """Dopisuje nadmiarowe wiadomości do streszczenia.
+
+    Wiadomości nadmiarowe mieszczą się w budżecie historii z poprzedniej tury,
+    więc wywołanie ma ograniczony rozmiar niezależnie od długości rozmowy.
+    """
+    if not overflow:
+        return state
+
+    prompt = SUMMARY_PROMPT.format(
+        max_words=int(SUMMARY_MAX_TOKENS * 0.75),
+        summary=state.summary or "-",
+        messages=format_messages(overflow),
+    )
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    summary = (response.choices[0].message.content or "").strip()
+    return ConversationState(summary, state.summarized + len(overflow))
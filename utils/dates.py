@@ -0,0 +1,87 @@
+import re
+from typing import List, Optional
+
+from utils.indexes import sql_literal
+
+# Kolumna ze znormalizowaną datą (RRRR, RRRR-MM lub RRRR-MM-DD), na której działają filtry dat
+DATE_COLUMN = "metadata.parsed_date"
+
+# Trzyliterowe początki nazw miesięcy (angielskie i polskie, "mar" jest wspólne)
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+    "sty": 1, "lut": 2, "kwi": 4, "maj": 5, "cze": 6,
+    "lip": 7, "sie": 8, "wrz": 9, "paź": 10, "paz": 10, "lis": 11, "gru": 12,
+}
+
+ISO_BOUND = re.compile(r"\d{4}(-\d{2}(-\d{2})?)?")
+
+_YMD = re.compile(r"\b(\d{4})[-/.](\d{1,2})(?:[-/.](\d{1,2}))?\b")
+_DMY = re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})\b")
+_DAY_MONTH_YEAR = re.compile(r"\b(\d{1,2})\.?\s+([^\W\d_]{3,})\.?,?\s+(\d{4})\b")
+_MONTH_DAY_YEAR = re.compile(r"\b([^\W\d_]{3,})\.?\s+(?:(\d{1,2}),?\s+)?(\d{4})\b")
+_YEAR = re.compile(r"\b(\d{4})\b")
+
+
+def _format(year: str, month: Optional[int] = None, day: Optional[int] = None) -> str:
+    if not month or not 1 <= month <= 12:
+        return year
+    if not day or not 1 <= day <= 31:
+        return f"{year}-{month:02d}"
+    return f"{year}-{month:02d}-{day:02d}"
+
+
+def _month(name: str) -> Optional[int]:
+    return MONTHS.get(name[:3].lower())
+
+
+def parse_date(value: Optional[str]) -> Optional[str]:
+    """Normalizuje datę Zotero w dowolnym zapisie do RRRR, RRRR-MM lub RRRR-MM-DD.
+
+    Obsługuje `meta.parsedDate` z API Zotero ("2019-03-00"), daty ISO,
+    "15.03.2019", "15 March 2019", "March 15, 2019", "marzec 2019"
+    i sam rok. Zwraca None, gdy w tekście nie ma roku.
+    """
+    if not value:
+        return None
+    text = str(value).strip()
+    match = _YMD.search(text)
+    if match:
+        year, month, day = match.groups()
+        return _format(year, int(month), int(day) if day else None)
+    match = _DMY.search(text)
+    if match:
+        first, second, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        # Domyślnie dzień przed miesiącem (zapis polski), chyba że to niemożliwe (03/15/2019)
+        day, month = (second, first) if second > 12 >= first else (first, second)
+        return _format(year, month, day)
+    match = _DAY_MONTH_YEAR.search(text)
+    if match and _month(match.group(2)):
+        return _format(match.group(3), _month(match.group(2)), int(match.group(1)))
+    match = _MONTH_DAY_YEAR.search(text)
+    if match and _month(match.group(1)):
+        return _format(match.group(3), _month(match.group(1)), int(match.group(2)) if match.group(2) else None)
+    match = _YEAR.search(text)
+    return match.group(1) if match else None
+
+
+def date_range_conditions(start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+    """Warunki SQL dla dat w zakresie [start, end] na kolumnie DATE_COLUMN.
+
+    Granice podaje się jako RRRR, RRRR-MM lub RRRR-MM-DD; `end` obejmuje
+    cały podany okres (end="2019" obejmuje "2019-12-31"). Dokumenty bez
+    rozpoznanej daty nie spełniają warunku.
+
+    Raises:
+        ValueError: Gdy granica nie jest w formacie ISO
+    """
+    for bound in (start, end):
+        if bound and not ISO_BOUND.fullmatch(bound):
+            raise ValueError(f"Nieprawidłowa data '{bound}' - oczekiwano RRRR, RRRR-MM lub RRRR-MM-DD")
+    conditions = []
+    if start:
+        conditions.append(f"{DATE_COLUMN} >= {sql_literal(start)}")
+    if end:
+        # Górna granica obejmuje wszystkie daty zaczynające się od `end`
+        conditions.append(f"{DATE_COLUMN} <= {sql_literal(end + chr(0xFFFF))}")
+    return conditions
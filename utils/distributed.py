@@ -0,0 +1,454 @@
+import argparse
+import json
+import os
+import pickle
+import random
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.metrics import metrics
+
+load_dotenv()
+
+# Katalog współdzielony przez wszystkie węzły (np. NFS), obok współdzielonego data/cache
+DISTRIBUTED_DIR = os.getenv("DISTRIBUTED_DIR", "data/distributed")
+
+# Po tylu sekundach bez odnowienia dzierżawa wygasa i dokument może przejąć inny węzeł
+LEASE_SECONDS = float(os.getenv("DISTRIBUTED_LEASE_SECONDS", "300"))
+
+# Co ile sekund węzeł sprawdza dokumenty dzierżawione przez inne węzły
+POLL_SECONDS = 5.0
+
+# Co ile sekund węzeł zapisuje swój manifest
+MANIFEST_FLUSH_SECONDS = 5.0
+
+
+def default_node_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _safe_name(key: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in key)
+
+
+def write_json_atomic(data: Any, path: str):
+    """Zapisuje JSON atomowo; nazwa pliku tymczasowego jest unikalna dla hosta i procesu."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_json(path: str) -> Optional[Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class LeaseStore:
+    """Dzierżawy dokumentów jako pliki w katalogu współdzielonym.
+
+    Dzierżawę zakłada się przez utworzenie pliku z O_CREAT | O_EXCL (tylko
+    jeden węzeł wygrywa). Wygasłą dzierżawę przejmuje ten węzeł, któremu uda
+    się atomowo przenieść jej plik (os.rename), po czym zakłada własną.
+    Przeniesiony plik jest czytany ponownie: jeśli to już nie ta wygasła
+    dzierżawa, którą węzeł sprawdził (inny węzeł zdążył ją przejąć lub
+    odnowić), wraca na miejsce. Odnowienie działa tak samo - plik jest
+    przenoszony, sprawdzany i zastępowany nowym bez nadpisywania dzierżawy
+    założonej w międzyczasie przez inny węzeł (os.link). Czas wygaśnięcia
+    jest zapisany jako czas bezwzględny, więc zegary hostów muszą być
+    zsynchronizowane (NTP).
+
+    Dzierżawy chronią przed dublowaniem pracy; poprawności wyników pilnują
+    atomowe zapisy cache - nawet dwa węzły przetwarzające ten sam dokument
+    zapiszą jeden kompletny plik.
+    """
+
+    def __init__(self, directory: str, node: str, lease_seconds: float = LEASE_SECONDS):
+        self.directory = directory
+        self.node = node
+        self.lease_seconds = lease_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{_safe_name(key)}.lease")
+
+    def _lease(self, key: str) -> Dict[str, Any]:
+        return {
+            "key": key,
+            "node": self.node,
+            "expires_at": time.time() + self.lease_seconds,
+            "acquired_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def holder(self, key: str) -> Optional[Dict[str, Any]]:
+        """Aktualna dzierżawa dokumentu (None, gdy jej nie ma lub plik jest w trakcie zapisu)."""
+        return read_json(self._path(key))
+
+    def _expired(self, path: str, lease: Optional[Dict[str, Any]]) -> bool:
+        if lease is not None:
+            return lease["expires_at"] < time.time()
+        # Plik bez poprawnej treści (węzeł padł w trakcie zapisu) - wiek według czasu modyfikacji
+        try:
+            return os.path.getmtime(path) + self.lease_seconds < time.time()
+        except FileNotFoundError:
+            return True
+
+    @staticmethod
+    def _put_back(moved_path: str, path: str) -> bool:
+        """Przywraca przeniesiony plik dzierżawy, chyba że w tym czasie powstała nowa (os.link nie nadpisuje)."""
+        try:
+            os.link(moved_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(moved_path)
+
+    def try_acquire(self, key: str) -> bool:
+        path = self._path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                lease = read_json(path)
+                if not self._expired(path, lease):
+                    return False
+                # Przejęcie wygasłej dzierżawy: rename udaje się tylko jednemu węzłowi
+                expired_path = f"{path}.{self.node}.expired"
+                try:
+                    os.rename(path, expired_path)
+                except FileNotFoundError:
+                    continue
+                # Między odczytem a rename inny węzeł mógł przejąć lub odnowić dzierżawę -
+                # przeniesiony plik musi być tą samą wygasłą dzierżawą
+                moved = read_json(expired_path)
+                same = moved == lease if lease is not None else self._expired(expired_path, moved)
+                if not same:
+                    self._put_back(expired_path, path)
+                    return False
+                os.unlink(expired_path)
+                metrics.inc("lease_takeovers")
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._lease(key), f)
+            return True
+        return False
+
+    def renew(self, key: str) -> bool:
+        """Przedłuża własną dzierżawę; False, gdy przejął ją inny węzeł."""
+        path = self._path(key)
+        lease = self.holder(key)
+        if not lease or lease["node"] != self.node:
+            return False
+        # Nowa treść obok, stara dzierżawa przeniesiona i sprawdzona przed podmianą
+        renewed_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(renewed_path, 'w', encoding='utf-8') as f:
+            json.dump(self._lease(key), f)
+        moved_path = f"{path}.{self.node}.renew"
+        try:
+            try:
+                os.rename(path, moved_path)
+            except FileNotFoundError:
+                return False
+            moved = read_json(moved_path)
+            if not moved or moved["node"] != self.node:
+                self._put_back(moved_path, path)
+                return False
+            os.unlink(moved_path)
+            try:
+                os.link(renewed_path, path)
+            except FileExistsError:  # inny węzeł założył dzierżawę, gdy pliku nie było
+                return False
+            return True
+        finally:
+            os.unlink(renewed_path)
+
+    def release(self, key: str):
+        lease = self.holder(key)
+        if lease and lease["node"] == self.node:
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def remove_expired(self) -> int:
+        """Usuwa wygasłe dzierżawy (np. dokumentów ukończonych przez osierocone procesy węzła, który padł)."""
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".lease") and self._expired(path, read_json(path)):
+                try:
+                    os.unlink(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def active(self) -> List[Dict[str, Any]]:
+        leases = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".lease"):
+                lease = read_json(os.path.join(self.directory, name))
+                if lease:
+                    leases.append(lease)
+        return leases
+
+
+class ExtractionNode:
+    """Węzeł rozproszonej ekstrakcji bez koordynatora.
+
+    Każdy węzeł pobiera listę dokumentów, przegląda ją we własnej losowej
+    kolejności i przetwarza lokalną pulą procesów dokumenty, na które uda mu
+    się założyć dzierżawę. Dokument jest gotowy, gdy istnieje jego plik cache.
+    Węzeł kończy pracę dopiero, gdy wszystkie dokumenty są gotowe lub
+    oznaczone jako błędne, więc dokumenty węzła, który padł, przejmą inne po
+    wygaśnięciu dzierżaw.
+    """
+
+    def __init__(
+        self,
+        node: Optional[str] = None,
+        shared_dir: str = DISTRIBUTED_DIR,
+        max_workers: int = 1,
+        lease_seconds: float = LEASE_SECONDS,
+        poll_seconds: float = POLL_SECONDS,
+    ):
+        self.node = node or default_node_name()
+        self.shared_dir = shared_dir
+        self.max_workers = max_workers
+        self.poll_seconds = poll_seconds
+        self.leases = LeaseStore(os.path.join(shared_dir, "leases"), self.node, lease_seconds)
+        self.renew_seconds = lease_seconds / 3
+        self.failed_dir = os.path.join(shared_dir, "failed")
+        self.manifest_path = os.path.join(shared_dir, "manifests", f"{_safe_name(self.node)}.json")
+        self.manifest: Dict[str, Any] = {
+            "node": self.node,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "documents": {},
+        }
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def _failed_path(self, key: str) -> str:
+        return os.path.join(self.failed_dir, f"{_safe_name(key)}.json")
+
+    def is_failed(self, key: str) -> bool:
+        return os.path.exists(self._failed_path(key))
+
+    def run(
+        self,
+        tasks: Dict[str, Any],
+        process: Callable[[Any], Dict[str, Any]],
+        is_done: Callable[[str], bool],
+    ) -> Dict[str, Any]:
+        """Przetwarza zadania `{klucz: dane}` funkcją `process` (wykonywaną w puli procesów).
+
+        `process` zwraca słownik jak process_single_document() (success, title,
+        error, metrics) i sam zapisuje wynik do cache; `is_done(klucz)`
+        sprawdza, czy wynik już istnieje.
+        """
+        order = list(tasks)
+        random.Random(self.node).shuffle(order)
+        deferred: List[str] = []
+        finished = set()
+        in_flight: Dict[Any, str] = {}
+        last_renewal = last_flush = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                # Zajmij kolejne wolne dokumenty, aż pula procesów będzie pełna
+                while order and len(in_flight) < self.max_workers:
+                    key = order.pop()
+                    if is_done(key) or self.is_failed(key):
+                        finished.add(key)
+                    elif self.leases.try_acquire(key):
+                        if is_done(key):  # ukończony przez inny węzeł między sprawdzeniami
+                            self.leases.release(key)
+                            finished.add(key)
+                            continue
+                        in_flight[executor.submit(process, tasks[key])] = key
+                        self.manifest["documents"][key] = {"status": "processing", "started": time.time()}
+                    else:
+                        deferred.append(key)
+
+                if not in_flight:
+                    if not deferred:
+                        break
+                    # Pozostałe dokumenty dzierżawią inne węzły - czekaj na ich wyniki lub wygaśnięcie dzierżaw
+                    time.sleep(self.poll_seconds)
+                    order, deferred = deferred, []
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.renew_seconds, return_when=FIRST_COMPLETED)
+                if time.monotonic() - last_renewal >= self.renew_seconds:
+                    for key in in_flight.values():
+                        if not self.leases.renew(key):
+                            print(f"  ⚠ Dzierżawę {key} przejął inny węzeł")
+                    last_renewal = time.monotonic()
+
+                for future in done:
+                    key = in_flight.pop(future)
+                    self._record(key, future)
+                    self.leases.release(key)
+                    finished.add(key)
+
+                if time.monotonic() - last_flush >= MANIFEST_FLUSH_SECONDS:
+                    self.flush()
+                    last_flush = time.monotonic()
+
+        self.leases.remove_expired()
+        self.manifest["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        self.flush()
+        return self.manifest
+
+    def _record(self, key: str, future):
+        entry = self.manifest["documents"][key]
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"success": False, "error": f"Nieoczekiwany błąd w procesie: {e}", "title": key}
+        metrics.merge(result.pop('metrics', None))
+        entry.update(
+            status=("cached" if result.get('cached') else "ok") if result['success'] else "error",
+            title=result.get('title'),
+            seconds=round(time.time() - entry.pop("started"), 2),
+        )
+        if result['success']:
+            print(f"  ✓ [{self.node}] {result.get('title')}")
+        else:
+            entry["error"] = result['error']
+            # Inne węzły nie ponawiają dokumentu z błędem (do `reset-failed`)
+            write_json_atomic({"node": self.node, "error": result['error']}, self._failed_path(key))
+            print(f"  ❌ [{self.node}] {result.get('title')} - {result['error']}")
+
+    def flush(self):
+        write_json_atomic(self.manifest, self.manifest_path)
+
+
+def merge_manifests(shared_dir: str = DISTRIBUTED_DIR) -> Dict[str, Any]:
+    """Łączy manifesty węzłów w `{shared_dir}/manifest.json` (dokument -> węzeł, status, czas)."""
+    manifests_dir = os.path.join(shared_dir, "manifests")
+    merged: Dict[str, Any] = {"documents": {}, "nodes": {}}
+    for name in sorted(os.listdir(manifests_dir)) if os.path.isdir(manifests_dir) else []:
+        if not name.endswith(".json"):
+            continue
+        manifest = read_json(os.path.join(manifests_dir, name))
+        if not manifest:
+            continue
+        statuses: Dict[str, int] = {}
+        for key, entry in manifest["documents"].items():
+            statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+            previous = merged["documents"].get(key)
+            # Dokument przetworzony dwukrotnie (przejęta dzierżawa) - liczy się udany wynik
+            if previous is None or previous["status"] in ("error", "processing"):
+                merged["documents"][key] = {**entry, "node": manifest["node"]}
+        merged["nodes"][manifest["node"]] = {
+            "started_at": manifest.get("started_at"),
+            "finished_at": manifest.get("finished_at"),
+            "documents": statuses,
+        }
+    write_json_atomic(merged, os.path.join(shared_dir, "manifest.json"))
+    return merged
+
+
+def process_item(item_data: Dict[str, Any]) -> Dict[str, Any]:
+    """process_single_document() bez odsyłania dokumentu - jest już w cache, węzeł potrzebuje tylko statusu."""
+    from utils.zotero_handler import process_single_document
+
+    result = process_single_document(item_data)
+    result.pop('doc_info', None)
+    result.pop('profile', None)
+    return result
+
+
+def zotero_tasks() -> Dict[str, Dict[str, Any]]:
+    from utils.zotero_handler import get_zotero_items_with_pdfs
+
+    return {item['key']: {'item': item} for item in get_zotero_items_with_pdfs()}
+
+
+def cache_path_of(item_data: Dict[str, Any]) -> str:
+    from utils.zotero_handler import get_cache_filename
+
+    return get_cache_filename(item_data['item']['key'], item_data['item']['attachment_key'])
+
+
+def run_node(args: argparse.Namespace):
+    tasks = zotero_tasks()
+    node = ExtractionNode(args.node, args.shared_dir, args.workers, args.lease_seconds)
+    print(f"Węzeł {node.node}: {len(tasks)} dokumentów, {args.workers} procesów, katalog {args.shared_dir}")
+    start = time.time()
+    node.run(tasks, process_item, lambda key: os.path.exists(cache_path_of(tasks[key])))
+    merged = merge_manifests(args.shared_dir)
+    print(f"\nWęzeł {node.node} zakończył w {time.time() - start:.1f} s; "
+          f"w manifeście {len(merged['documents'])} dokumentów z {len(merged['nodes'])} węzłów")
+    print(metrics.format_summary())
+    print(f"Metryki zapisano do {metrics.write_prometheus(f'extraction_{_safe_name(node.node)}')}")
+
+
+def merge_documents(args: argparse.Namespace):
+    """Łączy manifesty i zapisuje dokumenty z cache do pliku dokumentów (jak 1-extraction.py)."""
+    from utils.pipeline import DOCS_FILE, write_pickle
+
+    merged = merge_manifests(args.shared_dir)
+    tasks = zotero_tasks()
+    docs = []
+    for key in sorted(tasks):
+        cache_path = cache_path_of(tasks[key])
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                docs.append(pickle.load(f))
+    missing = len(tasks) - len(docs)
+    write_pickle(docs, DOCS_FILE)
+    print(f"Zapisano {len(docs)} dokumentów do {DOCS_FILE} (bez wyniku: {missing}; "
+          f"węzły: {', '.join(merged['nodes']) or 'brak'})")
+
+
+def print_status(args: argparse.Namespace):
+    leases = LeaseStore(os.path.join(args.shared_dir, "leases"), default_node_name()).active()
+    now = time.time()
+    expired = sum(1 for lease in leases if lease["expires_at"] < now)
+    failed_dir = os.path.join(args.shared_dir, "failed")
+    failed = len(os.listdir(failed_dir)) if os.path.isdir(failed_dir) else 0
+    merged = merge_manifests(args.shared_dir)
+    print(f"Dzierżawy: {len(leases)} (wygasłe: {expired}), dokumenty z błędem: {failed}")
+    for node, summary in merged["nodes"].items():
+        counts = ", ".join(f"{status}={count}" for status, count in sorted(summary["documents"].items()))
+        print(f"  {node}: {counts} (koniec: {summary['finished_at'] or 'w toku'})")
+
+
+def reset_failed(args: argparse.Namespace):
+    failed_dir = os.path.join(args.shared_dir, "failed")
+    names = os.listdir(failed_dir) if os.path.isdir(failed_dir) else []
+    for name in names:
+        os.unlink(os.path.join(failed_dir, name))
+    print(f"Usunięto {len(names)} oznaczeń błędów - dokumenty zostaną ponowione")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Rozproszona ekstrakcja dokumentów Zotero (bez koordynatora)")
+    parser.add_argument("--shared-dir", default=DISTRIBUTED_DIR, help="Katalog dzierżaw i manifestów (współdzielony)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Uruchom węzeł")
+    run_parser.add_argument("--node", help="Nazwa węzła (domyślnie host-pid)")
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    run_parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    subparsers.add_parser("merge", help="Połącz manifesty i zapisz plik dokumentów")
+    subparsers.add_parser("status", help="Pokaż dzierżawy i postęp węzłów")
+    subparsers.add_parser("reset-failed", help="Usuń oznaczenia dokumentów z błędem")
+    args = parser.parse_args(argv)
+
+    {"run": run_node, "merge": merge_documents, "status": print_status, "reset-failed": reset_failed}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
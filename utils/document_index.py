@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+
+from utils.indexes import sql_literal
+
+DOCUMENTS_TABLE_NAME = "docling_documents"
+
+# Pola metadanych przenoszone z fragmentów do tabeli dokumentów
+DOCUMENT_FIELDS = ["title", "creators", "date", "item_type"]
+
+# Liczba wierszy tabeli fragmentów w jednej partii skanu
+SCAN_BATCH_SIZE = 4096
+
+# Do tylu dokumentów w partii sumy liczy mnożenie macierzy (BLAS), powyżej np.add.at
+ONE_HOT_MAX_GROUPS = 256
+
+
+def group_sums(matrix: np.ndarray, inverse: np.ndarray, groups: int) -> np.ndarray:
+    """Sumy wierszy `matrix` w grupach `inverse` (indeksy 0..groups-1).
+
+    Fragmenty dokumentu leżą w tabeli obok siebie, więc partia zwykle
+    obejmuje kilkadziesiąt dokumentów - wtedy macierz przynależności razy
+    wektory jest najszybsza; przy wielu grupach jej koszt rośnie i lepsze
+    jest np.add.at.
+    """
+    if groups <= ONE_HOT_MAX_GROUPS:
+        one_hot = (inverse[None, :] == np.arange(groups)[:, None]).astype(matrix.dtype)
+        return one_hot @ matrix
+    sums = np.zeros((groups, matrix.shape[1]), dtype=matrix.dtype)
+    np.add.at(sums, inverse, matrix)
+    return sums
+
+
+def pool_document_vectors(chunk_table, batch_size: int = SCAN_BATCH_SIZE) -> pa.Table:
+    """Liczy wektor każdego dokumentu jako znormalizowaną średnią wektorów jego fragmentów.
+
+    Tabela fragmentów jest czytana partiami, więc w pamięci są tylko sumy
+    wektorów dla dokumentów. Fragmenty partii są grupowane po kluczu w numpy
+    (np.unique + group_sums), bez pętli po wierszach.
+
+    Oprócz płaskich kolumn DOCUMENT_FIELDS wynik ma kolumnę `metadata` z
+    polami dokumentu fragmentów (bez numerów stron), więc filtry SQL
+    wyszukiwania (`metadata.parsed_date >= ...`) działają też na tabeli dokumentów.
+    """
+    positions: Dict[str, int] = {}
+    keys: List[str] = []
+    sums = None
+    counts = np.zeros(0, dtype=np.int64)
+    metadata_parts = []
+
+    scanner = chunk_table.to_lance().to_batches(columns=["vector", "metadata"], batch_size=batch_size)
+    for batch in scanner:
+        if batch.num_rows == 0:
+            continue
+        vectors = batch.column("vector")
+        matrix = vectors.flatten().to_numpy().reshape(len(vectors), -1).astype(np.float32, copy=False)
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        batch_metadata = batch.column("metadata")
+        batch_keys = batch_metadata.field("zotero_key").to_numpy(zero_copy_only=False)
+
+        unique, first, inverse, batch_counts = np.unique(
+            batch_keys, return_index=True, return_inverse=True, return_counts=True
+        )
+        batch_sums = group_sums(matrix, inverse.ravel(), len(unique))
+
+        new = [i for i, key in enumerate(unique) if key not in positions]
+        if new:
+            for i in new:
+                positions[unique[i]] = len(keys)
+                keys.append(unique[i])
+            metadata_parts.append(batch_metadata.take(pa.array(first[new])))
+            grown = np.zeros((len(keys), matrix.shape[1]), dtype=np.float32)
+            if sums is not None:
+                grown[:len(sums)] = sums
+            sums = grown
+            counts = np.concatenate([counts, np.zeros(len(new), dtype=np.int64)])
+        rows = np.fromiter((positions[key] for key in unique), dtype=np.int64, count=len(unique))
+        sums[rows] += batch_sums
+        counts[rows] += batch_counts
+
+    if not keys:
+        return None
+
+    pooled = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    metadata = pa.concat_arrays(metadata_parts)
+    document_fields = [field.name for field in metadata.type if field.name != "page_numbers"]
+
+    columns = {"zotero_key": keys}
+    for field in DOCUMENT_FIELDS:
+        columns[field] = metadata.field(field)
+    columns["metadata"] = pa.StructArray.from_arrays(
+        [metadata.field(name) for name in document_fields], names=document_fields
+    )
+    columns["chunk_count"] = pa.array(counts, pa.int32())
+    columns["vector"] = pa.FixedSizeListArray.from_arrays(pa.array(pooled.ravel(), pa.float32()), pooled.shape[1])
+    return pa.table(columns)
+
+
+def build_document_table(db, chunk_table, table_name: str = DOCUMENTS_TABLE_NAME):
+    """Tworzy (nadpisuje) tabelę wektorów dokumentów na podstawie tabeli fragmentów.
+
+    Returns:
+        Tabela LanceDB z jednym wierszem na dokument lub None, jeśli brak fragmentów
+    """
+    documents = pool_document_vectors(chunk_table)
+    if documents is None:
+        print("Brak fragmentów - pomijam tworzenie tabeli dokumentów")
+        return None
+
+    table = db.create_table(table_name, documents, mode="overwrite")
+    try:
+        table.create_scalar_index("zotero_key", index_type="BTREE", replace=True)
+    except Exception as e:
+        print(f"  ⚠ Nie udało się utworzyć indeksu na zotero_key: {e}")
+
+    print(f"Utworzono tabelę '{table_name}' z wektorami {table.count_rows()} dokumentów")
+    return table
+
+
+def top_documents(
+    document_table,
+    query_vector: Sequence[float],
+    limit: int = 20,
+    where: Optional[str] = None,
+) -> List[str]:
+    """Zwraca klucze Zotero dokumentów najbliższych zapytaniu (etap 1).
+
+    `where` to ten sam filtr SQL co w etapie 2; działa na polach kolumny
+    `metadata` tabeli dokumentów.
+    """
+    builder = document_table.search(query_vector)
+    if where:
+        builder = builder.where(where, prefilter=True)
+    results = builder.select(["zotero_key", "_distance"]).limit(limit).to_arrow()
+    return results.column("zotero_key").to_pylist()
+
+
+def documents_filter(zotero_keys: Sequence[str]) -> str:
+    """Filtr SQL ograniczający wyszukiwanie fragmentów do podanych dokumentów."""
+    if not zotero_keys:
+        # Pusty etap 1 - żaden fragment nie pasuje
+        return "false"
+    return f"metadata.zotero_key IN ({', '.join(sql_literal(key) for key in zotero_keys)})"
@@ -0,0 +1,114 @@
+import os
+from typing import Any, Dict, List
+
+# Indeksy skalarne na metadanych fragmentów (kolumna -> typ indeksu)
+SCALAR_INDEXES: Dict[str, str] = {
+    "metadata.zotero_key": "BTREE",
+    "metadata.item_type": "BITMAP",  # mało unikalnych wartości
+    "metadata.parsed_date": "BTREE",
+}
+
+# Kolumny z indeksem pełnotekstowym (kolumna -> opcje tokenizera)
+FTS_COLUMNS: Dict[str, Dict[str, Any]] = {
+    # Trigramy bez wielkości liter: wyszukiwanie autora dopasowuje też części nazwisk
+    "metadata.creators": {
+        "base_tokenizer": "ngram", "ngram_min_length": 3, "ngram_max_length": 3,
+        "lower_case": True, "ascii_folding": True, "stem": False, "remove_stop_words": False,
+    },
+    "metadata.title": {},
+}
+
+# Język indeksu pełnotekstowego na treści fragmentów
+FTS_LANGUAGE = os.getenv("FTS_LANGUAGE", "Polish")
+
+# Języki z dostępnym stemmerem w tokenizerze LanceDB (tantivy)
+STEMMED_LANGUAGES = {
+    "Arabic", "Danish", "Dutch", "English", "Finnish", "French", "German", "Greek",
+    "Hungarian", "Italian", "Norwegian", "Portuguese", "Romanian", "Russian",
+    "Spanish", "Swedish", "Tamil", "Turkish",
+}
+
+
+def sql_literal(value: str) -> str:
+    """Zwraca wartość jako bezpieczny literał SQL (z ucieczką apostrofów)."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def has_trigram_index(table, column: str) -> bool:
+    """Czy kolumna ma indeks FTS na trigramach (FTS_COLUMNS) - starsze indeksy dzielą tekst na słowa."""
+    return any(
+        index.index_type == "FTS" and column in index.columns
+        and (getattr(index, "index_details", None) or {}).get("base_tokenizer") == "ngram"
+        for index in table.list_indices()
+    )
+
+
+def create_metadata_indexes(table, replace: bool = True) -> List[str]:
+    """Tworzy indeksy skalarne i pełnotekstowe na metadanych fragmentów.
+
+    Indeksy pozwalają LanceDB wykonywać filtry `where` (autor, data, typ)
+    bez skanowania całej tabeli.
+
+    Args:
+        table: Tabela LanceDB z fragmentami
+        replace: Czy nadpisać istniejące indeksy
+
+    Returns:
+        Lista kolumn, dla których udało się utworzyć indeks
+    """
+    created = []
+
+    for column, index_type in SCALAR_INDEXES.items():
+        try:
+            table.create_scalar_index(column, index_type=index_type, replace=replace)
+            created.append(column)
+        except Exception as e:
+            print(f"  ⚠ Nie udało się utworzyć indeksu {index_type} na {column}: {e}")
+
+    for column, options in FTS_COLUMNS.items():
+        try:
+            table.create_fts_index(column, use_tantivy=False, replace=replace, **options)
+            created.append(column)
+        except Exception as e:
+            print(f"  ⚠ Nie udało się utworzyć indeksu FTS na {column}: {e}")
+
+    return created
+
+
+def create_text_index(table, language: str = FTS_LANGUAGE, replace: bool = True) -> bool:
+    """Tworzy indeks pełnotekstowy (BM25) na treści fragmentów.
+
+    Dla języków ze stemmerem używany jest tokenizer ze stemmingiem i usuwaniem
+    słów nieznaczących. Polski nie ma stemmera w LanceDB, więc dla niego (i innych
+    języków bez stemmera) tekst jest indeksowany jako trigramy - odmienione formy
+    wyrazu mają wspólne trigramy rdzenia i nadal się dopasowują.
+
+    Returns:
+        True, jeśli indeks został utworzony
+    """
+    if language in STEMMED_LANGUAGES:
+        options = {"language": language, "stem": True, "remove_stop_words": True}
+    else:
+        options = {"base_tokenizer": "ngram", "ngram_min_length": 3, "ngram_max_length": 3}
+
+    try:
+        table.create_fts_index(
+            "text",
+            use_tantivy=False,
+            lower_case=True,
+            ascii_folding=True,
+            replace=replace,
+            **options,
+        )
+        return True
+    except Exception as e:
+        print(f"  ⚠ Nie udało się utworzyć indeksu FTS na text: {e}")
+        return False
+
+
+def create_indexes(table, replace: bool = True) -> List[str]:
+    """Tworzy wszystkie indeksy tabeli fragmentów (metadane i treść)."""
+    created = create_metadata_indexes(table, replace=replace)
+    if create_text_index(table, replace=replace):
+        created.append("text")
+    return created
@@ -0,0 +1,432 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+from dotenv import load_dotenv
+
+from utils.context_packer import CONTEXT_TOKEN_BUDGET, PackedContext, pack_context
+from utils.document_index import DOCUMENTS_TABLE_NAME
+from utils.maintenance import DB_URI, TABLE_NAME
+from utils.metrics import metrics, run_in_context
+from utils.parent_child import CHILDREN_TABLE_NAME, MULTI_GRANULARITY, PARENTS_TABLE_NAME, fetch_parents
+from utils.query_cache import embed_query
+from utils.related_items import RELATED_TABLE_NAME
+from utils.retrieval import DEFAULT_QUERY_TYPE, RRF_K, TWO_STAGE_SEARCH, SearchHit, hits_from_arrow, score_column, search
+
+load_dotenv()
+
+# Lista bibliotek Zotero (JSON); bez pliku używana jest jedna biblioteka z ZOTERO_USER_ID / ZOTERO_LIBRARY_TYPE
+LIBRARIES_FILE = os.getenv("ZOTERO_LIBRARIES_FILE", "libraries.json")
+
+# Domyślny katalog danych biblioteki: LIBRARIES_DIR/<nazwa>
+LIBRARIES_DIR = "data/libraries"
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+@dataclass(frozen=True)
+class Library:
+    """Biblioteka Zotero z własnym katalogiem danych.
+
+    Katalog danych (`root`) jest katalogiem roboczym potoku tej biblioteki:
+    ma własne `data/` z cache, plikami dokumentów i chunków, stanem potoku
+    (PIPELINE_STATE_FILE) i bazą LanceDB. Biblioteka z `root: "."` używa
+    katalogu projektu, jak przed konfiguracją wielu bibliotek.
+
+    `groups` ogranicza wyszukiwanie do wywołujących z jedną z podanych grup
+    (pusta lista - wszyscy), a `where` to filtr SQL dostępu dołączany do
+    każdego zapytania w tej bibliotece. `db` wskazuje bazę LanceDB poza
+    katalogiem danych.
+    """
+
+    name: str
+    library_id: str
+    library_type: str = "user"
+    api_key_env: str = "ZOTERO_API_KEY"
+    root: Optional[str] = None
+    groups: Tuple[str, ...] = ()
+    where: Optional[str] = None
+    sitemaps: Tuple[str, ...] = ()
+    db: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return self.root or os.path.join(LIBRARIES_DIR, self.name)
+
+    @property
+    def db_uri(self) -> str:
+        return self.db or os.path.normpath(os.path.join(self.path, DB_URI))
+
+    def allows(self, groups: Optional[Sequence[str]]) -> bool:
+        """Czy wywołujący z grupami `groups` może przeszukiwać bibliotekę (None - bez kontroli dostępu)."""
+        return groups is None or not self.groups or bool(set(groups) & set(self.groups))
+
+    def environment(self) -> Dict[str, str]:
+        """Zmienne środowiskowe potoku tej biblioteki (połączenie Zotero i sitemapy)."""
+        env = {"ZOTERO_USER_ID": self.library_id, "ZOTERO_LIBRARY_TYPE": self.library_type}
+        api_key = os.getenv(self.api_key_env)
+        if api_key:
+            env["ZOTERO_API_KEY"] = api_key
+        # Strony z WEB_SITEMAPS trafiają tylko do biblioteki w katalogu projektu, nie do każdej
+        if self.sitemaps or os.path.normpath(self.path) != ".":
+            env["WEB_SITEMAPS"] = ",".join(self.sitemaps)
+        return env
+
+
+def load_libraries(path: str = LIBRARIES_FILE) -> List[Library]:
+    """Wczytuje listę bibliotek z pliku JSON.
+
+    Format pliku:
+        {"libraries": [
+            {"name": "personal", "library_id": "1234567", "root": "."},
+            {"name": "lab", "library_id": "7654321", "library_type": "group",
+             "api_key_env": "ZOTERO_LAB_API_KEY", "groups": ["lab"],
+             "where": "metadata.item_type != 'note'"}
+        ]}
+
+    Raises:
+        ValueError: Jeśli nazwy bibliotek są puste, niepoprawne lub się powtarzają
+    """
+    if not os.path.exists(path):
+        return [Library("default", os.getenv("ZOTERO_USER_ID", ""), os.getenv("ZOTERO_LIBRARY_TYPE", "user"), root=".")]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)["libraries"]
+    libraries = []
+    for entry in entries:
+        library = Library(
+            name=entry["name"],
+            library_id=str(entry["library_id"]),
+            library_type=entry.get("library_type", "user"),
+            api_key_env=entry.get("api_key_env", "ZOTERO_API_KEY"),
+            root=entry.get("root"),
+            groups=tuple(entry.get("groups", ())),
+            where=entry.get("where"),
+            sitemaps=tuple(entry.get("sitemaps", ())),
+            db=entry.get("db"),
+        )
+        if not _NAME_PATTERN.match(library.name):
+            raise ValueError(f"Niepoprawna nazwa biblioteki: {library.name!r} (dozwolone litery, cyfry, - i _)")
+        libraries.append(library)
+
+    names = [library.name for library in libraries]
+    if not names or len(set(names)) != len(names):
+        raise ValueError(f"Lista bibliotek w {path} jest pusta lub zawiera powtórzone nazwy")
+    return libraries
+
+
+def select_libraries(libraries: List[Library], names: Optional[Sequence[str]]) -> List[Library]:
+    if not names:
+        return libraries
+    unknown = set(names) - {library.name for library in libraries}
+    if unknown:
+        raise ValueError(f"Nieznane biblioteki: {', '.join(sorted(unknown))}")
+    return [library for library in libraries if library.name in names]
+
+
+def combine_filters(*conditions: Optional[str]) -> Optional[str]:
+    conditions = [condition for condition in conditions if condition]
+    if len(conditions) <= 1:
+        return conditions[0] if conditions else None
+    return " AND ".join(f"({condition})" for condition in conditions)
+
+
+@dataclass(frozen=True)
+class LibraryTables:
+    """Tabele biblioteki otwarte przez FederatedSearch (opcjonalne są None, jeśli ich nie ma)."""
+
+    table: Any
+    documents_table: Any = None  # TWO_STAGE_SEARCH
+    parents_table: Any = None  # MULTI_GRANULARITY - rozwijanie trafień do sekcji nadrzędnych
+    related_table: Any = None  # utils.related_items
+
+
+def _open_optional_table(db, name: str):
+    try:
+        return db.open_table(name)
+    except Exception:
+        return None
+
+
+class FederatedSearch:
+    """Wyszukiwanie w wielu bibliotekach naraz.
+
+    Każda biblioteka jest przeszukiwana w osobnym wątku (utils.retrieval.search
+    na jej tabeli), z filtrem dostępu biblioteki dołączonym do `where` - filtr
+    wykonuje LanceDB przed wyborem kandydatów, więc niedostępne fragmenty nie
+    zajmują miejsc w wynikach. Wektor zapytania jest liczony raz, przed
+    rozesłaniem zapytań.
+
+    Wyniki są łączone według wyniku trafności, jeśli wszystkie biblioteki
+    zwróciły ten sam rodzaj wyniku (RRF, BM25 lub odległość). Gdy rodzaje się
+    różnią (np. biblioteka bez indeksu FTS przeszła na wyszukiwanie
+    wektorowe) albo wyniki były dywersyfikowane (MMR), listy łączone są
+    według pozycji, jak w reciprocal-rank fusion.
+
+    `read_consistency_interval` przekazywany jest do lancedb.connect - długo
+    działająca usługa (utils.service) widzi wtedy dane dopisane przez potok.
+    """
+
+    def __init__(
+        self,
+        libraries: List[Library],
+        max_workers: Optional[int] = None,
+        table_name: Optional[str] = None,
+        read_consistency_interval: Optional[timedelta] = None,
+    ):
+        self.libraries = libraries
+        self.table_name = table_name or (CHILDREN_TABLE_NAME if MULTI_GRANULARITY else TABLE_NAME)
+        self.read_consistency_interval = read_consistency_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(libraries), thread_name_prefix="library")
+        self._tables: Dict[str, LibraryTables] = {}
+        self._lock = Lock()
+
+    def tables(self, library: Library) -> LibraryTables:
+        """Tabele biblioteki (fragmenty, dokumenty, sekcje nadrzędne, podobne prace), otwierane raz."""
+        with self._lock:
+            if library.name not in self._tables:
+                import lancedb
+
+                db = lancedb.connect(library.db_uri, read_consistency_interval=self.read_consistency_interval)
+                self._tables[library.name] = LibraryTables(
+                    table=db.open_table(self.table_name),
+                    documents_table=_open_optional_table(db, DOCUMENTS_TABLE_NAME) if TWO_STAGE_SEARCH else None,
+                    parents_table=_open_optional_table(db, PARENTS_TABLE_NAME) if MULTI_GRANULARITY else None,
+                    related_table=_open_optional_table(db, RELATED_TABLE_NAME),
+                )
+            return self._tables[library.name]
+
+    def accessible(self, libraries: Optional[Sequence[str]] = None,
+                   groups: Optional[Sequence[str]] = None) -> List[Library]:
+        """Wybrane (domyślnie wszystkie) biblioteki, które mogą przeszukiwać wywołujący z grupami `groups`."""
+        return [library for library in select_libraries(self.libraries, libraries) if library.allows(groups)]
+
+    def _search_library(self, library: Library, query: str, limit: int, query_type: str,
+                        where: Optional[str], options: Dict[str, Any]) -> pa.Table:
+        tables = self.tables(library)
+        with metrics.span("library_search", library=library.name):
+            return search(
+                tables.table, query, limit, query_type, combine_filters(library.where, where),
+                document_table=tables.documents_table, **options,
+            )
+
+    def search(
+        self,
+        query: str,
+        limit: int = 5,
+        query_type: str = DEFAULT_QUERY_TYPE,
+        where: Optional[str] = None,
+        libraries: Optional[Sequence[str]] = None,
+        groups: Optional[Sequence[str]] = None,
+        **options,
+    ) -> List[SearchHit]:
+        """Przeszukuje wybrane (domyślnie wszystkie) biblioteki dostępne dla grup `groups`.
+
+        Args:
+            query: Zapytanie użytkownika
+            limit: Liczba wyników po połączeniu
+            query_type: "vector", "fts" lub "hybrid"
+            where: Filtr SQL zapytania, dołączany do filtrów dostępu bibliotek
+            libraries: Nazwy przeszukiwanych bibliotek
+            groups: Grupy wywołującego (None - bez kontroli dostępu, np. w CLI)
+            **options: Pozostałe opcje utils.retrieval.search (mmr, max_per_document, ...)
+
+        Returns:
+            Trafienia z polem `library`, najlepsze najpierw
+        """
+        selected = self.accessible(libraries, groups)
+        if not selected:
+            return []
+        if query_type != "fts":
+            embed_query(query)  # jeden wektor zapytania w cache dla wszystkich bibliotek
+
+        with metrics.span("federated_search", libraries=len(selected)):
+            futures = [
+                (library, self.executor.submit(
+                    run_in_context(self._search_library), library, query, limit, query_type, where, options
+                ))
+                for library in selected
+            ]
+            results = []
+            for library, future in futures:
+                try:
+                    results.append((library.name, future.result()))
+                except Exception as e:
+                    print(f"  ⚠ Biblioteka {library.name} niedostępna: {e}")
+        by_rank = bool(options.get("mmr") or options.get("max_per_document"))
+        return merge_results(results, limit, by_rank)
+
+    def expand_to_parents(self, hits: List[SearchHit], query: str,
+                          budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+        """Pakuje trafienia w kontekst, zamieniając fragmenty potomne na sekcje nadrzędne.
+
+        Sekcje są pobierane z tabeli PARENTS_TABLE_NAME biblioteki trafienia
+        (identyfikatory sekcji są unikalne tylko w obrębie biblioteki)
+        i deduplikowane, jak w utils.parent_child.expand_to_parents().
+        Trafienia bez sekcji nadrzędnej (tryb bez MULTI_GRANULARITY lub
+        biblioteka bez tabeli sekcji) trafiają do kontekstu bez zmian.
+        """
+        wanted: Dict[str, List[str]] = {}
+        for hit in hits:
+            if hit.parent_id:
+                wanted.setdefault(hit.library, []).append(hit.parent_id)
+        parents: Dict[Tuple[Optional[str], str], SearchHit] = {}
+        for library in self.libraries:
+            parents_table = self.tables(library).parents_table if library.name in wanted else None
+            if parents_table is not None:
+                fetched = fetch_parents(parents_table, list(dict.fromkeys(wanted[library.name])))
+                for parent_id, parent in fetched.items():
+                    parents[(library.name, parent_id)] = replace(parent, library=library.name)
+
+        context_hits = []
+        seen = set()
+        for hit in hits:
+            parent = parents.get((hit.library, hit.parent_id))
+            if parent is None:
+                context_hits.append(hit)
+            elif (hit.library, hit.parent_id) not in seen:
+                seen.add((hit.library, hit.parent_id))
+                context_hits.append(parent)
+        return pack_context(context_hits, query, budget)
+
+    def table_versions(self, libraries: Sequence[Library]) -> Dict[str, int]:
+        """Wersje tabel fragmentów bibliotek (np. do unieważniania cache odpowiedzi)."""
+        return {library.name: self.tables(library).table.version for library in libraries}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def merge_results(results: List[Tuple[str, pa.Table]], limit: int, by_rank: bool = False) -> List[SearchHit]:
+    """Łączy wyniki bibliotek w jedną listę (kolejność bibliotek rozstrzyga remisy)."""
+    kinds = {score_column(table) for _, table in results if table.num_rows}
+    by_rank = by_rank or len(kinds) != 1 or None in kinds
+    ascending = kinds == {"_distance"}
+
+    ranked = []
+    for order, (name, table) in enumerate(results):
+        for rank, hit in enumerate(hits_from_arrow(table)):
+            if by_rank:
+                key = -1.0 / (RRF_K + rank + 1)
+            else:
+                key = hit.score if ascending else -hit.score
+            ranked.append((key, order, rank, replace(hit, library=name)))
+    ranked.sort(key=lambda entry: entry[:3])
+    return [hit for *_, hit in ranked[:limit]]
+
+
+def sync_library(library: Library, pipeline_args: List[str], log_file: Optional[str] = None) -> int:
+    """Uruchamia potok (utils.pipeline run) w katalogu danych biblioteki; zwraca kod wyjścia."""
+    os.makedirs(library.path, exist_ok=True)
+    env = {**os.environ, **library.environment()}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_ROOT, env.get("PYTHONPATH")]))
+    command = [sys.executable, "-m", "utils.pipeline", "run", *pipeline_args]
+    if log_file is None:
+        return subprocess.run(command, cwd=library.path, env=env).returncode
+    with open(log_file, 'a', encoding='utf-8') as log:
+        return subprocess.run(command, cwd=library.path, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def sync_libraries(libraries: List[Library], pipeline_args: List[str], parallel: int = 1) -> Dict[str, int]:
+    """Synchronizuje biblioteki po kolei lub równolegle (wyjście do data/sync.log każdej biblioteki)."""
+    if parallel <= 1:
+        codes = {}
+        for library in libraries:
+            print(f"\n=== Biblioteka {library.name} ({library.path}) ===")
+            codes[library.name] = sync_library(library, pipeline_args)
+        return codes
+
+    def run(library: Library) -> int:
+        log_file = os.path.join(library.path, "data", "sync.log")
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        print(f"Biblioteka {library.name}: potok uruchomiony, log w {log_file}")
+        return sync_library(library, pipeline_args, log_file)
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return dict(zip((library.name for library in libraries), executor.map(run, libraries)))
+
+
+def print_status(libraries: List[Library]):
+    from utils.pipeline import STATE_FILE, print_status as print_pipeline_status
+
+    for library in libraries:
+        access = f", grupy: {', '.join(library.groups)}" if library.groups else ""
+        print(f"\n=== {library.name} ({library.library_type} {library.library_id}, {library.path}{access}) ===")
+        print_pipeline_status(os.path.join(library.path, STATE_FILE))
+
+
+def print_hits(hits: List[SearchHit]):
+    for i, hit in enumerate(hits):
+        print(f"\n=== Wynik {i+1} [{hit.library}] ===")
+        print(f"Źródło: {hit.source or 'Nieznane źródło'}")
+        print(f"Wynik: {hit.score:.4f}" if hit.score is not None else "Wynik: -")
+        print(f"Treść: {hit.text[:300]}...")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Wiele bibliotek Zotero: synchronizacja i wyszukiwanie federacyjne")
+    parser.add_argument("--config", default=LIBRARIES_FILE, help="Plik z listą bibliotek")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser(
+        "sync", help="Uruchom potok dla bibliotek (pozostałe argumenty trafiają do utils.pipeline run)"
+    )
+    sync_parser.add_argument("--libraries", nargs="+")
+    sync_parser.add_argument("--parallel", type=int, default=1, help="Liczba bibliotek synchronizowanych naraz")
+
+    status_parser = subparsers.add_parser("status", help="Pokaż stan potoku każdej biblioteki")
+    status_parser.add_argument("--libraries", nargs="+")
+
+    search_parser = subparsers.add_parser("search", help="Przeszukaj biblioteki równolegle")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--libraries", nargs="+")
+    search_parser.add_argument(
+        "--groups", nargs="+",
+        help="Pokaż wyniki dostępne dla tych grup (CLI czyta bazy bezpośrednio, dostęp wymusza utils.service)",
+    )
+    search_parser.add_argument("--limit", type=int, default=5)
+    search_parser.add_argument("--type", dest="query_type", choices=["vector", "fts", "hybrid"], default=DEFAULT_QUERY_TYPE)
+    search_parser.add_argument("--where", help="Filtr SQL na metadanych")
+    search_parser.add_argument("--mmr", action="store_true")
+    search_parser.add_argument("--max-per-document", type=int)
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command != "sync":
+        parser.error(f"nieznane argumenty: {' '.join(extra)}")
+
+    libraries = select_libraries(load_libraries(args.config), args.libraries)
+    if args.command == "sync":
+        start = time.time()
+        codes = sync_libraries(libraries, extra, args.parallel)
+        failed = [name for name, code in codes.items() if code != 0]
+        print(f"\nZsynchronizowano {len(codes) - len(failed)}/{len(codes)} bibliotek w {time.time() - start:.1f} s")
+        if failed:
+            print(f"❌ Błąd potoku: {', '.join(failed)}")
+            sys.exit(1)
+    elif args.command == "status":
+        print_status(libraries)
+    else:
+        federated = FederatedSearch(libraries)
+        start = time.time()
+        hits = federated.search(
+            args.query, args.limit, args.query_type, args.where, groups=args.groups,
+            mmr=args.mmr, max_per_document=args.max_per_document,
+        )
+        print(f"Zapytanie: '{args.query}' - {len(hits)} wyników z {len(libraries)} bibliotek "
+              f"w {(time.time() - start) * 1000:.0f} ms")
+        print_hits(hits)
+        federated.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import os
+import statistics
+import time
+from datetime import timedelta
+from typing import Any, Dict, List
+
+import lancedb
+from dotenv import load_dotenv
+
+from utils.indexes import create_indexes
+
+load_dotenv()
+
+DB_URI = "data/lancedb"
+TABLE_NAME = "docling"
+
+# Wersje starsze niż okno retencji są usuwane podczas konserwacji
+RETENTION_DAYS = int(os.getenv("LANCEDB_RETENTION_DAYS", "7"))
+
+# Czy uruchamiać konserwację automatycznie po dodaniu fragmentów (3-embedding.py)
+OPTIMIZE_AFTER_INGEST = os.getenv("LANCEDB_OPTIMIZE_AFTER_INGEST", "0") == "1"
+
+
+def get_directory_size(path: str) -> int:
+    """Zwraca łączny rozmiar plików w katalogu (w bajtach)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def get_table_stats(table, db_uri: str = DB_URI) -> Dict[str, Any]:
+    """Zbiera statystyki tabeli: wersję, liczbę wierszy, fragmentów, indeksów i rozmiar na dysku."""
+    return {
+        "version": table.version,
+        "rows": table.count_rows(),
+        "fragments": len(table.to_lance().get_fragments()),
+        "indices": len(table.list_indices()),
+        "size_bytes": get_directory_size(os.path.join(db_uri, f"{table.name}.lance")),
+    }
+
+
+def sample_search_latency(table, samples: int = 5, limit: int = 10) -> float | None:
+    """Mierzy medianę czasu wyszukiwania wektorowego (w ms).
+
+    Jako zapytań używa wektorów zapisanych w tabeli, więc pomiar nie wymaga
+    wywołań API embeddingów. Dla tabel bez wektorów zwraca None.
+    """
+    if "vector" not in table.schema.names:
+        return None
+    vectors = table.search().select(["vector"]).limit(samples).to_arrow().column("vector").to_pylist()
+    if not vectors:
+        return None
+
+    timings = []
+    for vector in vectors:
+        start = time.perf_counter()
+        table.search(vector).select(["text"]).limit(limit).to_arrow()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def optimize_table(
+    table,
+    retention_days: int = RETENTION_DAYS,
+    rebuild_indexes: bool = False,
+    db_uri: str = DB_URI,
+    latency_samples: int = 5,
+) -> Dict[str, Dict[str, Any]]:
+    """Kompaktuje pliki tabeli, usuwa stare wersje i odświeża indeksy.
+
+    Args:
+        table: Tabela LanceDB
+        retention_days: Wersje starsze niż tyle dni są usuwane
+        rebuild_indexes: Czy przebudować indeksy od zera
+            (domyślnie indeksy są tylko uzupełniane o nowe dane)
+        db_uri: Ścieżka do bazy (do pomiaru rozmiaru na dysku)
+        latency_samples: Liczba zapytań w próbce czasu wyszukiwania
+
+    Returns:
+        Słownik ze statystykami "before" i "after"
+    """
+    before = get_table_stats(table, db_uri)
+    before["search_latency_ms"] = sample_search_latency(table, latency_samples)
+
+    if rebuild_indexes:
+        create_indexes(table, replace=True)
+
+    # optimize() łączy małe fragmenty, usuwa stare wersje i aktualizuje indeksy
+    table.optimize(cleanup_older_than=timedelta(days=retention_days))
+
+    after = get_table_stats(table, db_uri)
+    after["search_latency_ms"] = sample_search_latency(table, latency_samples)
+
+    print_maintenance_report(table.name, before, after)
+    return {"before": before, "after": after}
+
+
+def print_maintenance_report(table_name: str, before: Dict[str, Any], after: Dict[str, Any]):
+    """Wyświetla porównanie statystyk tabeli przed i po konserwacji."""
+
+    def fmt_latency(value):
+        return f"{value:.1f} ms" if value is not None else "brak danych"
+
+    print(f"\nKonserwacja tabeli '{table_name}':")
+    print(f"  Wersja:        {before['version']} -> {after['version']}")
+    print(f"  Wiersze:       {before['rows']} -> {after['rows']}")
+    print(f"  Fragmenty:     {before['fragments']} -> {after['fragments']}")
+    print(f"  Indeksy:       {before['indices']} -> {after['indices']}")
+    print(f"  Rozmiar:       {before['size_bytes'] / 1024**2:.1f} MB -> {after['size_bytes'] / 1024**2:.1f} MB")
+    print(f"  Wyszukiwanie:  {fmt_latency(before['search_latency_ms'])} -> {fmt_latency(after['search_latency_ms'])}")
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Konserwacja tabeli LanceDB bazy wiedzy Zotero")
+    parser.add_argument("--db", default=DB_URI, help="Ścieżka do bazy LanceDB")
+    parser.add_argument("--table", default=TABLE_NAME, help="Nazwa tabeli")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                        help="Usuń wersje starsze niż tyle dni")
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="Przebuduj indeksy od zera")
+    args = parser.parse_args(argv)
+
+    db = lancedb.connect(args.db)
+    table = db.open_table(args.table)
+    optimize_table(table, args.retention_days, args.rebuild_indexes, args.db)
+
+
+if __name__ == "__main__":
+    main()
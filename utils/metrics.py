@@ -0,0 +1,347 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Prefiks nazw metryk w formacie Prometheus
+METRICS_PREFIX = "zotero_rag"
+
+# Katalog plików z metrykami (format tekstowy Prometheus, jeden plik na etap)
+METRICS_DIR = os.getenv("METRICS_DIR", "data/metrics")
+
+# Plik JSONL ze spanami (domyślnie pusty = bez zapisu śladów)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# Po przekroczeniu tego rozmiaru plik śladów jest przenoszony do `<TRACE_FILE>.1` (0 = bez limitu)
+TRACE_MAX_BYTES = int(float(os.getenv("TRACE_MAX_MB", "100")) * 1024 * 1024)
+
+# Granice kubełków histogramu czasów etapów (sekundy)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Przepustowości: licznik dzielony przez czas zegarowy etapu (od pierwszego początku do
+# ostatniego końca spanu, także gdy etap wykonywało równolegle kilka procesów)
+THROUGHPUTS = [
+    ("pages_per_second", "pages", "conversion"),
+    ("chunks_per_second", "chunks", "chunking"),
+    ("chunk_tokens_per_second", "chunk_tokens", "token_counting"),
+    ("tokens_per_second", "embedding_tokens", "embedding_request"),
+]
+
+_current_span: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+class Metrics:
+    """Liczniki, histogramy czasów i spany etapów potoku.
+
+    Każdy proces ma własny rejestr. Procesy robocze (ProcessPoolExecutor)
+    zwracają `snapshot(reset=True)` razem z wynikiem, a proces główny
+    dołącza go przez `merge()`. Rejestr odziedziczony przez fork jest
+    czyszczony przy pierwszym użyciu w nowym procesie, więc dane rodzica
+    nie są liczone podwójnie.
+
+    Spany trafiają do pliku JSONL (TRACE_FILE) z identyfikatorem śladu
+    i rodzica - zagnieżdżone spany (także w zadaniach asyncio) tworzą jeden
+    ślad.
+    """
+
+    def __init__(self, trace_file: Optional[str] = TRACE_FILE):
+        self.trace_file = trace_file or None
+        self._caches: Dict[str, Any] = {}
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._trace_handle = None
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.durations: Dict[str, Dict[str, Any]] = {}
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Zwiększa licznik `name` (w eksporcie `{METRICS_PREFIX}_{name}_total`)."""
+        self._check_fork()
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, stage: str, seconds: float, started_at: Optional[float] = None, error: bool = False):
+        """Dodaje czas etapu do histogramu; `started_at` (czas epoki) wyznacza okno przepustowości."""
+        self._check_fork()
+        started_at = time.time() - seconds if started_at is None else started_at
+        with self._lock:
+            entry = self.durations.get(stage)
+            if entry is None:
+                entry = self.durations[stage] = {
+                    "buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0, "errors": 0,
+                    "first": started_at, "last": started_at + seconds,
+                }
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+                    break
+            entry["sum"] += seconds
+            entry["count"] += 1
+            entry["errors"] += int(error)
+            entry["first"] = min(entry["first"], started_at)
+            entry["last"] = max(entry["last"], started_at + seconds)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Dict[str, Any]]:
+        """Mierzy czas bloku jako etap `name` i zapisuje span do śladu.
+
+        Zwraca słownik atrybutów, który można uzupełnić w bloku
+        (np. liczbą stron), zanim span zostanie zapisany.
+        """
+        parent = _current_span.get()
+        trace_id = parent[0] if parent else uuid.uuid4().hex
+        span_id = uuid.uuid4().hex[:16]
+        token = _current_span.set((trace_id, span_id))
+        started_at = time.time()
+        start = time.perf_counter()
+        error = False
+        try:
+            yield attributes
+        except BaseException as e:
+            error = True
+            attributes["error"] = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            _current_span.reset(token)
+            self.observe(name, seconds, started_at, error)
+            self._write_trace({
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_id": parent[1] if parent else None,
+                "name": name,
+                "start": started_at,
+                "duration_ms": seconds * 1000,
+                "pid": os.getpid(),
+                "status": "error" if error else "ok",
+                "attributes": attributes,
+            })
+
+    def register_cache(self, name: str, stats):
+        """Dołącza do eksportu liczniki trafień obiektu CacheStats (np. cache wektorów zapytań)."""
+        self._caches[name] = stats
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """Zwraca kopię liczników i histogramów (do przesłania między procesami)."""
+        self._check_fork()
+        with self._lock:
+            snapshot = {
+                "counters": dict(self.counters),
+                "durations": {
+                    stage: {**entry, "buckets": list(entry["buckets"])} for stage, entry in self.durations.items()
+                },
+            }
+            if reset:
+                self.counters = {}
+                self.durations = {}
+        return snapshot
+
+    def merge(self, snapshot: Optional[Dict[str, Any]]):
+        """Dodaje metryki z innego procesu (wynik `snapshot()`)."""
+        if not snapshot:
+            return
+        self._check_fork()
+        with self._lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0.0) + value
+            for stage, other in snapshot["durations"].items():
+                entry = self.durations.get(stage)
+                if entry is None:
+                    self.durations[stage] = {**other, "buckets": list(other["buckets"])}
+                    continue
+                entry["buckets"] = [a + b for a, b in zip(entry["buckets"], other["buckets"])]
+                for field in ("sum", "count", "errors"):
+                    entry[field] += other[field]
+                entry["first"] = min(entry["first"], other["first"])
+                entry["last"] = max(entry["last"], other["last"])
+
+    def counter_total(self, name: str, **labels) -> float:
+        """Suma licznika po wszystkich seriach pasujących do podanych etykiet."""
+        wanted = set(_label_key(labels))
+        return sum(
+            value for (counter, key), value in self.snapshot()["counters"].items()
+            if counter == name and wanted <= set(key)
+        )
+
+    def throughputs(self) -> Dict[str, float]:
+        """Przepustowości z THROUGHPUTS dla etapów, które zostały zmierzone."""
+        durations = self.snapshot()["durations"]
+        rates = {}
+        for rate_name, counter, stage in THROUGHPUTS:
+            entry = durations.get(stage)
+            total = self.counter_total(counter)
+            if entry and total and entry["last"] > entry["first"]:
+                rates[rate_name] = total / (entry["last"] - entry["first"])
+        return rates
+
+    def cache_hit_rates(self) -> Dict[str, Dict[str, float]]:
+        """Trafienia i chybienia cache: liczniki `cache_requests` i zarejestrowane CacheStats."""
+        caches: Dict[str, Dict[str, float]] = {}
+        for (counter, labels), value in self.snapshot()["counters"].items():
+            if counter == "cache_requests":
+                labels = dict(labels)
+                entry = caches.setdefault(labels.get("cache", ""), {"hits": 0.0, "misses": 0.0})
+                entry["hits" if labels.get("result") == "hit" else "misses"] += value
+        for name, stats in self._caches.items():
+            entry = caches.setdefault(name, {"hits": 0.0, "misses": 0.0})
+            entry["hits"] += stats.hits
+            entry["misses"] += stats.misses
+        for entry in caches.values():
+            total = entry["hits"] + entry["misses"]
+            entry["hit_rate"] = entry["hits"] / total if total else 0.0
+        return caches
+
+    def render_prometheus(self) -> str:
+        """Zwraca wszystkie metryki w formacie tekstowym Prometheus (wersja 0.0.4)."""
+        snapshot = self.snapshot()
+        lines: List[str] = []
+
+        series: Dict[str, List[Tuple[Tuple, float]]] = {}
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            if name != "cache_requests":
+                series.setdefault(name, []).append((labels, value))
+        for name, values in series.items():
+            metric = f"{METRICS_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{_format_labels(labels)} {_format_value(value)}" for labels, value in values)
+
+        metric = f"{METRICS_PREFIX}_stage_duration_seconds"
+        lines.append(f"# HELP {metric} Czas etapów potoku, wyszukiwania i czatu")
+        lines.append(f"# TYPE {metric} histogram")
+        for stage, entry in sorted(snapshot["durations"].items()):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, entry["buckets"]):
+                cumulative += count
+                labels = _format_labels((("le", repr(bound)), ("stage", stage)))
+                lines.append(f"{metric}_bucket{labels} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels((('le', '+Inf'), ('stage', stage)))} {entry['count']}")
+            lines.append(f"{metric}_sum{_format_labels((('stage', stage),))} {_format_value(entry['sum'])}")
+            lines.append(f"{metric}_count{_format_labels((('stage', stage),))} {entry['count']}")
+
+        metric = f"{METRICS_PREFIX}_stage_errors_total"
+        lines.append(f"# TYPE {metric} counter")
+        for stage, entry in sorted(snapshot["durations"].items()):
+            lines.append(f"{metric}{_format_labels((('stage', stage),))} {entry['errors']}")
+
+        for rate_name, value in self.throughputs().items():
+            metric = f"{METRICS_PREFIX}_{rate_name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {_format_value(value)}")
+
+        caches = self.cache_hit_rates()
+        if caches:
+            requests_metric = f"{METRICS_PREFIX}_cache_requests_total"
+            ratio_metric = f"{METRICS_PREFIX}_cache_hit_ratio"
+            lines.append(f"# TYPE {requests_metric} counter")
+            for name, entry in sorted(caches.items()):
+                for result, field in (("hit", "hits"), ("miss", "misses")):
+                    labels = _format_labels((("cache", name), ("result", result)))
+                    lines.append(f"{requests_metric}{labels} {_format_value(entry[field])}")
+            lines.append(f"# TYPE {ratio_metric} gauge")
+            for name, entry in sorted(caches.items()):
+                lines.append(f"{ratio_metric}{_format_labels((('cache', name),))} {_format_value(entry['hit_rate'])}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, job: str, metrics_dir: str = METRICS_DIR) -> str:
+        """Zapisuje metryki do `{metrics_dir}/{job}.prom` (np. dla textfile collectora node_exportera)."""
+        os.makedirs(metrics_dir, exist_ok=True)
+        path = os.path.join(metrics_dir, f"{job}.prom")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+        return path
+
+    def format_summary(self) -> str:
+        """Zwraca czytelne podsumowanie: czasy etapów, przepustowości i trafienia cache."""
+        snapshot = self.snapshot()
+        lines = ["Metryki etapów:"]
+        for stage, entry in sorted(snapshot["durations"].items(), key=lambda item: -item[1]["sum"]):
+            errors = f", błędów: {entry['errors']}" if entry["errors"] else ""
+            lines.append(
+                f"  {stage}: {entry['count']}x, łącznie {entry['sum']:.2f} s, "
+                f"średnio {entry['sum'] / entry['count'] * 1000:.1f} ms{errors}"
+            )
+        for rate_name, value in self.throughputs().items():
+            lines.append(f"  {rate_name}: {value:.1f}")
+        for name, entry in sorted(self.cache_hit_rates().items()):
+            lines.append(
+                f"  cache {name}: {entry['hits']:.0f}/{entry['hits'] + entry['misses']:.0f} trafień "
+                f"({entry['hit_rate']:.0%})"
+            )
+        return "\n".join(lines)
+
+    def _write_trace(self, record: Dict[str, Any]):
+        if not self.trace_file:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                if self._trace_handle is None:
+                    os.makedirs(os.path.dirname(self.trace_file) or ".", exist_ok=True)
+                    # Tryb dopisywania i buforowanie liniowe: każda linia to jeden zapis,
+                    # więc procesy robocze mogą pisać do tego samego pliku
+                    self._trace_handle = open(self.trace_file, "a", encoding="utf-8", buffering=1)
+                self._trace_handle.write(line)
+                if TRACE_MAX_BYTES and self._trace_handle.tell() >= TRACE_MAX_BYTES:
+                    self._rotate_trace()
+        except OSError as e:
+            print(f"  ⚠ Nie udało się zapisać śladu do {self.trace_file}: {e}")
+            self.trace_file = None
+
+    def _rotate_trace(self):
+        """Przenosi pełny plik śladów do `.1`; następny zapis otwiera nowy plik."""
+        inode = os.fstat(self._trace_handle.fileno()).st_ino
+        self._trace_handle.close()
+        self._trace_handle = None
+        try:
+            # Inny proces mógł już przenieść plik - wtedy wystarczy otworzyć nowy
+            if os.stat(self.trace_file).st_ino == inode:
+                os.replace(self.trace_file, self.trace_file + ".1")
+        except FileNotFoundError:
+            pass
+
+
+metrics = Metrics()
+
+
+def run_in_context(func):
+    """Opakowuje funkcję tak, by w innym wątku działała w bieżącym kontekście (spany rodzica)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
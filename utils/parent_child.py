@@ -0,0 +1,108 @@
+import os
+import re
+from typing import Dict, List
+
+from utils.context_packer import CONTEXT_TOKEN_BUDGET, PackedContext, pack_context
+from utils.indexes import sql_literal
+from utils.retrieval import SearchHit
+
+# Tryb chunkingu: "flat" (jeden poziom fragmentów) lub "parent_child"
+CHUNKING_MODE = os.getenv("CHUNKING_MODE", "flat")
+MULTI_GRANULARITY = CHUNKING_MODE == "parent_child"
+
+# Maksymalny rozmiar fragmentu potomnego (tokeny) - małe fragmenty dają precyzyjne embeddingi
+CHILD_MAX_TOKENS = int(os.getenv("CHILD_MAX_TOKENS", "256"))
+
+CHILDREN_TABLE_NAME = "docling_children"
+PARENTS_TABLE_NAME = "docling_parents"
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def make_parent_id(zotero_key: str, index: int) -> str:
+    """Identyfikator sekcji nadrzędnej: klucz Zotero i numer chunka w dokumencie."""
+    return f"{zotero_key}:{index}"
+
+
+def split_into_children(text: str, encoding, max_tokens: int = CHILD_MAX_TOKENS) -> List[str]:
+    """Dzieli tekst sekcji na fragmenty potomne o maks. `max_tokens` tokenów.
+
+    Fragmenty składane są z całych zdań; zdania dłuższe niż limit są dzielone
+    po tokenach.
+
+    Args:
+        text: Tekst sekcji nadrzędnej
+        encoding: Kodowanie tiktoken (np. OpenAITokenizerWrapper().tokenizer)
+        max_tokens: Maksymalna liczba tokenów fragmentu
+    """
+    children = []
+    current: List[str] = []
+    current_tokens = 0
+
+    for sentence in (s.strip() for s in _SENTENCE_SPLIT.split(text)):
+        if not sentence:
+            continue
+        tokens = encoding.encode(sentence, disallowed_special=())
+
+        if len(tokens) > max_tokens:
+            if current:
+                children.append(" ".join(current))
+                current, current_tokens = [], 0
+            for start in range(0, len(tokens), max_tokens):
+                children.append(encoding.decode(tokens[start:start + max_tokens]))
+            continue
+
+        if current_tokens + len(tokens) > max_tokens:
+            children.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += len(tokens)
+
+    if current:
+        children.append(" ".join(current))
+    return children
+
+
+def fetch_parents(parent_table, parent_ids: List[str]) -> Dict[str, SearchHit]:
+    """Pobiera sekcje nadrzędne o podanych identyfikatorach."""
+    if not parent_ids:
+        return {}
+
+    where = f"parent_id IN ({', '.join(sql_literal(parent_id) for parent_id in parent_ids)})"
+    rows = (
+        parent_table.search()
+        .where(where)
+        .select(["parent_id", "text", "metadata"])
+        .limit(len(parent_ids))
+        .to_arrow()
+    )
+    metadata = rows.column("metadata").to_pylist()
+    return {
+        parent_id: SearchHit(
+            text,
+            meta["title"], meta["creators"], meta["date"], meta["item_type"],
+            meta["page_numbers"], meta["zotero_key"],
+            parent_id=parent_id, source_type=meta.get("source_type"), url=meta.get("url"),
+        )
+        for parent_id, text, meta in zip(
+            rows.column("parent_id").to_pylist(), rows.column("text").to_pylist(), metadata
+        )
+    }
+
+
+def expand_to_parents(
+    hits: List[SearchHit],
+    parent_table,
+    query: str,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> PackedContext:
+    """Zamienia trafienia w fragmentach potomnych na ich sekcje nadrzędne.
+
+    Sekcje są deduplikowane (kilka trafień w tej samej sekcji daje jedną
+    sekcję), zachowują kolejność najlepszego trafienia i są pakowane
+    w budżet tokenów przez pack_context().
+    """
+    parent_ids = list(dict.fromkeys(hit.parent_id for hit in hits if hit.parent_id))
+    parents = fetch_parents(parent_table, parent_ids)
+    parent_hits = [parents[parent_id] for parent_id in parent_ids if parent_id in parents]
+    return pack_context(parent_hits, query, budget)
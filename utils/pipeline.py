@@ -0,0 +1,468 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import pickle
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Stan potoku: odciski wejść i wyjść ostatniego udanego przebiegu każdego etapu
+STATE_FILE = os.getenv("PIPELINE_STATE_FILE", "data/pipeline_state.json")
+
+DOCS_FILE = "data/zotero_docs.pkl"
+# Lista dokumentów Zotero w cache (klucze i ścieżki plików) - etapy potoku nie trzymają dokumentów w jednym pliku
+DOCS_MANIFEST_FILE = "data/zotero_docs_manifest.json"
+WEB_DOCS_FILE = "data/web_docs.pkl"
+CHUNKS_MANIFEST_FILE = "data/zotero_chunks_manifest.json"
+STAGES = ["extraction", "web", "chunking", "embedding"]
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_scripts: Dict[str, Any] = {}
+
+
+def load_script(filename: str):
+    """Importuje numerowany skrypt potoku (np. `2-chunking.py`) jako moduł, bez uruchamiania `__main__`."""
+    if filename not in _scripts:
+        name = "pipeline_" + os.path.splitext(filename)[0].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(name, os.path.join(_ROOT, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _scripts[filename] = module
+    return _scripts[filename]
+
+
+def file_fingerprint(path: str) -> Optional[str]:
+    """Odcisk pliku jak w make: rozmiar i czas modyfikacji (None, gdy pliku nie ma)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def fingerprint(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def load_state(path: str = STATE_FILE) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state: Dict[str, Any], path: str = STATE_FILE):
+    """Zapisuje stan atomowo (plik tymczasowy + os.replace)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def outputs_current(entry: Dict[str, Any]) -> bool:
+    """Czy pliki wyjściowe etapu są takie, jak po jego ostatnim przebiegu."""
+    outputs = entry.get("outputs", {})
+    return all(file_fingerprint(path) == recorded for path, recorded in outputs.items())
+
+
+def write_pickle(obj: Any, path: str) -> str:
+    """Zapisuje pickle atomowo i zwraca skrót SHA-256 zawartości.
+
+    Jeśli zawartość się nie zmieniła, plik nie jest nadpisywany (zachowuje
+    czas modyfikacji, więc etapy zależne pozostają aktualne).
+    """
+    return _write_if_changed(pickle.dumps(obj), path)
+
+
+def write_json(obj: Any, path: str) -> str:
+    """Jak write_pickle(), ale w formacie JSON (manifesty dokumentów i chunków)."""
+    return _write_if_changed(json.dumps(obj, ensure_ascii=False, indent=2).encode(), path)
+
+
+def load_json(path: str) -> Optional[Any]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_if_changed(data: bytes, path: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() == digest:
+                return digest
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return digest
+
+
+def delete_chunk_caches(keys: List[str]):
+    """Usuwa cache chunków dokumentów, których treść lub metadane się zmieniły."""
+    if not keys:
+        return
+    chunking = load_script("2-chunking.py")
+    for key in keys:
+        cache_path = chunking.get_chunks_cache_filename(key)
+        if os.path.exists(cache_path):
+            os.unlink(cache_path)
+
+
+def chunk_cache_fingerprints(manifest_path: str = CHUNKS_MANIFEST_FILE) -> Dict[str, Optional[str]]:
+    """Odciski plików cache chunków każdego dokumentu z manifestu 2-chunking.py."""
+    manifest = load_json(manifest_path)
+    if manifest is None:
+        return {}
+    return {entry['zotero_key']: file_fingerprint(entry['cache_path']) for entry in manifest['documents']}
+
+
+class ExtractionStage:
+    """Pobieranie i konwersja PDF-ów (1-extraction.py).
+
+    Wejściem jest wersja biblioteki Zotero (jedno zapytanie do API): bez
+    zmian w bibliotece etap jest pomijany. Po zmianie pobierane są tylko
+    elementy zmienione od poprzedniej wersji (`since`), a lista dokumentów
+    (DOCS_MANIFEST_FILE) powstaje z poprzedniej listy, bez wczytywania
+    dokumentów z cache. Konwertowane są tylko dokumenty, których nie ma
+    w cache.
+
+    Elementy, których ekstrakcja się nie udała, są zapisywane w stanie
+    etapu (`failed`) i ponawiane przy każdym przebiegu, także bez zmian
+    w bibliotece.
+    """
+
+    name = "extraction"
+
+    def __init__(self):
+        from utils.zotero_handler import get_zotero_connection
+
+        self.zot = get_zotero_connection()
+        self.library = [os.getenv('ZOTERO_USER_ID'), os.getenv('ZOTERO_LIBRARY_TYPE')]
+        self.version = None
+
+    def inputs(self, state: Dict[str, Any]) -> str:
+        if self.version is None:
+            self.version = self.zot.last_modified_version()
+        self.always_run = bool(state.get(self.name, {}).get("failed"))
+        return fingerprint({"library": self.library, "version": self.version})
+
+    def run(self, state: Dict[str, Any], options: argparse.Namespace) -> Dict[str, Any]:
+        from utils.zotero_handler import (
+            extract_documents_from_zotero,
+            get_cache_filename,
+            get_deleted_keys,
+            get_items_with_pdfs,
+            get_zotero_items_with_pdfs,
+            refresh_changed_documents,
+        )
+
+        previous = state.get(self.name, {})
+        manifest = load_json(DOCS_MANIFEST_FILE)
+        documents: Dict[Tuple[str, str], Dict[str, str]] = {}
+        stale: List[str] = []
+        items = None
+        if previous.get("library") == self.library and previous.get("library_version") is not None:
+            since = previous["library_version"]
+            stale, changed = refresh_changed_documents(self.zot, since)
+            deleted = set(get_deleted_keys(self.zot, since))
+            changed_keys = {item['key'] for item in changed}
+            retry = set(previous.get("failed", [])) - deleted - changed_keys
+            print(f"Od wersji {since}: zmienione elementy {len(changed_keys)}, usunięte {len(deleted)}, "
+                  f"ponawiane {len(retry)}")
+            if manifest is not None:
+                items = changed + get_items_with_pdfs(self.zot, retry)
+                replaced = changed_keys | retry
+                for entry in manifest["documents"]:
+                    if entry["zotero_key"] in deleted or entry["attachment_key"] in deleted:
+                        stale.append(entry["zotero_key"])
+                    elif entry["zotero_key"] not in replaced:
+                        documents[(entry["zotero_key"], entry["attachment_key"])] = entry
+        # Chunki zmienionych i usuniętych dokumentów są nieaktualne
+        delete_chunk_caches(stale)
+        if items is None:
+            # Pierwszy przebieg (lub brak listy dokumentów): cała biblioteka, konwersja tylko brakujących
+            items = get_zotero_items_with_pdfs()
+
+        pending = []
+        for item in items:
+            cache_path = get_cache_filename(item['key'], item['attachment_key'])
+            documents[(item['key'], item['attachment_key'])] = {
+                "zotero_key": item['key'], "attachment_key": item['attachment_key'], "cache_path": cache_path,
+            }
+            if not os.path.exists(cache_path):
+                pending.append(item)
+        print(f"Dokumenty do konwersji: {len(pending)} z {len(documents)}")
+        if pending:
+            extract_documents_from_zotero(max_workers=min(options.workers, len(pending)), items_with_pdfs=pending)
+
+        # Dokument bez pliku cache nie został skonwertowany - jego element jest ponawiany w następnym przebiegu.
+        # Odcisk pliku cache zmienia listę także po samej aktualizacji metadanych, więc chunking się uruchomi.
+        converted = []
+        for key in sorted(documents):
+            cache_fingerprint = file_fingerprint(documents[key]["cache_path"])
+            if cache_fingerprint is not None:
+                converted.append({**documents[key], "fingerprint": cache_fingerprint})
+        failed = sorted({entry["zotero_key"] for entry in documents.values()} - {entry["zotero_key"] for entry in converted})
+        digest = write_json({"documents": converted}, DOCS_MANIFEST_FILE)
+        print(f"Zapisano listę {len(converted)} dokumentów do {DOCS_MANIFEST_FILE} (błędy: {len(failed)})")
+        return {
+            "library": self.library,
+            "library_version": self.version,
+            "documents": len(converted),
+            "failed": failed,
+            "docs_sha256": digest,
+            "outputs": {DOCS_MANIFEST_FILE: file_fingerprint(DOCS_MANIFEST_FILE)},
+        }
+
+
+class WebStage:
+    """Strony WWW z sitemap (utils/web_source.py, WEB_SITEMAPS).
+
+    Zmian na stronach nie da się sprawdzić bez pobrania sitemap, więc przy
+    skonfigurowanych sitemapach etap uruchamia się zawsze; jest tani, bo
+    sitemapy są pobierane warunkowo (ETag), a strony konwertowane tylko po
+    zmianie lastmod lub treści. Plik stron jest nadpisywany tylko po zmianie,
+    więc bez zmian chunking pozostaje aktualny.
+    """
+
+    name = "web"
+
+    def __init__(self):
+        from utils.web_source import WEB_SITEMAPS
+
+        self.sitemaps = WEB_SITEMAPS
+        self.always_run = bool(WEB_SITEMAPS)
+
+    def inputs(self, state: Dict[str, Any]) -> str:
+        return fingerprint({"sitemaps": self.sitemaps})
+
+    def run(self, state: Dict[str, Any], options: argparse.Namespace) -> Dict[str, Any]:
+        from utils.web_source import WEB_WORKERS, extract_web_documents
+
+        docs, stale = extract_web_documents(self.sitemaps, max_workers=WEB_WORKERS) if self.sitemaps else ([], [])
+        delete_chunk_caches(stale)
+        digest = write_pickle(docs, WEB_DOCS_FILE)
+        return {
+            "pages": len(docs),
+            "docs_sha256": digest,
+            "outputs": {WEB_DOCS_FILE: file_fingerprint(WEB_DOCS_FILE)},
+        }
+
+
+class ChunkingStage:
+    """Chunking dokumentów (2-chunking.py).
+
+    Wejściem są skróty listy dokumentów Zotero i pliku stron WWW oraz
+    konfiguracja chunkingu. Dzielone są tylko dokumenty bez cache chunków
+    (nowe oraz zmienione - ich cache usuwają etapy extraction i web);
+    tylko one są wczytywane z cache dokumentów. Manifest chunków powstaje
+    z poprzedniego manifestu i nowych chunków, bez zbiorczego pliku pickle.
+    Po zmianie konfiguracji przez chunking przechodzą wszystkie dokumenty.
+
+    Dokumenty, których chunking się nie udał, są zapisywane w stanie etapu
+    (`failed`) i ponawiane przy każdym przebiegu.
+    """
+
+    name = "chunking"
+
+    def inputs(self, state: Dict[str, Any]) -> str:
+        from utils.parent_child import CHILD_MAX_TOKENS, CHUNKING_MODE
+
+        self.always_run = bool(state.get(self.name, {}).get("failed"))
+        # Skrót zawartości z etapu, chyba że plik zmieniono poza potokiem (utils.web_source)
+        sources = {}
+        for stage, path in (("extraction", DOCS_MANIFEST_FILE), ("web", WEB_DOCS_FILE)):
+            entry = state.get(stage, {})
+            sources[stage] = entry["docs_sha256"] if entry and outputs_current(entry) else file_fingerprint(path)
+        return fingerprint({
+            "docs": sources["extraction"], "web": sources["web"],
+            "mode": CHUNKING_MODE, "child_max_tokens": CHILD_MAX_TOKENS,
+        })
+
+    def run(self, state: Dict[str, Any], options: argparse.Namespace) -> Dict[str, Any]:
+        from utils.parent_child import CHILD_MAX_TOKENS, CHUNKING_MODE
+        from utils.web_source import load_web_documents
+        from utils.zotero_handler import load_cached_document
+
+        manifest = load_json(DOCS_MANIFEST_FILE)
+        if manifest is None:
+            raise RuntimeError(f"Brak {DOCS_MANIFEST_FILE} - uruchom etap extraction")
+        chunking = load_script("2-chunking.py")
+        config = {"mode": CHUNKING_MODE, "child_max_tokens": CHILD_MAX_TOKENS}
+        rechunk_all = state.get(self.name, {}).get("config") != config
+
+        def pending(zotero_key: str) -> bool:
+            return rechunk_all or not os.path.exists(chunking.get_chunks_cache_filename(zotero_key))
+
+        web_docs = load_web_documents(WEB_DOCS_FILE)
+        keys = list(dict.fromkeys(
+            [entry["zotero_key"] for entry in manifest["documents"]] + [doc_info["zotero_key"] for doc_info in web_docs]
+        ))
+        docs = [load_cached_document(entry["cache_path"]) for entry in manifest["documents"] if pending(entry["zotero_key"])]
+        docs += [doc_info for doc_info in web_docs if pending(doc_info["zotero_key"])]
+        print(f"Dokumenty do chunkingu: {len(docs)} z {len(keys)}")
+        chunks = chunking.chunk_zotero_documents(docs, max_workers=min(options.workers, len(docs))) if docs else []
+
+        # Liczby chunków: nowe z tego przebiegu, pozostałe z poprzedniego manifestu
+        previous = load_json(CHUNKS_MANIFEST_FILE) or {"documents": []}
+        counts = {entry["zotero_key"]: entry["chunk_count"] for entry in previous["documents"]}
+        for zotero_key in {chunk_info["zotero_key"] for chunk_info in chunks}:
+            counts[zotero_key] = 0
+        for chunk_info in chunks:
+            counts[chunk_info["zotero_key"]] += 1
+
+        documents = []
+        failed = []
+        for zotero_key in keys:
+            cache_path = chunking.get_chunks_cache_filename(zotero_key)
+            if not os.path.exists(cache_path):
+                failed.append(zotero_key)
+                continue
+            if zotero_key not in counts:
+                counts[zotero_key] = len(chunking.load_cached_chunks(cache_path))
+            documents.append({"zotero_key": zotero_key, "cache_path": cache_path, "chunk_count": counts[zotero_key]})
+        write_json({"documents": documents}, CHUNKS_MANIFEST_FILE)
+        print(f"Zapisano manifest {len(documents)} dokumentów do {CHUNKS_MANIFEST_FILE} (błędy: {len(failed)})")
+        return {
+            "config": config,
+            "documents": len(documents),
+            "chunks": sum(entry["chunk_count"] for entry in documents),
+            "failed": failed,
+            "outputs": {CHUNKS_MANIFEST_FILE: file_fingerprint(CHUNKS_MANIFEST_FILE)},
+        }
+
+
+class EmbeddingStage:
+    """Embeddingi i tabele LanceDB (3-embedding.py).
+
+    Wejściem są odciski plików cache chunków każdego dokumentu. Dokumenty
+    zmienione lub usunięte od poprzedniego przebiegu są usuwane z tabel,
+    a brakujące dodawane (tryb wznawiania), więc embeddingi powstają tylko
+    dla zmienionych dokumentów.
+    """
+
+    name = "embedding"
+
+    def inputs(self, state: Dict[str, Any]) -> str:
+        from utils.parent_child import CHUNKING_MODE
+
+        return fingerprint({"documents": chunk_cache_fingerprints(), "mode": CHUNKING_MODE})
+
+    def run(self, state: Dict[str, Any], options: argparse.Namespace) -> Dict[str, Any]:
+        from utils.parent_child import CHUNKING_MODE
+
+        documents = chunk_cache_fingerprints()
+        previous = state.get(self.name, {})
+        stale = []
+        if previous.get("mode") == CHUNKING_MODE:
+            stale = [
+                zotero_key for zotero_key, recorded in previous.get("documents", {}).items()
+                if documents.get(zotero_key) != recorded
+            ]
+        embedding = load_script("3-embedding.py")
+        table = embedding.sync_embeddings(stale, rebuild=options.rebuild_tables)
+        if table is None:
+            raise RuntimeError("Nie udało się zaktualizować bazy embeddingów")
+        return {"mode": CHUNKING_MODE, "documents": documents, "rows": table.count_rows()}
+
+
+STAGE_CLASSES = {stage.name: stage for stage in (ExtractionStage, WebStage, ChunkingStage, EmbeddingStage)}
+
+
+def is_up_to_date(entry: Dict[str, Any], inputs: str) -> bool:
+    return entry.get("inputs") == inputs and outputs_current(entry)
+
+
+def run_pipeline(options: argparse.Namespace) -> Dict[str, Any]:
+    """Uruchamia wybrane etapy po kolei, pomijając etapy z aktualnymi wejściami i wyjściami.
+
+    Wejścia etapu są liczone po zakończeniu poprzedniego, więc zmiana na
+    początku potoku uruchamia tylko te etapy dalej, których dotyczy.
+    """
+    state = load_state(options.state_file)
+    selected = [name for name in STAGES if name in options.stages]
+    total_start = time.time()
+
+    for name in selected:
+        stage = STAGE_CLASSES[name]()
+        entry = state.get(name, {})
+        inputs = stage.inputs(state)
+        force = options.force or (name == "embedding" and options.rebuild_tables)
+        if not force and not getattr(stage, "always_run", False) and is_up_to_date(entry, inputs):
+            print(f"[{name}] aktualny - pomijam")
+            continue
+        if options.dry_run:
+            print(f"[{name}] do uruchomienia")
+            continue
+
+        print(f"\n[{name}] uruchamiam...")
+        start = time.time()
+        result = stage.run(state, options)
+        state[name] = {
+            **result,
+            "inputs": inputs,
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(time.time() - start, 2),
+        }
+        save_state(state, options.state_file)
+        print(f"[{name}] zakończony w {time.time() - start:.1f} s")
+
+    print(f"\nPotok zakończony w {time.time() - total_start:.1f} s")
+    return state
+
+
+def print_status(state_file: str = STATE_FILE):
+    """Wyświetla stan etapów z ostatnich przebiegów."""
+    state = load_state(state_file)
+    for name in STAGES:
+        entry = state.get(name)
+        if not entry:
+            print(f"{name}: nigdy nie uruchomiony")
+            continue
+        details = ", ".join(
+            f"{key}={entry[key]}" for key in ("library_version", "documents", "pages", "chunks", "rows")
+            if key in entry and not isinstance(entry[key], dict)
+        )
+        if entry.get("failed"):
+            details += f", błędy={len(entry['failed'])}"
+        outputs = "" if outputs_current(entry) else " (pliki wyjściowe zmienione od przebiegu)"
+        print(f"{name}: {entry['finished_at']} ({entry['seconds']} s) {details}{outputs}")
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Nieinteraktywny potok bazy wiedzy Zotero")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Uruchom etapy, których wejścia się zmieniły")
+    run_parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    run_parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                            help="Liczba procesów roboczych ekstrakcji i chunkingu")
+    run_parser.add_argument("--force", action="store_true", help="Uruchom etapy mimo aktualnych odcisków")
+    run_parser.add_argument("--rebuild-tables", action="store_true",
+                            help="Utwórz tabele LanceDB od nowa (wszystkie embeddingi)")
+    run_parser.add_argument("--dry-run", action="store_true", help="Tylko pokaż, które etapy by się uruchomiły")
+    run_parser.add_argument("--state-file", default=STATE_FILE)
+
+    status_parser = subparsers.add_parser("status", help="Pokaż stan etapów")
+    status_parser.add_argument("--state-file", default=STATE_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        print_status(args.state_file)
+    else:
+        run_pipeline(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+load_dotenv()
+
+# Tryb profilowania procesów roboczych ekstrakcji i chunkingu (domyślnie wyłączony)
+PROFILING = os.getenv("PIPELINE_PROFILE", "0") == "1"
+
+# Katalog raportów i zrzutów cProfile
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+
+# Dla ilu najwolniejszych dokumentów zachować zrzuty cProfile
+PROFILE_SLOWEST = int(os.getenv("PROFILE_SLOWEST", "5"))
+
+# Czy profilować dokumenty cProfile (narzut na kodzie Pythona) i śledzić alokacje tracemalloc
+PROFILE_CPROFILE = os.getenv("PROFILE_CPROFILE", "1") == "1"
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "1") == "1"
+
+# Liczba największych miejsc alokacji zapisywanych dla dokumentu
+PROFILE_TOP_ALLOCATIONS = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "10"))
+
+# Liczba funkcji z raportu cProfile (po czasie łącznym) w raporcie
+PROFILE_TOP_FUNCTIONS = 15
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Szczytowe zużycie pamięci (RSS) bieżącego procesu od jego startu, w MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux podaje kilobajty, macOS bajty
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def enable_docling_timings():
+    """Włącza pomiar czasów etapów potoku docling (układ strony, OCR, tabele, ...)."""
+    from docling.datamodel.settings import settings
+
+    settings.debug.profile_pipeline_timings = True
+
+
+def docling_timings(conversion_result) -> Dict[str, float]:
+    """Zwraca łączne czasy etapów docling z wyniku konwersji (sekundy)."""
+    timings = getattr(conversion_result, "timings", None) or {}
+    return {name: float(sum(item.times)) for name, item in timings.items() if item.times}
+
+
+@contextmanager
+def timed_calls(obj, method_name: str, totals: Dict[str, float], phase: str) -> Iterator[None]:
+    """Sumuje czas wywołań metody obiektu (np. `tokenize` tokenizera używanego przez chunker)."""
+    method = getattr(obj, method_name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            totals[phase] = totals.get(phase, 0.0) + time.perf_counter() - start
+
+    setattr(obj, method_name, wrapper)
+    try:
+        yield
+    finally:
+        delattr(obj, method_name)
+
+
+def _allocation_snapshot() -> tracemalloc.Snapshot:
+    # Bez alokacji samego profilowania
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def _cprofile_path(stage: str, key: str) -> str:
+    safe_key = "".join(c if c.isalnum() else "_" for c in key)
+    return os.path.join(PROFILE_DIR, "cprofile", f"{stage}_{safe_key}.prof")
+
+
+@contextmanager
+def profile_document(stage: str, key: str) -> Iterator[Optional[Dict[str, Any]]]:
+    """Profiluje przetwarzanie jednego dokumentu w procesie roboczym.
+
+    Zwraca słownik profilu (None, gdy PIPELINE_PROFILE jest wyłączone), do
+    którego wywołujący dopisuje czasy faz. Po zakończeniu bloku zawiera czas
+    całkowity, szczytowy RSS procesu, szczyt i największe miejsca alokacji
+    tracemalloc oraz ścieżkę zrzutu cProfile.
+    """
+    if not PROFILING:
+        yield None
+        return
+
+    profile: Dict[str, Any] = {"stage": stage, "key": key, "pid": os.getpid(), "phases": {}}
+    rss_before = peak_rss_mb()
+    baseline = None
+    if PROFILE_TRACEMALLOC:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        baseline = _allocation_snapshot()
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile() if PROFILE_CPROFILE else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield profile
+    finally:
+        if profiler:
+            profiler.disable()
+        profile["seconds"] = time.perf_counter() - start
+        profile["rss_peak_mb"] = peak_rss_mb()
+        # Dokument podniósł szczyt pamięci procesu o tyle MB (0 = szczyt był wcześniej)
+        profile["rss_growth_mb"] = (
+            profile["rss_peak_mb"] - rss_before if rss_before is not None else None
+        )
+        if baseline is not None:
+            profile["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            # Pamięć zaalokowana podczas dokumentu i nadal zajęta na jego końcu
+            statistics = _allocation_snapshot().compare_to(baseline, "lineno")[:PROFILE_TOP_ALLOCATIONS]
+            profile["top_allocations"] = [
+                (str(stat.traceback[0]), stat.size_diff / 1024, stat.count_diff)
+                for stat in statistics if stat.size_diff >= 1024
+            ]
+        if profiler:
+            path = _cprofile_path(stage, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            profiler.dump_stats(path)
+            profile["cprofile_path"] = path
+
+
+class ProfileReport:
+    """Zbiera profile dokumentów w procesie głównym i zapisuje raport Markdown.
+
+    Zrzuty cProfile są zachowywane tylko dla PROFILE_SLOWEST najwolniejszych
+    dokumentów; pozostałe są usuwane przy zapisie raportu.
+    """
+
+    def __init__(self, stage: str, slowest: int = PROFILE_SLOWEST):
+        self.stage = stage
+        self.slowest = slowest
+        self.profiles: List[Dict[str, Any]] = []
+
+    def add(self, profile: Optional[Dict[str, Any]]):
+        if profile:
+            self.profiles.append(profile)
+
+    def write(self, profile_dir: str = PROFILE_DIR) -> Optional[str]:
+        """Zapisuje `{profile_dir}/{stage}_report.md` i zwraca jego ścieżkę."""
+        if not self.profiles:
+            return None
+
+        ranked = sorted(self.profiles, key=lambda profile: profile["seconds"], reverse=True)
+        slowest = ranked[:self.slowest]
+        for profile in ranked[self.slowest:]:
+            path = profile.pop("cprofile_path", None)
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+        lines = [
+            f"# Profil etapu {self.stage}",
+            "",
+            f"{datetime.now():%Y-%m-%d %H:%M}, dokumentów: {len(self.profiles)}, "
+            f"łączny czas dokumentów: {sum(profile['seconds'] for profile in self.profiles):.1f} s",
+            "",
+        ]
+        lines += self._phase_table()
+        lines += self._slowest_table(slowest)
+        lines += self._memory_table()
+        lines += self._allocations(slowest)
+        lines += self._cprofile_sections(slowest)
+
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{self.stage}_report.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def _phase_table(self) -> List[str]:
+        totals: Dict[str, List[float]] = {}
+        for profile in self.profiles:
+            for phase, seconds in profile["phases"].items():
+                totals.setdefault(phase, []).append(seconds)
+        wall = sum(profile["seconds"] for profile in self.profiles) or 1.0
+
+        lines = [
+            "## Fazy",
+            "",
+            "Fazy mogą się zagnieżdżać (np. `docling_*` w `conversion`), więc udziały nie sumują się do 100%.",
+            "",
+            "| Faza | Łącznie [s] | Udział | Średnio [ms] | Maks. [ms] | Dokumentów |",
+            "|---|---:|---:|---:|---:|---:|",
+        ]
+        for phase, values in sorted(totals.items(), key=lambda item: -sum(item[1])):
+            lines.append(
+                f"| {phase} | {sum(values):.2f} | {sum(values) / wall:.0%} | "
+                f"{sum(values) / len(values) * 1000:.1f} | {max(values) * 1000:.1f} | {len(values)} |"
+            )
+        return lines + [""]
+
+    def _slowest_table(self, slowest: List[Dict[str, Any]]) -> List[str]:
+        lines = [
+            "## Najwolniejsze dokumenty",
+            "",
+            "| Dokument | Czas [s] | Najdłuższe fazy | Szczyt RSS [MB] | Szczyt tracemalloc [MB] |",
+            "|---|---:|---|---:|---:|",
+        ]
+        for profile in slowest:
+            phases = sorted(profile["phases"].items(), key=lambda item: -item[1])[:3]
+            lines.append(
+                f"| {profile.get('title') or profile['key']} (`{profile['key']}`) | {profile['seconds']:.2f} | "
+                + ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in phases)
+                + f" | {_format_mb(profile.get('rss_peak_mb'))} | {_format_mb(profile.get('tracemalloc_peak_mb'))} |"
+            )
+        return lines + [""]
+
+    def _memory_table(self) -> List[str]:
+        workers: Dict[int, Dict[str, Any]] = {}
+        for profile in self.profiles:
+            if profile.get("rss_peak_mb") is None:
+                continue
+            worker = workers.setdefault(profile["pid"], {"documents": 0, "peak": 0.0, "key": None})
+            worker["documents"] += 1
+            # Dokument, przy którym szczyt RSS procesu wzrósł najbardziej
+            if profile["rss_growth_mb"] > 0 and profile["rss_peak_mb"] >= worker["peak"]:
+                worker["peak"] = profile["rss_peak_mb"]
+                worker["key"] = profile["key"]
+        if not workers:
+            return []
+
+        lines = [
+            "## Pamięć procesów roboczych",
+            "",
+            "| PID | Dokumentów | Szczyt RSS [MB] | Dokument, przy którym osiągnięto szczyt |",
+            "|---:|---:|---:|---|",
+        ]
+        for pid, worker in sorted(workers.items(), key=lambda item: -item[1]["peak"]):
+            lines.append(f"| {pid} | {worker['documents']} | {worker['peak']:.0f} | `{worker['key'] or '-'}` |")
+        return lines + [""]
+
+    def _allocations(self, slowest: List[Dict[str, Any]]) -> List[str]:
+        lines = []
+        for profile in slowest:
+            if not profile.get("top_allocations"):
+                continue
+            if not lines:
+                lines = [
+                "## Największe alokacje (tracemalloc)",
+                "",
+                "Pamięć zaalokowana podczas przetwarzania dokumentu i nadal zajęta na jego końcu.",
+                "",
+            ]
+            lines += [f"### `{profile['key']}`", "", "| Miejsce | Przyrost [KB] | Bloków |", "|---|---:|---:|"]
+            lines += [f"| `{place}` | {size:.0f} | {count} |" for place, size, count in profile["top_allocations"]]
+            lines.append("")
+        return lines
+
+    def _cprofile_sections(self, slowest: List[Dict[str, Any]]) -> List[str]:
+        lines = []
+        for profile in slowest:
+            path = profile.get("cprofile_path")
+            if not path or not os.path.exists(path):
+                continue
+            if not lines:
+                lines = [
+                    "## cProfile",
+                    "",
+                    "Pełne zrzuty można otworzyć np. przez `python -m pstats <plik>` lub snakeviz.",
+                    "",
+                ]
+            output = io.StringIO()
+            pstats.Stats(path, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            lines += [f"### `{profile['key']}` ({path})", "", "```", output.getvalue().strip(), "```", ""]
+        return lines
+
+
+def _format_mb(value: Optional[float]) -> str:
+    return f"{value:.0f}" if value is not None else "-"
@@ -0,0 +1,249 @@
+import hashlib
+import os
+import pickle
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.metrics import metrics
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Rozmiar cache wektorów zapytań w pamięci (liczba zapytań)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+
+# Katalog cache wektorów zapytań na dysku (pusty = wyłączony)
+QUERY_CACHE_DIR = os.getenv("QUERY_CACHE_DIR", "data/query_cache")
+
+# Czas życia wyników wyszukiwania w cache (sekundy)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+
+# Liczba zapytań w jednym żądaniu embeddingów przy osadzaniu wsadowym
+QUERY_EMBEDDING_BATCH_SIZE = int(os.getenv("QUERY_EMBEDDING_BATCH_SIZE", "256"))
+
+
+class CacheStats:
+    """Liczniki trafień i chybień cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+class EmbeddingCache:
+    """Cache tekst zapytania -> wektor: LRU w pamięci i opcjonalnie pliki na dysku.
+
+    Wektory są przechowywane jako tablice float32 tylko do odczytu (3072
+    wymiary to 12 KB zamiast ~100 KB listy floatów Pythona). Pliki na dysku
+    mają ten sam format co pozostałe cache projektu: `{md5}.pkl` w katalogu
+    cache, zapisywane atomowo.
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, cache_dir: Optional[str] = QUERY_CACHE_DIR):
+        self.maxsize = maxsize
+        self.cache_dir = os.path.join(cache_dir, "embeddings") if cache_dir else None
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+        return hashlib.md5(f"{model}\n{text}".encode()).hexdigest()
+
+    @staticmethod
+    def as_vector(vector: Sequence[float]) -> np.ndarray:
+        """Kopia wektora jako float32 tylko do odczytu (współdzielona przez wszystkich odbiorców)."""
+        array = np.array(vector, dtype=np.float32)
+        array.setflags(write=False)
+        return array
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return vector
+
+        vector = self._load_from_disk(key)
+        with self._lock:
+            if vector is not None:
+                self.stats.hits += 1
+                self._store(key, vector)
+            else:
+                self.stats.misses += 1
+        return vector
+
+    def put(self, key: str, vector: Sequence[float]) -> np.ndarray:
+        vector = self.as_vector(vector)
+        with self._lock:
+            self._store(key, vector)
+        self._save_to_disk(key, vector)
+        return vector
+
+    def _store(self, key: str, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, f"{key}.pkl") if self.cache_dir else None
+
+    def _load_from_disk(self, key: str) -> Optional[np.ndarray]:
+        path = self._disk_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                # Starsze pliki zawierają listy floatów
+                return self.as_vector(pickle.load(f))
+        except Exception:
+            # Uszkodzony plik cache - zostanie nadpisany
+            return None
+
+    def _save_to_disk(self, key: str, vector: np.ndarray):
+        path = self._disk_path(key)
+        if not path:
+            return
+        # Zapis atomowy: równoległe procesy usługi czytają plik kompletny albo wcale
+        tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(vector, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  ⚠ Nie udało się zapisać wektora zapytania do cache: {e}")
+
+
+class ResultCache:
+    """Krótkotrwały cache wyników wyszukiwania (zapytanie + filtry -> top-k fragmentów).
+
+    Klucz zawiera wersję tabeli, a zmiana wersji czyści cały cache, więc po
+    dodaniu lub usunięciu fragmentów nie są zwracane nieaktualne wyniki.
+    """
+
+    def __init__(self, ttl: float = RESULT_CACHE_TTL, maxsize: int = RESULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._table_versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, table_name: str, table_version: int, key: Any):
+        with self._lock:
+            self._check_version(table_name, table_version)
+            entry = self._entries.get((table_name, key))
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end((table_name, key))
+                self.stats.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[(table_name, key)]
+            self.stats.misses += 1
+            return None
+
+    def put(self, table_name: str, table_version: int, key: Any, value):
+        with self._lock:
+            self._check_version(table_name, table_version)
+            self._entries[(table_name, key)] = (time.monotonic(), value)
+            self._entries.move_to_end((table_name, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _check_version(self, table_name: str, table_version: int):
+        if self._table_versions.get(table_name) != table_version:
+            self._table_versions[table_name] = table_version
+            for cached_key in [k for k in self._entries if k[0] == table_name]:
+                del self._entries[cached_key]
+
+
+embedding_cache = EmbeddingCache()
+result_cache = ResultCache()
+
+metrics.register_cache("embeddings", embedding_cache.stats)
+metrics.register_cache("results", result_cache.stats)
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+
+        _client = OpenAI()
+    return _client
+
+
+def embed_query(text: str, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Zwraca wektor zapytania, korzystając z cache przed wywołaniem API OpenAI."""
+    key = EmbeddingCache.make_key(text, model)
+    vector = embedding_cache.get(key)
+    if vector is None:
+        with metrics.span("query_embedding", queries=1):
+            response = _get_client().embeddings.create(model=model, input=[text])
+        vector = embedding_cache.put(key, response.data[0].embedding)
+    return vector
+
+
+def embed_queries(
+    texts: List[str],
+    model: str = EMBEDDING_MODEL,
+    batch_size: int = QUERY_EMBEDDING_BATCH_SIZE,
+) -> List[np.ndarray]:
+    """Zwraca wektory wielu zapytań, osadzając brakujące w cache partiami.
+
+    Powtórzone zapytania są osadzane tylko raz.
+    """
+    keys = [EmbeddingCache.make_key(text, model) for text in texts]
+    vectors = {key: embedding_cache.get(key) for key in set(keys)}
+    missing = [(key, text) for key, text in dict(zip(keys, texts)).items() if vectors[key] is None]
+
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        with metrics.span("query_embedding", queries=len(batch)):
+            response = _get_client().embeddings.create(model=model, input=[text for _, text in batch])
+        for (key, _), item in zip(batch, response.data):
+            vectors[key] = embedding_cache.put(key, item.embedding)
+
+    return [vectors[key] for key in keys]
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Zwraca statystyki obu poziomów cache."""
+    return {
+        "embeddings": embedding_cache.stats.as_dict(),
+        "results": result_cache.stats.as_dict(),
+    }
+
+
+def format_cache_stats() -> str:
+    """Zwraca statystyki cache w jednej linii tekstu."""
+    stats = get_cache_stats()
+    return (
+        f"Cache wektorów zapytań: {stats['embeddings']['hits']}/"
+        f"{stats['embeddings']['hits'] + stats['embeddings']['misses']} trafień "
+        f"({stats['embeddings']['hit_rate']:.0%}), "
+        f"cache wyników: {stats['results']['hits']}/"
+        f"{stats['results']['hits'] + stats['results']['misses']} trafień "
+        f"({stats['results']['hit_rate']:.0%})"
+    )
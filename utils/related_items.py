@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from utils.document_index import DOCUMENTS_TABLE_NAME
+from utils.indexes import sql_literal
+from utils.maintenance import DB_URI, TABLE_NAME
+
+RELATED_TABLE_NAME = "related_items"
+RELATED_CHUNKS_TABLE_NAME = "related_chunks"
+
+# Liczba sąsiadów zapisywanych dla każdego dokumentu / fragmentu
+RELATED_NEIGHBORS = int(os.getenv("RELATED_NEIGHBORS", "10"))
+
+# Liczba wierszy zapytań w jednym mnożeniu macierzy
+KNN_BATCH_SIZE = 1024
+
+# Metadane sąsiada zapisywane w grafie, żeby podgląd nie wymagał złączenia
+NEIGHBOR_FIELDS = ["title", "creators", "date"]
+
+RELATED_SCHEMA = pa.schema([
+    ("zotero_key", pa.string()),
+    ("neighbor_key", pa.string()),
+    ("rank", pa.int32()),
+    ("score", pa.float32()),
+    ("neighbor_title", pa.string()),
+    ("neighbor_creators", pa.string()),
+    ("neighbor_date", pa.string()),
+    # Skrót wektora i metadanych dokumentu `zotero_key` z chwili liczenia jego listy
+    ("document_hash", pa.string()),
+])
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def document_hash(vector: np.ndarray, metadata: dict) -> str:
+    """Skrót znormalizowanego wektora i metadanych dokumentu (wykrywa ponowny embedding pod tym samym kluczem)."""
+    digest = hashlib.md5(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+    digest.update(repr([metadata[field] for field in NEIGHBOR_FIELDS]).encode())
+    return digest.hexdigest()[:16]
+
+
+def load_document_vectors(document_table) -> Tuple[List[str], np.ndarray, Dict[str, dict]]:
+    """Wczytuje wektory dokumentów (utils.document_index) jako znormalizowaną macierz.
+
+    Returns:
+        Klucze Zotero, macierz wektorów (wiersz na klucz) i metadane dokumentów
+    """
+    rows = document_table.to_lance().to_table(columns=["zotero_key", "vector", *NEIGHBOR_FIELDS])
+    keys = rows.column("zotero_key").to_pylist()
+    vectors = rows.column("vector").combine_chunks()
+    matrix = _normalize(vectors.flatten().to_numpy().reshape(len(vectors), -1).astype(np.float32))
+    metadata = {
+        key: {field: value for field, value in zip(NEIGHBOR_FIELDS, values)}
+        for key, *values in zip(keys, *(rows.column(field).to_pylist() for field in NEIGHBOR_FIELDS))
+    }
+    return keys, matrix, metadata
+
+
+def nearest_neighbors(
+    query_matrix: np.ndarray,
+    matrix: np.ndarray,
+    k: int,
+    exclude: Optional[np.ndarray] = None,
+    batch_size: int = KNN_BATCH_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Dokładne k najbliższych sąsiadów (kosinusowo) dla wierszy `query_matrix`.
+
+    Args:
+        query_matrix: Znormalizowane wektory zapytań
+        matrix: Znormalizowane wektory kandydatów
+        k: Liczba sąsiadów
+        exclude: Indeks w `matrix` pomijany dla każdego zapytania (np. ono samo), -1 = brak
+
+    Returns:
+        Indeksy sąsiadów i ich podobieństwa, posortowane malejąco, kształt (zapytania, k)
+    """
+    k = min(k, matrix.shape[0] - (1 if exclude is not None else 0))
+    if k <= 0 or len(query_matrix) == 0:
+        empty = np.empty((len(query_matrix), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    all_indices = []
+    all_scores = []
+    for start in range(0, len(query_matrix), batch_size):
+        similarity = query_matrix[start:start + batch_size] @ matrix.T
+        if exclude is not None:
+            rows = np.nonzero(exclude[start:start + batch_size] >= 0)[0]
+            similarity[rows, exclude[start:start + batch_size][rows]] = -np.inf
+
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+        all_indices.append(np.take_along_axis(top, order, axis=1))
+        all_scores.append(np.take_along_axis(scores, order, axis=1))
+
+    return np.concatenate(all_indices), np.concatenate(all_scores).astype(np.float32)
+
+
+def _graph_rows(
+    query_keys: Sequence[str],
+    keys: Sequence[str],
+    metadata: Dict[str, dict],
+    indices: np.ndarray,
+    scores: np.ndarray,
+    hashes: Sequence[str],
+) -> pa.Table:
+    k = indices.shape[1]
+    neighbor_keys = [keys[i] for i in indices.ravel()]
+    columns = {
+        "zotero_key": np.repeat(np.asarray(query_keys, dtype=object), k).tolist(),
+        "neighbor_key": neighbor_keys,
+        "rank": np.tile(np.arange(1, k + 1, dtype=np.int32), len(query_keys)),
+        "score": scores.ravel(),
+    }
+    for field in NEIGHBOR_FIELDS:
+        columns[f"neighbor_{field}"] = [metadata[key][field] for key in neighbor_keys]
+    columns["document_hash"] = np.repeat(np.asarray(hashes, dtype=object), k).tolist()
+    return pa.table(columns, schema=RELATED_SCHEMA)
+
+
+def compute_related_items(
+    keys: Sequence[str],
+    matrix: np.ndarray,
+    metadata: Dict[str, dict],
+    query_keys: Optional[Sequence[str]] = None,
+    k: int = RELATED_NEIGHBORS,
+) -> pa.Table:
+    """Liczy wiersze grafu sąsiedztwa dla `query_keys` (domyślnie wszystkich dokumentów)."""
+    positions = {key: i for i, key in enumerate(keys)}
+    query_keys = list(keys if query_keys is None else query_keys)
+    query_positions = np.array([positions[key] for key in query_keys], dtype=np.int64)
+    indices, scores = nearest_neighbors(
+        matrix[query_positions] if len(query_positions) else matrix[:0], matrix, k, exclude=query_positions
+    )
+    hashes = [document_hash(matrix[i], metadata[key]) for i, key in zip(query_positions, query_keys)]
+    return _graph_rows(query_keys, keys, metadata, indices, scores, hashes)
+
+
+def _create_related_table(db, rows: pa.Table, table_name: str):
+    table = db.create_table(table_name, rows, mode="overwrite")
+    try:
+        table.create_scalar_index("zotero_key", index_type="BTREE", replace=True)
+    except Exception as e:
+        print(f"  ⚠ Nie udało się utworzyć indeksu na zotero_key: {e}")
+    return table
+
+
+def build_related_items(db, document_table, k: int = RELATED_NEIGHBORS, table_name: str = RELATED_TABLE_NAME):
+    """Buduje od zera graf k najbliższych dokumentów i zapisuje go jako tabelę z indeksem."""
+    keys, matrix, metadata = load_document_vectors(document_table)
+    rows = compute_related_items(keys, matrix, metadata, k=k)
+    table = _create_related_table(db, rows, table_name)
+    print(f"Utworzono tabelę '{table_name}': {len(keys)} dokumentów, {rows.num_rows} powiązań (k={k})")
+    return table
+
+
+def _stored_neighbors(
+    related_table,
+) -> Tuple[Dict[str, Set[str]], Dict[str, float], Dict[str, int], Dict[str, str]]:
+    rows = related_table.to_lance().to_table(columns=["zotero_key", "neighbor_key", "score", "document_hash"])
+    neighbors: Dict[str, Set[str]] = {}
+    min_scores: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    hashes: Dict[str, str] = {}
+    for key, neighbor, score, stored_hash in zip(
+        rows.column("zotero_key").to_pylist(), rows.column("neighbor_key").to_pylist(),
+        rows.column("score").to_pylist(), rows.column("document_hash").to_pylist(),
+    ):
+        neighbors.setdefault(key, set()).add(neighbor)
+        min_scores[key] = min(score, min_scores.get(key, np.inf))
+        counts[key] = counts.get(key, 0) + 1
+        hashes[key] = stored_hash
+    return neighbors, min_scores, counts, hashes
+
+
+def update_related_items(related_table, document_table, k: int = RELATED_NEIGHBORS) -> Dict[str, int]:
+    """Aktualizuje graf po dodaniu, usunięciu lub zmianie dokumentów.
+
+    Dokument, którego wektor lub metadane zmieniły się pod tym samym kluczem
+    (ponowny embedding zmienionego elementu Zotero), jest wykrywany po
+    `document_hash` i traktowany jak usunięty i dodany na nowo.
+    Przeliczane są tylko listy sąsiadów, które mogły się zmienić:
+    nowych i zmienionych dokumentów, dokumentów, których sąsiad został
+    usunięty lub zmieniony, oraz dokumentów, dla których nowy lub zmieniony
+    dokument jest bliższy niż ich obecny k-ty sąsiad. Wynik jest taki sam
+    jak po pełnym przeliczeniu.
+
+    Returns:
+        Liczby dokumentów dodanych, usuniętych, zmienionych i przeliczonych
+    """
+    keys, matrix, metadata = load_document_vectors(document_table)
+    neighbors, min_scores, counts, stored_hashes = _stored_neighbors(related_table)
+
+    current = set(keys)
+    new = [key for key in keys if key not in neighbors]
+    changed = [
+        key for i, key in enumerate(keys)
+        if key in neighbors and stored_hashes[key] != document_hash(matrix[i], metadata[key])
+    ]
+    removed = [key for key in neighbors if key not in current]
+    added = new + changed
+    # Zmieniony dokument jest jednocześnie usunięty (stare sąsiedztwa) i dodany (nowe)
+    removed_set = set(removed) | set(changed)
+
+    affected = {key for key, items in neighbors.items() if key in current and items & removed_set}
+    if added:
+        positions = {key: i for i, key in enumerate(keys)}
+        added_matrix = matrix[[positions[key] for key in added]]
+        # Najwyższe podobieństwo każdego dokumentu do któregokolwiek z nowych
+        best_new = (matrix @ added_matrix.T).max(axis=1)
+        for i, key in enumerate(keys):
+            if key in neighbors and key not in removed_set:
+                full = counts[key] >= min(k, len(keys) - 1)
+                if not full or best_new[i] > min_scores[key]:
+                    affected.add(key)
+    affected -= set(added)
+
+    stale = removed + changed + sorted(affected)
+    if stale:
+        related_table.delete(f"zotero_key IN ({', '.join(sql_literal(key) for key in stale)})")
+
+    recompute = added + sorted(affected)
+    if recompute:
+        related_table.add(compute_related_items(keys, matrix, metadata, recompute, k))
+
+    stats = {"added": len(new), "removed": len(removed), "changed": len(changed), "recomputed": len(recompute)}
+    print(
+        f"Zaktualizowano '{related_table.name}': dodano {stats['added']}, usunięto {stats['removed']}, "
+        f"zmieniono {stats['changed']}, przeliczono {stats['recomputed']} list sąsiadów"
+    )
+    return stats
+
+
+def sync_related_items(db, document_table, k: int = RELATED_NEIGHBORS, table_name: str = RELATED_TABLE_NAME):
+    """Aktualizuje graf przyrostowo, a jeśli tabela jeszcze nie istnieje - buduje go.
+
+    Tabela sprzed kolumny `document_hash` jest budowana od nowa (bez skrótów
+    nie da się wykryć zmienionych dokumentów).
+    """
+    try:
+        related_table = db.open_table(table_name)
+    except Exception:
+        return build_related_items(db, document_table, k, table_name)
+    if "document_hash" not in related_table.schema.names:
+        print(f"Tabela '{table_name}' nie ma skrótów dokumentów - przeliczam graf od zera")
+        return build_related_items(db, document_table, k, table_name)
+    update_related_items(related_table, document_table, k)
+    return related_table
+
+
+def get_related_items(related_table, zotero_key: str, limit: int = RELATED_NEIGHBORS) -> List[Dict[str, object]]:
+    """Zwraca dokumenty podobne do podanego, od najbardziej podobnego.
+
+    Zapytanie korzysta z indeksu BTREE na `zotero_key`, więc nie zależy od
+    rozmiaru biblioteki.
+    """
+    rows = (
+        related_table.search()
+        .where(f"zotero_key = {sql_literal(zotero_key)} AND rank <= {int(limit)}")
+        .select(["neighbor_key", "rank", "score", *(f"neighbor_{field}" for field in NEIGHBOR_FIELDS)])
+        .limit(limit)
+        .to_arrow()
+        .sort_by("rank")
+    )
+    return rows.to_pylist()
+
+
+def build_related_chunks(
+    db,
+    chunk_table,
+    k: int = RELATED_NEIGHBORS,
+    table_name: str = RELATED_CHUNKS_TABLE_NAME,
+    batch_size: int = KNN_BATCH_SIZE,
+):
+    """Buduje graf k najbliższych fragmentów z innych dokumentów (sugestie cytowań).
+
+    Fragmenty identyfikowane są przez SearchHit.chunk_id. Graf fragmentów
+    jest zawsze budowany od zera.
+    """
+    from utils.retrieval import SearchHit
+
+    rows = chunk_table.to_lance().to_table(columns=["text", "vector", "metadata"])
+    keys = rows.column("metadata").combine_chunks().field("zotero_key").to_pylist()
+    texts = rows.column("text").to_pylist()
+    chunk_ids = [SearchHit(text, zotero_key=key).chunk_id for text, key in zip(texts, keys)]
+    vectors = rows.column("vector").combine_chunks()
+    matrix = _normalize(vectors.flatten().to_numpy().reshape(len(vectors), -1).astype(np.float32))
+    document_ids = np.unique(np.asarray(keys, dtype=object), return_inverse=True)[1]
+
+    k = min(k, len(chunk_ids) - 1)
+    if k <= 0:
+        print("Za mało fragmentów - pomijam graf fragmentów")
+        return None
+
+    tables = []
+    for start in range(0, len(chunk_ids), batch_size):
+        similarity = matrix[start:start + batch_size] @ matrix.T
+        # Pomiń fragmenty tego samego dokumentu
+        similarity[document_ids[start:start + batch_size, None] == document_ids[None, :]] = -np.inf
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        valid = np.isfinite(scores).ravel()
+        sources = np.repeat(np.arange(start, start + len(top)), k)[valid]
+        targets = top.ravel()[valid]
+        tables.append(pa.table({
+            "chunk_id": [chunk_ids[i] for i in sources],
+            "zotero_key": [keys[i] for i in sources],
+            "neighbor_chunk_id": [chunk_ids[i] for i in targets],
+            "neighbor_key": [keys[i] for i in targets],
+            "rank": pa.array(np.tile(np.arange(1, k + 1, dtype=np.int32), len(top))[valid]),
+            "score": pa.array(scores.ravel()[valid].astype(np.float32)),
+        }))
+
+    table = db.create_table(table_name, pa.concat_tables(tables), mode="overwrite")
+    table.create_scalar_index("chunk_id", index_type="BTREE", replace=True)
+    print(f"Utworzono tabelę '{table_name}': {len(chunk_ids)} fragmentów, {table.count_rows()} powiązań (k={k})")
+    return table
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Graf podobnych dokumentów biblioteki Zotero")
+    parser.add_argument("command", choices=["build", "update"],
+                        help="build - przelicz od zera, update - przelicz tylko zmienione listy sąsiadów")
+    parser.add_argument("--db", default=DB_URI, help="Ścieżka do bazy LanceDB")
+    parser.add_argument("--k", type=int, default=RELATED_NEIGHBORS, help="Liczba sąsiadów")
+    parser.add_argument("--chunks", action="store_true",
+                        help="Zbuduj też graf podobnych fragmentów (tabela related_chunks)")
+    parser.add_argument("--chunk-table", default=TABLE_NAME, help="Tabela fragmentów dla --chunks")
+    args = parser.parse_args(argv)
+
+    db = lancedb.connect(args.db)
+    document_table = db.open_table(DOCUMENTS_TABLE_NAME)
+    if args.command == "build":
+        build_related_items(db, document_table, args.k)
+    else:
+        sync_related_items(db, document_table, args.k)
+
+    if args.chunks:
+        build_related_chunks(db, db.open_table(args.chunk_table), args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+
+from utils.document_index import documents_filter, top_documents
+from utils.metrics import metrics, run_in_context
+from utils.query_cache import embed_query, result_cache
+
+# Kolumny zwracane przez wyszukiwanie (bez kolumny `vector`)
+RESULT_COLUMNS = ["text", "metadata"]
+
+# Kolumny zwracane, jeśli tabela je ma (np. fragmenty potomne, utils.parent_child)
+OPTIONAL_RESULT_COLUMNS = ["parent_id"]
+
+# Kolumny wyników poszczególnych metod, pomijane przy fuzji
+SCORE_COLUMNS = ["_distance", "_score"]
+
+# Kolumny metadanych przenoszone do SearchHit
+METADATA_FIELDS = ["title", "creators", "date", "item_type", "page_numbers", "zotero_key"]
+
+# Pola źródła dokumentu (utils/web_source.py), brak w tabelach sprzed ich dodania
+SOURCE_FIELDS = ["source_type", "url"]
+
+# Domyślny tryb wyszukiwania: "vector", "fts" lub "hybrid"
+DEFAULT_QUERY_TYPE = os.getenv("SEARCH_QUERY_TYPE", "hybrid")
+
+# Stała k w reciprocal-rank fusion (większa = mniejsza przewaga czołowych pozycji)
+RRF_K = 60
+
+# Wagi list wyników w fuzji
+VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+FTS_WEIGHT = float(os.getenv("HYBRID_FTS_WEIGHT", "1.0"))
+
+# Ile kandydatów pobiera każda metoda na jeden zwracany wynik
+CANDIDATES_PER_RESULT = 4
+
+# Waga trafności względem różnorodności w MMR (1.0 = sama trafność)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Ile kandydatów pobierać na jeden wynik przy dywersyfikacji
+DIVERSITY_CANDIDATES_PER_RESULT = 4
+
+# Liczba dokumentów wybieranych w pierwszym etapie wyszukiwania dwuetapowego
+TWO_STAGE_DOCUMENTS = int(os.getenv("TWO_STAGE_DOCUMENTS", "20"))
+
+# Czy czat ma domyślnie używać wyszukiwania dwuetapowego
+TWO_STAGE_SEARCH = os.getenv("SEARCH_TWO_STAGE", "0") == "1"
+
+# Pula wątków dla równoległych zapytań BM25 i ANN (LanceDB zwalnia GIL)
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+@dataclass(frozen=True, slots=True)
+class SearchHit:
+    """Pojedynczy wynik wyszukiwania: treść fragmentu i jego metadane Zotero."""
+
+    text: str
+    title: Optional[str] = None
+    creators: Optional[str] = None
+    date: Optional[str] = None
+    item_type: Optional[str] = None
+    page_numbers: Optional[List[int]] = None
+    zotero_key: Optional[str] = None
+    score: Optional[float] = None  # _relevance_score (RRF), _score (BM25) lub _distance (wektory)
+    parent_id: Optional[str] = None  # sekcja nadrzędna fragmentu potomnego (utils.parent_child)
+    source_type: Optional[str] = None  # "zotero" lub "web"
+    url: Optional[str] = None  # adres strony WWW
+    library: Optional[str] = None  # biblioteka Zotero przy wyszukiwaniu federacyjnym (utils.libraries)
+
+    @property
+    def chunk_id(self) -> str:
+        """Stabilny identyfikator fragmentu (klucz Zotero + skrót treści)."""
+        return hashlib.md5(f"{self.zotero_key}\n{self.text}".encode()).hexdigest()[:16]
+
+    @property
+    def source(self) -> str:
+        """Opis źródła do cytowania: tytuł, autorzy, data, typ i strony."""
+        source_parts = []
+        if self.title:
+            source_parts.append(self.title)
+        if self.creators:
+            source_parts.append(f"by {self.creators}")
+        if self.date:
+            source_parts.append(f"({self.date})")
+        if self.item_type:
+            source_parts.append(f"[{self.item_type}]")
+        if self.page_numbers:
+            source_parts.append(f"p. {', '.join(str(p) for p in self.page_numbers)}")
+        return " ".join(source_parts)
+
+
+def score_column(results: pa.Table) -> Optional[str]:
+    """Kolumna wyniku trafności: `_relevance_score` (RRF), `_score` (BM25) lub `_distance` (mniejszy = lepszy)."""
+    return next((name for name in ("_relevance_score", "_score", "_distance") if name in results.column_names), None)
+
+
+def hits_from_arrow(results: pa.Table) -> List[SearchHit]:
+    """Zamienia wyniki LanceDB (tabela Arrow) na listę SearchHit.
+
+    Kolumny są konwertowane w całości (bez iterowania po wierszach tabeli).
+    """
+    if results.num_rows == 0:
+        return []
+
+    flat = results.flatten()
+    texts = flat.column("text").to_pylist()
+    fields = {
+        name: flat.column(f"metadata.{name}").to_pylist()
+        for name in METADATA_FIELDS + SOURCE_FIELDS
+        if f"metadata.{name}" in flat.column_names
+    }
+    scores_name = score_column(flat)
+    scores = flat.column(scores_name).to_pylist() if scores_name else [None] * len(texts)
+    parent_ids = flat.column("parent_id").to_pylist() if "parent_id" in flat.column_names else [None] * len(texts)
+
+    return [
+        SearchHit(
+            text, *(fields[name][i] if name in fields else None for name in METADATA_FIELDS), scores[i], parent_ids[i],
+            **{name: fields[name][i] for name in SOURCE_FIELDS if name in fields},
+        )
+        for i, text in enumerate(texts)
+    ]
+
+
+def _columns(table, with_vectors: bool) -> List[str]:
+    names = table.schema.names
+    columns = RESULT_COLUMNS + [name for name in OPTIONAL_RESULT_COLUMNS if name in names]
+    return columns + ["vector"] if with_vectors else columns
+
+
+def vector_search(
+    table, query, limit: int = 5, where: Optional[str] = None, with_vectors: bool = False
+) -> pa.Table:
+    """Wyszukiwanie wektorowe (ANN). `query` to tekst albo gotowy wektor.
+
+    Kolumna `vector` jest pobierana tylko na życzenie (`with_vectors`).
+    """
+    with metrics.span("vector_search", limit=limit, filtered=bool(where)):
+        builder = table.search(query, query_type="vector")
+        if where:
+            builder = builder.where(where, prefilter=True)
+        return builder.select(_columns(table, with_vectors) + ["_distance"]).with_row_id(True).limit(limit).to_arrow()
+
+
+def fts_search(
+    table, query: str, limit: int = 5, where: Optional[str] = None, with_vectors: bool = False
+) -> pa.Table:
+    """Wyszukiwanie pełnotekstowe (BM25) po treści fragmentów."""
+    with metrics.span("fts_search", limit=limit, filtered=bool(where)):
+        builder = table.search(query, query_type="fts", fts_columns="text")
+        if where:
+            builder = builder.where(where, prefilter=True)
+        return builder.select(_columns(table, with_vectors) + ["_score"]).with_row_id(True).limit(limit).to_arrow()
+
+
+def reciprocal_rank_fusion(
+    results: Sequence[pa.Table],
+    weights: Sequence[float],
+    limit: int,
+    k: int = RRF_K,
+) -> pa.Table:
+    """Łączy rankingi metodą reciprocal-rank fusion.
+
+    Wynik wiersza to suma `weight / (k + rank)` po wszystkich listach, w których
+    się pojawił. Wiersze identyfikowane są przez `_rowid`.
+
+    Returns:
+        Tabela z kolumnami wspólnymi dla wszystkich list (RESULT_COLUMNS,
+        `_rowid`, ewentualnie `vector`) i `_relevance_score`,
+        posortowana malejąco po wyniku
+    """
+    columns = [
+        name for name in results[0].column_names
+        if name not in SCORE_COLUMNS and all(name in result.column_names for result in results)
+    ]
+    results = [result.select(columns) for result in results]
+
+    scores = {}
+    positions = {}
+    offset = 0
+    for result, weight in zip(results, weights):
+        for rank, row_id in enumerate(result.column("_rowid").to_pylist(), start=1):
+            scores[row_id] = scores.get(row_id, 0.0) + weight / (k + rank)
+            positions.setdefault(row_id, offset + rank - 1)
+        offset += result.num_rows
+
+    if not scores:
+        return results[0].append_column("_relevance_score", pa.array([], pa.float32()))
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+    fused = pa.concat_tables(results).take([positions[row_id] for row_id in ranked])
+    return fused.append_column(
+        "_relevance_score", pa.array([scores[row_id] for row_id in ranked], pa.float32())
+    )
+
+
+def hybrid_search(
+    table,
+    query: str,
+    limit: int = 5,
+    where: Optional[str] = None,
+    vector_weight: float = VECTOR_WEIGHT,
+    fts_weight: float = FTS_WEIGHT,
+    rrf_k: int = RRF_K,
+    query_vector: Optional[List[float]] = None,
+    with_vectors: bool = False,
+) -> pa.Table:
+    """Wyszukiwanie hybrydowe: BM25 i ANN równolegle, wyniki łączone przez RRF.
+
+    Args:
+        table: Tabela LanceDB z fragmentami
+        query: Zapytanie użytkownika
+        limit: Liczba zwracanych wyników
+        where: Opcjonalny filtr SQL stosowany w obu wyszukiwaniach
+        vector_weight: Waga rankingu wektorowego
+        fts_weight: Waga rankingu BM25
+        rrf_k: Stała k w RRF
+        query_vector: Gotowy wektor zapytania (jeśli None, LanceDB policzy go z tekstu)
+        with_vectors: Czy zwrócić kolumnę `vector` (np. do MMR)
+    """
+    candidates = limit * CANDIDATES_PER_RESULT
+    vector_future = _executor.submit(
+        run_in_context(vector_search), table, query_vector if query_vector is not None else query,
+        candidates, where, with_vectors,
+    )
+    fts_future = _executor.submit(run_in_context(fts_search), table, query, candidates, where, with_vectors)
+    return reciprocal_rank_fusion(
+        [vector_future.result(), fts_future.result()],
+        [vector_weight, fts_weight],
+        limit,
+        rrf_k,
+    )
+
+
+def maximal_marginal_relevance(
+    query_vector: Optional[Sequence[float]],
+    vectors: np.ndarray,
+    limit: int,
+    lambda_mult: float = MMR_LAMBDA,
+    keys: Optional[Sequence[str]] = None,
+    max_per_document: Optional[int] = None,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """Wybiera kandydatów metodą maximal marginal relevance.
+
+    Kolejny wybrany wektor maksymalizuje
+    `lambda * trafność - (1 - lambda) * max sim(już wybrane)`.
+    Trafnością jest `relevance` (np. znormalizowany wynik RRF lub BM25),
+    a bez niej podobieństwo kosinusowe do wektora zapytania.
+    Opcjonalnie ogranicza liczbę wyników z jednego dokumentu (`keys`).
+
+    Returns:
+        Indeksy wybranych kandydatów w kolejności wyboru
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if relevance is None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (query / max(np.linalg.norm(query), 1e-12))
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    keys = np.asarray(keys, dtype=object) if keys is not None else None
+    per_document = {}
+    selected = []
+
+    while len(selected) < limit and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+
+        if max_per_document and keys is not None:
+            key = keys[best]
+            per_document[key] = per_document.get(key, 0) + 1
+            if per_document[key] >= max_per_document:
+                available &= keys != key
+
+    return selected
+
+
+def cap_per_document(keys: Sequence[str], limit: int, max_per_document: int) -> List[int]:
+    """Wybiera pierwsze wyniki, pomijając nadmiarowe fragmenty z tego samego dokumentu."""
+    per_document = {}
+    selected = []
+    for i, key in enumerate(keys):
+        if per_document.get(key, 0) >= max_per_document:
+            continue
+        per_document[key] = per_document.get(key, 0) + 1
+        selected.append(i)
+        if len(selected) == limit:
+            break
+    return selected
+
+
+def candidate_relevance(results: pa.Table) -> Optional[np.ndarray]:
+    """Trafność kandydatów z wyniku fuzji RRF lub BM25, przeskalowana do [0, 1].
+
+    Zwraca None dla wyników czysto wektorowych (`_distance`) - wtedy MMR
+    liczy trafność z wektora zapytania.
+    """
+    for column in ("_relevance_score", "_score"):
+        if column in results.column_names:
+            scores = results.column(column).to_numpy().astype(np.float32)
+            low, high = float(scores.min()), float(scores.max())
+            return (scores - low) / (high - low) if high > low else np.ones_like(scores)
+    return None
+
+
+def diversify_results(
+    results: pa.Table,
+    query_vector: Optional[Sequence[float]],
+    limit: int,
+    mmr: bool = True,
+    mmr_lambda: float = MMR_LAMBDA,
+    max_per_document: Optional[int] = None,
+) -> pa.Table:
+    """Dywersyfikuje kandydatów (MMR i/lub limit na dokument) i usuwa kolumnę `vector`.
+
+    W trybie hybrydowym i FTS trafnością w MMR jest ranking tych metod
+    (candidate_relevance), a nie samo podobieństwo wektorów.
+    """
+    if results.num_rows == 0:
+        return results.drop_columns(["vector"]) if "vector" in results.column_names else results
+
+    keys = results.column("metadata").combine_chunks().field("zotero_key").to_pylist()
+    if mmr:
+        vectors = results.column("vector").combine_chunks()
+        matrix = vectors.flatten().to_numpy().reshape(len(vectors), -1)
+        order = maximal_marginal_relevance(
+            query_vector, matrix, limit, mmr_lambda, keys, max_per_document, candidate_relevance(results)
+        )
+    else:
+        order = cap_per_document(keys, limit, max_per_document)
+
+    results = results.take(order)
+    return results.drop_columns(["vector"]) if "vector" in results.column_names else results
+
+
+def search(
+    table,
+    query: str,
+    limit: int = 5,
+    query_type: str = DEFAULT_QUERY_TYPE,
+    where: Optional[str] = None,
+    use_cache: bool = True,
+    mmr: bool = False,
+    mmr_lambda: float = MMR_LAMBDA,
+    max_per_document: Optional[int] = None,
+    document_table=None,
+    n_documents: int = TWO_STAGE_DOCUMENTS,
+    **hybrid_options,
+) -> pa.Table:
+    """Wyszukuje fragmenty w wybranym trybie ("vector", "fts" lub "hybrid").
+
+    Wektor zapytania pochodzi z cache wektorów (utils.query_cache), a całe
+    wyniki z krótkotrwałego cache wyników, unieważnianego przy zmianie
+    wersji tabeli. Jeśli tabela nie ma jeszcze indeksu FTS, tryb hybrydowy
+    przechodzi na wyszukiwanie wektorowe.
+
+    Przy `mmr=True` lub `max_per_document` pobieranych jest więcej kandydatów
+    (razem z wektorami, tylko dla nich), które są następnie dywersyfikowane.
+
+    Po podaniu `document_table` (utils.document_index) wyszukiwanie jest
+    dwuetapowe: najpierw ANN po wektorach dokumentów wybiera `n_documents`
+    dokumentów, a potem fragmenty są szukane tylko w nich
+    (filtr `metadata.zotero_key IN (...)`). Filtr `where` jest stosowany
+    w obu etapach (tabela dokumentów ma kolumnę `metadata` z polami
+    dokumentu); jeśli w etapie 1 nie da się go wykonać (pola fragmentu,
+    np. numery stron, albo tabela dokumentów sprzed tej kolumny),
+    wyszukiwanie jest jednoetapowe.
+    """
+    # Ścieżka tabeli, nie nazwa - biblioteki (utils.libraries) mają tabele o tych samych nazwach w osobnych bazach
+    table_id = getattr(table, "uri", table.name)
+    cache_key = (
+        query, query_type, limit, where, mmr, mmr_lambda, max_per_document,
+        getattr(document_table, "uri", document_table.name) if document_table is not None else None, n_documents,
+        tuple(sorted(hybrid_options.items())),
+    )
+    if use_cache:
+        cached = result_cache.get(table_id, table.version, cache_key)
+        if cached is not None:
+            return cached
+
+    with metrics.span("search", query_type=query_type, limit=limit, two_stage=document_table is not None):
+        diversify = mmr or bool(max_per_document)
+        # MMR w trybie FTS bierze trafność z BM25, więc nie potrzebuje wektora zapytania
+        needs_vector = query_type != "fts" or document_table is not None
+        query_vector = embed_query(query) if needs_vector else None
+
+        if document_table is not None:
+            with metrics.span("document_search", documents=n_documents):
+                try:
+                    document_keys = top_documents(document_table, query_vector, n_documents, where)
+                except Exception as e:
+                    print(f"  ⚠ Filtr niedostępny w tabeli dokumentów ({e}), wyszukiwanie jednoetapowe")
+                    document_keys = None
+            if document_keys is not None:
+                stage_filter = documents_filter(document_keys)
+                where = f"({where}) AND {stage_filter}" if where else stage_filter
+
+        candidates = limit * DIVERSITY_CANDIDATES_PER_RESULT if diversify else limit
+
+        results = _run_search(table, query, query_vector, candidates, query_type, where, diversify, **hybrid_options)
+        if diversify:
+            results = diversify_results(results, query_vector, limit, mmr, mmr_lambda, max_per_document)
+
+    if use_cache:
+        result_cache.put(table_id, table.version, cache_key, results)
+    return results
+
+
+def _run_search(
+    table,
+    query: str,
+    query_vector: Optional[List[float]],
+    limit: int,
+    query_type: str,
+    where: Optional[str],
+    with_vectors: bool = False,
+    **hybrid_options,
+) -> pa.Table:
+    if query_type == "fts":
+        return fts_search(table, query, limit, where, with_vectors)
+
+    if query_type == "hybrid":
+        try:
+            return hybrid_search(
+                table, query, limit, where,
+                query_vector=query_vector, with_vectors=with_vectors, **hybrid_options,
+            )
+        except Exception as e:
+            print(f"  ⚠ Wyszukiwanie hybrydowe niedostępne ({e}), używam wektorowego")
+    return vector_search(table, query_vector, limit, where, with_vectors)
+
+
+def search_hits(
+    table,
+    query: str,
+    limit: int = 5,
+    query_type: str = DEFAULT_QUERY_TYPE,
+    where: Optional[str] = None,
+    **options,
+) -> List[SearchHit]:
+    """Jak search(), ale zwraca listę SearchHit zamiast tabeli Arrow."""
+    return hits_from_arrow(search(table, query, limit, query_type, where, **options))
+
+
+def filter_hits(table, where: str, limit: int = 5) -> List[SearchHit]:
+    """Zwraca fragmenty spełniające filtr SQL (bez zapytania), jako SearchHit.
+
+    Filtr jest wykonywany przez LanceDB i korzysta z indeksów skalarnych.
+    """
+    return hits_from_arrow(table.search().where(where).select(_columns(table, False)).limit(limit).to_arrow())
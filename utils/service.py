@@ -0,0 +1,585 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+from aiohttp import web
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from utils.answer_cache import answer_cache, context_fingerprint, replay_chunks
+from utils.context_packer import CONTEXT_TOKEN_BUDGET
+from utils.conversation import (
+    HISTORY_TOKEN_BUDGET,
+    ConversationState,
+    build_history,
+    condense_query,
+    message_tokens,
+    update_summary,
+)
+from utils.dates import date_range_conditions
+from utils.indexes import sql_literal
+from utils.libraries import LIBRARIES_FILE, FederatedSearch, Library, load_libraries
+from utils.metrics import metrics, run_in_context
+from utils.query_cache import embed_query, get_cache_stats
+from utils.related_items import get_related_items
+from utils.retrieval import DEFAULT_QUERY_TYPE, SearchHit
+
+load_dotenv()
+
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+
+# Limity równoczesnych żądań; kolejne czekają maks. SERVICE_QUEUE_TIMEOUT s, potem 503
+MAX_CONCURRENT_SEARCHES = int(os.getenv("SERVICE_MAX_CONCURRENT_SEARCHES", "16"))
+MAX_CONCURRENT_CHATS = int(os.getenv("SERVICE_MAX_CONCURRENT_CHATS", "8"))
+QUEUE_TIMEOUT = float(os.getenv("SERVICE_QUEUE_TIMEOUT", "30"))
+
+# Wątki wykonujące blokujące zapytania LanceDB i embeddingi zapytań
+SEARCH_WORKERS = int(os.getenv("SERVICE_SEARCH_WORKERS", str(MAX_CONCURRENT_SEARCHES)))
+
+# Rozmiar puli połączeń HTTP do API OpenAI (czat)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("SERVICE_OPENAI_MAX_CONNECTIONS", "64"))
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+CHAT_TEMPERATURE = 0.7
+
+# Ile dokumentów z odpowiedzi dostaje listę podobnych prac
+RELATED_DOCUMENTS = 3
+RELATED_LIMIT = 5
+
+MAX_SEARCH_LIMIT = 50
+
+# Górna granica budżetu kontekstu, o który może poprosić klient (`context_tokens`)
+MAX_CONTEXT_TOKENS = int(os.getenv("SERVICE_MAX_CONTEXT_TOKENS", "16000"))
+
+# Klucze API i grupy ich właścicieli (JSON: {"<klucz>": ["lab", ...]}); grupy decydują,
+# które biblioteki (utils.libraries) widzi wywołujący. Bez klucza - tylko biblioteki bez `groups`.
+API_KEYS_FILE = os.getenv("SERVICE_API_KEYS_FILE", "")
+
+# Wersja szablonu promptu w kluczu cache odpowiedzi - zwiększ przy każdej zmianie SYSTEM_PROMPT
+PROMPT_VERSION = "1"
+
+SYSTEM_PROMPT = """You are a helpful assistant that answers questions based on documents from a Zotero library.
+    Use only the information from the provided context to answer questions. When citing information,
+    reference the source document (title, authors, date) when available. If you're unsure or the context
+    doesn't contain the relevant information, say so clearly.
+
+    Context from Zotero library:
+    {context}
+    """
+
+
+def load_api_keys(path: str) -> Dict[str, List[str]]:
+    """Wczytuje klucze API usługi i grupy ich właścicieli (pusta ścieżka - brak kluczy)."""
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        keys = json.load(f)
+    return {str(key): [str(group) for group in groups] for key, groups in keys.items()}
+
+
+class ServiceResources:
+    """Zasoby współdzielone przez wszystkie żądania usługi.
+
+    Wyszukiwanie federacyjne w bibliotekach (utils.libraries, tabele
+    otwierane raz), pula wątków dla blokujących zapytań, klient OpenAI
+    z pulą połączeń i semafory ograniczające liczbę równoczesnych
+    wyszukiwań i rozmów.
+    """
+
+    def __init__(self, libraries: List[Library], table_name: Optional[str] = None,
+                 api_keys: Optional[Dict[str, List[str]]] = None):
+        self.federated = FederatedSearch(
+            libraries,
+            # Każde z równoczesnych wyszukiwań odpytuje wszystkie biblioteki naraz
+            max_workers=SEARCH_WORKERS * len(libraries),
+            table_name=table_name,
+            read_consistency_interval=timedelta(seconds=10),
+        )
+        self.api_keys = api_keys or {}
+        for library in libraries:
+            self.federated.tables(library)  # błąd otwarcia bazy ujawnia się przy starcie, nie w żądaniu
+        if not self.api_keys and any(library.groups for library in libraries):
+            print("  ⚠ Brak SERVICE_API_KEYS_FILE - biblioteki z `groups` nie będą dostępne przez usługę")
+
+        self.executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+        self.openai = AsyncOpenAI(
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                )
+            )
+        )
+        self.search_slots = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+        self.chat_slots = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
+        self.active = {"search": 0, "chat": 0}
+        self.rejected = {"search": 0, "chat": 0}
+
+    async def run(self, func, *args):
+        """Wykonuje blokującą funkcję w puli wątków usługi (w kontekście bieżącego spanu)."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, run_in_context(func), *args)
+
+    @asynccontextmanager
+    async def slot(self, kind: str):
+        """Zajmuje miejsce w limicie równoczesnych żądań danego rodzaju.
+
+        Jeśli miejsce nie zwolni się w QUEUE_TIMEOUT sekund, żądanie kończy się
+        odpowiedzią 503.
+        """
+        semaphore = self.search_slots if kind == "search" else self.chat_slots
+        try:
+            await asyncio.wait_for(semaphore.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected[kind] += 1
+            raise web.HTTPServiceUnavailable(
+                text=json.dumps({"error": f"Za dużo równoczesnych żądań ({kind})"}),
+                content_type="application/json",
+            )
+        self.active[kind] += 1
+        try:
+            yield
+        finally:
+            self.active[kind] -= 1
+            semaphore.release()
+
+    def caller_groups(self, request: web.Request) -> List[str]:
+        """Grupy wywołującego z klucza API (`Authorization: Bearer <klucz>`); bez klucza - brak grup."""
+        header = request.headers.get("Authorization", "")
+        if not header:
+            return []
+        scheme, _, key = header.partition(" ")
+        groups = self.api_keys.get(key.strip()) if scheme.lower() == "bearer" else None
+        if groups is None:
+            raise web.HTTPUnauthorized(
+                text=json.dumps({"error": "Nieprawidłowy klucz API"}), content_type="application/json"
+            )
+        return groups
+
+    def table_version(self, libraries: List[Library]) -> int:
+        """Suma wersji tabel bibliotek - rośnie przy każdej zmianie którejkolwiek z nich."""
+        return sum(self.federated.table_versions(libraries).values())
+
+    async def close(self):
+        await self.openai.close()
+        self.executor.shutdown(wait=False)
+        self.federated.close()
+
+
+RESOURCES = web.AppKey("resources", ServiceResources)
+
+
+def bad_request(message: str) -> web.HTTPBadRequest:
+    return web.HTTPBadRequest(text=json.dumps({"error": message}), content_type="application/json")
+
+
+def parse_int(body: Dict[str, Any], name: str, default: Optional[int], low: int, high: int) -> Optional[int]:
+    """Liczba całkowita z żądania przycięta do [low, high]; brak pola lub null = `default`."""
+    value = body.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise bad_request(f"Pole '{name}' musi być liczbą całkowitą")
+    try:
+        number = int(value)
+    except (ValueError, OverflowError):
+        raise bad_request(f"Pole '{name}' musi być liczbą całkowitą")
+    return max(low, min(number, high))
+
+
+def build_filter(filters: Dict[str, Any]) -> Optional[str]:
+    """Buduje filtr SQL z filtrów żądania (typ, zakres dat, klucze Zotero, źródło).
+
+    Klienci nie przesyłają własnego SQL - wartości są wstawiane jako literały.
+    Zakres dat (RRRR, RRRR-MM lub RRRR-MM-DD) dotyczy daty znormalizowanej
+    `metadata.parsed_date`. Wartości o złym typie lub formacie kończą się 400.
+    """
+    if not isinstance(filters, dict):
+        raise bad_request("Pole 'filters' musi być obiektem")
+    for name in ("item_type", "date_from", "date_to", "source_type"):
+        if filters.get(name) is not None and not isinstance(filters[name], str):
+            raise bad_request(f"Filtr '{name}' musi być tekstem")
+    keys = filters.get("zotero_keys")
+    if keys is not None and not (isinstance(keys, list) and all(isinstance(key, str) for key in keys)):
+        raise bad_request("Filtr 'zotero_keys' musi być listą kluczy")
+
+    conditions = []
+    if filters.get("item_type"):
+        conditions.append(f"metadata.item_type = {sql_literal(filters['item_type'])}")
+    try:
+        conditions += date_range_conditions(filters.get("date_from"), filters.get("date_to"))
+    except ValueError as e:
+        raise bad_request(str(e))
+    if filters.get("zotero_keys"):
+        keys = ", ".join(sql_literal(key) for key in filters["zotero_keys"])
+        conditions.append(f"metadata.zotero_key IN ({keys})")
+    if filters.get("source_type"):
+        conditions.append(f"metadata.source_type = {sql_literal(filters['source_type'])}")
+    return " AND ".join(conditions) or None
+
+
+def parse_search_options(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Waliduje parametry wyszukiwania z treści żądania."""
+    query = body.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise bad_request("Brak pola 'query'")
+
+    query_type = body.get("query_type", DEFAULT_QUERY_TYPE)
+    if query_type not in ("vector", "fts", "hybrid"):
+        raise bad_request(f"Nieznany query_type: {query_type}")
+
+    # MMR i limit fragmentów na dokument są opcjonalne - domyślnie ranking bez zmian
+    mmr = body.get("mmr", False)
+    if not isinstance(mmr, bool):
+        raise bad_request("Pole 'mmr' musi być wartością logiczną")
+
+    return {
+        "query": query,
+        "limit": parse_int(body, "limit", 8, 1, MAX_SEARCH_LIMIT),
+        "query_type": query_type,
+        "where": build_filter(body.get("filters") or {}),
+        "mmr": mmr,
+        "max_per_document": parse_int(body, "max_per_document", None, 1, MAX_SEARCH_LIMIT),
+    }
+
+
+def request_libraries(resources: ServiceResources, request: web.Request, body: Dict[str, Any]) -> List[Library]:
+    """Biblioteki przeszukiwane w żądaniu: wybrane w `libraries` (domyślnie wszystkie) i dostępne dla wywołującego.
+
+    Grupy wywołującego pochodzą z jego klucza API, nie z treści żądania.
+    Biblioteka niedostępna dla wywołującego jest traktowana jak nieznana.
+    """
+    names = body.get("libraries")
+    if names is not None and not (isinstance(names, list) and all(isinstance(name, str) for name in names)):
+        raise bad_request("Pole 'libraries' musi być listą nazw bibliotek")
+    accessible = resources.federated.accessible(groups=resources.caller_groups(request))
+    if names:
+        unknown = set(names) - {library.name for library in accessible}
+        if unknown:
+            raise bad_request(f"Nieznane lub niedostępne biblioteki: {', '.join(sorted(unknown))}")
+        accessible = [library for library in accessible if library.name in names]
+    if not accessible:
+        raise web.HTTPForbidden(
+            text=json.dumps({"error": "Brak bibliotek dostępnych dla tego klucza API"}), content_type="application/json"
+        )
+    return accessible
+
+
+def hit_to_dict(hit: SearchHit) -> Dict[str, Any]:
+    return {**asdict(hit), "source": hit.source, "chunk_id": hit.chunk_id}
+
+
+def retrieve(resources: ServiceResources, options: Dict[str, Any], libraries: List[Library]) -> List[SearchHit]:
+    """Wyszukuje fragmenty w bibliotekach (blokująco - wywoływane w puli wątków)."""
+    return resources.federated.search(
+        options["query"],
+        options["limit"],
+        options["query_type"],
+        options["where"],
+        libraries=[library.name for library in libraries],
+        mmr=options["mmr"],
+        max_per_document=options["max_per_document"],
+    )
+
+
+def build_context(resources: ServiceResources, hits: List[SearchHit], query: str, budget: int):
+    """Pakuje trafienia w kontekst (z sekcjami nadrzędnymi) i dołącza podobne dokumenty (blokująco)."""
+    with metrics.span("context_packing", hits=len(hits)) as span:
+        packed = resources.federated.expand_to_parents(hits, query, budget)
+        span["tokens"] = packed.tokens
+    metrics.inc("context_tokens", packed.tokens)
+
+    libraries = {library.name: library for library in resources.federated.libraries}
+    related = []
+    documents = list(dict.fromkeys((hit.library, hit.zotero_key) for hit in hits if hit.zotero_key))
+    for library_name, zotero_key in documents[:RELATED_DOCUMENTS]:
+        related_table = resources.federated.tables(libraries[library_name]).related_table
+        items = get_related_items(related_table, zotero_key, RELATED_LIMIT) if related_table is not None else []
+        if items:
+            title = next(hit.title for hit in hits if (hit.library, hit.zotero_key) == (library_name, zotero_key))
+            related.append({"library": library_name, "zotero_key": zotero_key, "title": title, "items": items})
+    return packed, related
+
+
+async def read_json(request: web.Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        body = None
+    if not isinstance(body, dict):
+        raise bad_request("Oczekiwano obiektu JSON")
+    return body
+
+
+async def handle_search(request: web.Request) -> web.Response:
+    """POST /search - zwraca trafienia jako JSON."""
+    resources = request.app[RESOURCES]
+    body = await read_json(request)
+    options = parse_search_options(body)
+    libraries = request_libraries(resources, request, body)
+
+    start = time.perf_counter()
+    async with resources.slot("search"):
+        hits = await resources.run(retrieve, resources, options, libraries)
+    return web.json_response({
+        "hits": [hit_to_dict(hit) for hit in hits],
+        "took_ms": (time.perf_counter() - start) * 1000,
+    })
+
+
+async def send_event(response: web.StreamResponse, event: str, data: Any):
+    """Wysyła jedno zdarzenie Server-Sent Events."""
+    await response.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+
+def parse_messages(body: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Waliduje historię rozmowy: wiadomości user/assistant zakończone pytaniem użytkownika."""
+    messages = body.get("messages")
+    valid = (
+        isinstance(messages, list)
+        and messages
+        and all(
+            isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+            for m in messages
+        )
+        and messages[-1]["role"] == "user"
+    )
+    if not valid:
+        raise bad_request("Pole 'messages' musi być historią zakończoną wiadomością użytkownika")
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+
+async def handle_chat(request: web.Request) -> web.StreamResponse:
+    """POST /chat - odpowiedź modelu strumieniowana jako SSE.
+
+    Zdarzenia: `context` (trafienia, liczba tokenów kontekstu, zapytanie
+    użyte do wyszukiwania, podobne dokumenty), `token` (kolejne fragmenty
+    odpowiedzi), `done` (czasy etapów, tokeny historii i zaktualizowana
+    pamięć rozmowy `memory`, którą klient odsyła z następnym pytaniem)
+    lub `error`.
+
+    Historia wysyłana do modelu mieści się w HISTORY_TOKEN_BUDGET (starsze
+    wiadomości są streszczane po odpowiedzi), a pytania uzupełniające są
+    przeformułowywane w samodzielne zapytania do wyszukiwania.
+
+    Odpowiedzi na pierwsze pytanie rozmowy trafiają do cache odpowiedzi
+    (utils.answer_cache) i przy powtórzeniu pytania z tym samym kontekstem
+    są odtwarzane jako strumień bez wywołania modelu.
+    """
+    resources = request.app[RESOURCES]
+    body = await read_json(request)
+    messages = parse_messages(body)
+    state = ConversationState.from_dict(body.get("memory"), len(messages))
+    budget = parse_int(body, "context_tokens", CONTEXT_TOKEN_BUDGET, 1, MAX_CONTEXT_TOKENS)
+    libraries = request_libraries(resources, request, body)
+    # Walidacja opcji przed płatnym wywołaniem modelu - zapytanie podmieniane jest po przeformułowaniu
+    question = messages[-1]["content"]
+    options = parse_search_options({**body, "query": question})
+
+    start = time.perf_counter()
+    async with resources.slot("chat"):
+        try:
+            with metrics.span("condense_query"):
+                query = await condense_query(resources.openai, messages, state) or question
+        except Exception as e:
+            print(f"  ⚠ Nie udało się przeformułować pytania, wyszukiwanie po jego treści: {e}")
+            query = question
+        options["query"] = query
+        async with resources.slot("search"):
+            hits = await resources.run(retrieve, resources, options, libraries)
+            packed, related = await resources.run(build_context, resources, hits, query, budget)
+        retrieval_ms = (time.perf_counter() - start) * 1000
+        print(f"[chat] {packed.summary()}")
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await send_event(response, "context", {
+            "hits": [hit_to_dict(hit) for hit in hits],
+            "context_tokens": packed.tokens,
+            "query": query,
+            "related": related,
+        })
+
+        system_prompt = SYSTEM_PROMPT.format(context=packed.text)
+        history, overflow = build_history(messages, state, HISTORY_TOKEN_BUDGET)
+
+        # Odpowiedź zależy tylko od pytania i kontekstu wyłącznie na początku rozmowy
+        cacheable = len(messages) == 1 and not state.summary
+        fingerprint = context_fingerprint([hit.chunk_id for hit in hits], CHAT_MODEL, PROMPT_VERSION)
+        # Cache odpowiedzi osobno dla każdego zestawu bibliotek
+        cache_name = ",".join(library.name for library in libraries)
+        table_version = resources.table_version(libraries)
+        question_vector = None
+        cached = None
+        if cacheable:
+            if answer_cache.similarity > 0:
+                question_vector = await resources.run(embed_query, question)
+            cached = answer_cache.get(cache_name, table_version, question, fingerprint, question_vector)
+
+        first_token_ms = None
+        answer = []
+        try:
+            if cached is not None:
+                first_token_ms = (time.perf_counter() - start) * 1000
+                for piece in replay_chunks(cached):
+                    await send_event(response, "token", {"text": piece})
+            else:
+                with metrics.span("llm_answer", model=CHAT_MODEL) as span:
+                    llm_start = time.perf_counter()
+                    stream = await resources.openai.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=[{"role": "system", "content": system_prompt}, *history],
+                        temperature=CHAT_TEMPERATURE,
+                        stream=True,
+                    )
+                    async with stream:
+                        async for chunk in stream:
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                if first_token_ms is None:
+                                    first_token_ms = (time.perf_counter() - start) * 1000
+                                    # Czas do pierwszego tokenu samego modelu (bez wyszukiwania)
+                                    metrics.observe("llm_first_token", time.perf_counter() - llm_start)
+                                answer.append(delta)
+                                await send_event(response, "token", {"text": delta})
+                    span["chunks"] = len(answer)
+                if cacheable and answer:
+                    answer_cache.put(
+                        cache_name, table_version, question, fingerprint, "".join(answer), question_vector
+                    )
+        except ConnectionResetError:
+            # Klient rozłączył się - przerwanie strumienia zwalnia połączenie do OpenAI
+            return response
+        except Exception as e:
+            await send_event(response, "error", {"error": str(e)})
+            return response
+
+        # Streszczenie po odpowiedzi - nie opóźnia pierwszego tokenu
+        answer_ms = (time.perf_counter() - start) * 1000
+        try:
+            with metrics.span("update_summary", messages=len(overflow)):
+                state = await update_summary(resources.openai, state, overflow)
+        except Exception as e:
+            print(f"  ⚠ Nie udało się zaktualizować streszczenia rozmowy: {e}")
+
+        await send_event(response, "done", {
+            "retrieval_ms": retrieval_ms,
+            "first_token_ms": first_token_ms,
+            "answer_ms": answer_ms,
+            "total_ms": (time.perf_counter() - start) * 1000,
+            "history_tokens": sum(message_tokens(message) for message in history),
+            "memory": asdict(state),
+            "cached": cached is not None,
+        })
+        await response.write_eof()
+        return response
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    """GET /stats - statystyki cache i obciążenia usługi."""
+    resources = request.app[RESOURCES]
+    return web.json_response({
+        "cache": {**get_cache_stats(), "answers": answer_cache.as_dict()},
+        "active": resources.active,
+        "rejected": resources.rejected,
+        "table_versions": resources.federated.table_versions(resources.federated.libraries),
+    })
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """GET /metrics - liczniki, histogramy czasów i trafienia cache w formacie Prometheus."""
+    resources = request.app[RESOURCES]
+    text = metrics.render_prometheus()
+    gauges = [
+        "# TYPE zotero_rag_active_requests gauge",
+        *(f'zotero_rag_active_requests{{kind="{kind}"}} {count}' for kind, count in resources.active.items()),
+        "# TYPE zotero_rag_rejected_requests_total counter",
+        *(f'zotero_rag_rejected_requests_total{{kind="{kind}"}} {count}' for kind, count in resources.rejected.items()),
+        "# TYPE zotero_rag_table_version gauge",
+        *(
+            f'zotero_rag_table_version{{library="{name}"}} {version}'
+            for name, version in resources.federated.table_versions(resources.federated.libraries).items()
+        ),
+    ]
+    return web.Response(
+        body=(text + "\n".join(gauges) + "\n").encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+@web.middleware
+async def trace_requests(request: web.Request, handler):
+    """Obejmuje każde żądanie API spanem - spany wyszukiwania i czatu są jego dziećmi."""
+    if request.path in ("/metrics", "/health"):
+        return await handler(request)
+    with metrics.span("http_request", method=request.method, path=request.path) as span:
+        response = await handler(request)
+        span["status"] = response.status
+        return response
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def handle_libraries(request: web.Request) -> web.Response:
+    """GET /libraries - biblioteki dostępne dla klucza API wywołującego."""
+    resources = request.app[RESOURCES]
+    libraries = resources.federated.accessible(groups=resources.caller_groups(request))
+    return web.json_response({"libraries": [library.name for library in libraries]})
+
+
+def create_app(
+    libraries: Optional[List[Library]] = None,
+    table_name: Optional[str] = None,
+    api_keys: Optional[Dict[str, List[str]]] = None,
+) -> web.Application:
+    """Tworzy aplikację aiohttp; zasoby są otwierane przy starcie, a zamykane przy wyłączeniu.
+
+    Domyślnie usługa przeszukuje biblioteki z LIBRARIES_FILE (bez pliku -
+    jedną bibliotekę w katalogu projektu).
+    """
+    app = web.Application(middlewares=[trace_requests])
+
+    async def open_resources(app: web.Application):
+        app[RESOURCES] = ServiceResources(libraries or load_libraries(), table_name, api_keys)
+
+    async def close_resources(app: web.Application):
+        await app[RESOURCES].close()
+
+    app.on_startup.append(open_resources)
+    app.on_cleanup.append(close_resources)
+    app.router.add_post("/search", handle_search)
+    app.router.add_post("/chat", handle_chat)
+    app.router.add_get("/libraries", handle_libraries)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Usługa wyszukiwania i czatu bazy wiedzy Zotero")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--config", default=LIBRARIES_FILE, help="Plik z listą bibliotek (utils.libraries)")
+    parser.add_argument("--db", default=None, help="Jedna baza LanceDB zamiast listy bibliotek")
+    parser.add_argument("--table", default=None, help="Tabela fragmentów (domyślnie wg CHUNKING_MODE)")
+    parser.add_argument("--api-keys", default=API_KEYS_FILE, help="Plik z kluczami API i grupami")
+    args = parser.parse_args(argv)
+
+    libraries = [Library("default", "", root=".", db=args.db)] if args.db else load_libraries(args.config)
+    app = create_app(libraries, args.table, load_api_keys(args.api_keys))
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,267 @@
+import gzip
+import io
+import json
+import os
+import queue
+import threading
 import xml.etree.ElementTree as ET
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Set
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+
+# Number of sitemaps fetched and parsed in parallel
+SITEMAP_WORKERS = int(os.getenv("SITEMAP_WORKERS", "8"))
+
+# Seconds to wait for a sitemap server to respond
+SITEMAP_TIMEOUT = 10
+
+# Parsed entries buffered between the fetch threads and the consumer; a slow
+# consumer stalls the fetch threads instead of growing memory
+QUEUE_SIZE = 1000
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """A requests session whose connection pool fits `pool_size` concurrent requests per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@dataclass(frozen=True, slots=True)
+class SitemapEntry:
+    """A page listed in a sitemap."""
+
+    url: str
+    lastmod: Optional[str] = None
+    sitemap: Optional[str] = None  # sitemap the URL was listed in
+
+
+class SitemapCrawler:
+    """Streams page URLs from a sitemap, following sitemap indexes concurrently.
+
+    Sitemaps are fetched with a pooled `requests.Session` from a thread pool and
+    parsed incrementally with `iterparse`, so a sitemap is never held in memory
+    as a whole. Gzipped sitemaps (`.xml.gz`, or any body starting with the gzip
+    magic bytes) are decompressed on the fly.
+
+    With a state file, the ETag and Last-Modified headers of every sitemap are
+    remembered and sent as If-None-Match / If-Modified-Since on the next crawl.
+    Sitemaps answered with 304 Not Modified are skipped (their URLs are not
+    yielded again); for an unchanged sitemap index, its remembered child
+    sitemaps are still checked individually. The state is saved only after a
+    crawl has been consumed to the end.
+    """
+
+    def __init__(
+        self,
+        state_file: Optional[str] = None,
+        max_workers: int = SITEMAP_WORKERS,
+        timeout: float = SITEMAP_TIMEOUT,
+        session: Optional[requests.Session] = None,
+    ):
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = session or make_session(max_workers)
+        self.state: Dict[str, Dict[str, Any]] = self._load_state()
+        self.stats = {"fetched": 0, "not_modified": 0, "not_found": 0, "urls": 0}
+        # Sitemaps crawled by this instance, by outcome
+        self.fetched: Set[str] = set()
+        self.not_modified: Set[str] = set()
+        self.not_found: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def crawl(self, sitemap_url: str) -> Iterator[SitemapEntry]:
+        """Yield the page URLs of a sitemap and all sitemaps it links to.
+
+        Raises:
+            ValueError: If a sitemap cannot be fetched (other than 404) or parsed
+        """
+        results: "queue.Queue[tuple]" = queue.Queue(maxsize=QUEUE_SIZE)
+        stop = threading.Event()
+        seen = {sitemap_url}
+        pending = 1
+        completed = False
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        executor.submit(self._fetch, sitemap_url, results, stop)
+        try:
+            while pending:
+                kind, value = results.get()
+                if kind == "url":
+                    yield value
+                elif kind == "sitemap":
+                    if value not in seen:
+                        seen.add(value)
+                        pending += 1
+                        executor.submit(self._fetch, value, results, stop)
+                elif kind == "done":
+                    pending -= 1
+                else:  # error
+                    raise value
+            completed = True
+        finally:
+            stop.set()
+            # Unblock fetch threads waiting on a full queue
+            while not results.empty():
+                results.get_nowait()
+            executor.shutdown(wait=True, cancel_futures=True)
+        if completed and self.state_file:
+            self.save_state()
+
+    def _fetch(self, url: str, results: queue.Queue, stop: threading.Event):
+        def put(item: tuple) -> bool:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            if not stop.is_set():
+                self._fetch_sitemap(url, put)
+        except requests.RequestException as e:
+            put(("error", ValueError(f"Failed to fetch sitemap {url}: {e}")))
+        except ET.ParseError as e:
+            put(("error", ValueError(f"Failed to parse sitemap XML {url}: {e}")))
+        except Exception as e:
+            put(("error", ValueError(f"Unexpected error processing sitemap {url}: {e}")))
+        finally:
+            put(("done", url))
+
+    def _fetch_sitemap(self, url: str, put):
+        headers = {}
+        previous = self.state.get(url, {})
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                self._count("not_modified")
+                with self._lock:
+                    self.not_modified.add(url)
+                # The index itself is unchanged, but its children may not be
+                for child in previous.get("sitemaps", []):
+                    put(("sitemap", child))
+                return
+            if response.status_code == 404:
+                self._count("not_found")
+                with self._lock:
+                    self.not_found.add(url)
+                return
+            response.raise_for_status()
+            self._count("fetched")
+
+            children: List[str] = []
+            for kind, loc, lastmod in self._parse(response):
+                if kind == "url":
+                    self._count("urls")
+                    if not put(("url", SitemapEntry(loc, lastmod, url))):
+                        return
+                else:
+                    child = urljoin(url, loc)
+                    children.append(child)
+                    if not put(("sitemap", child)):
+                        return
+
+            with self._lock:
+                self.state[url] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "sitemaps": children,
+                }
+                self.fetched.add(url)
+
+    @staticmethod
+    def _parse(response: requests.Response) -> Iterator[tuple]:
+        """Incrementally parse a (possibly gzipped) sitemap or sitemap index.
+
+        Yields ("url" | "sitemap", loc, lastmod) tuples.
+        """
+        response.raw.decode_content = True  # Content-Encoding: gzip
+        response.raw.auto_close = False  # let BufferedReader see EOF instead of a closed file
+        stream = io.BufferedReader(response.raw)
+        if stream.peek(2)[:2] == GZIP_MAGIC:  # .xml.gz served as a file
+            stream = gzip.GzipFile(fileobj=stream)
+
+        root = None
+        loc = lastmod = None
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            if root is None:
+                root = elem
+            if event == "start":
+                continue
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if tag == "loc":
+                loc = (elem.text or "").strip()
+            elif tag == "lastmod":
+                lastmod = (elem.text or "").strip() or None
+            elif tag in ("url", "sitemap"):
+                if loc:
+                    yield tag, loc, lastmod
+                loc = lastmod = None
+                # Drop parsed entries so memory stays flat for large sitemaps
+                root.clear()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_state(self):
+        """Write the conditional request state atomically (temp file + os.replace)."""
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        temp_path = f"{self.state_file}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.state_file)
+
+
+def iter_sitemap_urls(
+    base_url: str,
+    sitemap_filename: str = "sitemap.xml",
+    state_file: Optional[str] = None,
+    max_workers: int = SITEMAP_WORKERS,
+) -> Iterator[SitemapEntry]:
+    """Stream (url, lastmod) entries of a site's sitemap, following sitemap indexes.
+
+    Args:
+        base_url: The base URL of the website
+        sitemap_filename: The filename of the sitemap (default: sitemap.xml)
+        state_file: Optional JSON file with ETag/Last-Modified of fetched sitemaps;
+            sitemaps unchanged since the previous crawl are skipped
+        max_workers: Number of sitemaps fetched in parallel
+
+    Raises:
+        ValueError: If there's an error fetching (except 404) or parsing a sitemap
+    """
+    crawler = SitemapCrawler(state_file=state_file, max_workers=max_workers)
+    yield from crawler.crawl(urljoin(base_url, sitemap_filename))
 
 
 def get_sitemap_urls(base_url: str, sitemap_filename: str = "sitemap.xml") -> List[str]:
     """Fetches and parses a sitemap XML file to extract URLs.
 
+    Sitemap indexes are followed and gzipped sitemaps are supported; see
+    `SitemapCrawler` for streaming with lastmod and conditional requests.
+
     Args:
         base_url: The base URL of the website
         sitemap_filename: The filename of the sitemap (default: sitemap.xml)
@@ -19,40 +273,14 @@ def get_sitemap_urls(base_url: str, sitemap_filename: str = "sitemap.xml") -> Li
     Raises:
         ValueError: If there's an error fetching (except 404) or parsing the sitemap
     """
-    try:
-        sitemap_url = urljoin(base_url, sitemap_filename)
-
-        # Fetch sitemap URL
-        response = requests.get(sitemap_url, timeout=10)
-
-        # # Return just the base URL if sitemap not found
-        if response.status_code == 404:
-            return [base_url.rstrip("/")]
-
-        response.raise_for_status()
-
-        # Parse XML content
-        root = ET.fromstring(response.content)
-
-        # Handle different XML namespaces that sitemaps might use
-        namespaces = (
-            {"ns": root.tag.split("}")[0].strip("{")} if "}" in root.tag else ""
-        )
-
-        # Extract URLs using namespace if present
-        if namespaces:
-            urls = [elem.text for elem in root.findall(".//ns:loc", namespaces)]
-        else:
-            urls = [elem.text for elem in root.findall(".//loc")]
-
-        return urls
+    sitemap_url = urljoin(base_url, sitemap_filename)
+    crawler = SitemapCrawler()
+    urls = [entry.url for entry in crawler.crawl(sitemap_url)]
 
-    except requests.RequestException as e:
-        raise ValueError(f"Failed to fetch sitemap: {str(e)}")
-    except ET.ParseError as e:
-        raise ValueError(f"Failed to parse sitemap XML: {str(e)}")
-    except Exception as e:
-        raise ValueError(f"Unexpected error processing sitemap: {str(e)}")
+    # Return just the base URL if sitemap not found
+    if not urls and sitemap_url in crawler.not_found:
+        return [base_url.rstrip("/")]
+    return urls
 
 
 if __name__ == "__main__":
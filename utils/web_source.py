@@ -0,0 +1,323 @@
+import argparse
+import hashlib
+import html
+import io
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from utils.dates import parse_date
+from utils.metrics import metrics
+from utils.sitemap import SitemapCrawler, SitemapEntry, make_session
+
+load_dotenv()
+
+# Sitemapy stron (wiki, dokumentacja) indeksowanych obok biblioteki Zotero, oddzielone przecinkami
+WEB_SITEMAPS = [url.strip() for url in os.getenv("WEB_SITEMAPS", "").split(",") if url.strip()]
+
+# Maksymalna liczba żądań na sekundę do jednego hosta
+WEB_RATE_LIMIT = float(os.getenv("WEB_RATE_LIMIT", "2"))
+
+# Liczba stron pobieranych i konwertowanych równolegle
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "8"))
+
+WEB_TIMEOUT = 30
+
+# Stan stron (lastmod, skrót treści, klucz) i sitemap (ETag/Last-Modified)
+WEB_STATE_FILE = os.getenv("WEB_STATE_FILE", "data/web_state.json")
+WEB_SITEMAP_STATE_FILE = os.getenv("WEB_SITEMAP_STATE_FILE", "data/web_sitemaps.json")
+
+WEB_DOCS_FILE = "data/web_docs.pkl"
+WEB_CACHE_DIR = "data/web_cache"
+
+SOURCE_TYPE = "web"
+ITEM_TYPE = "webpage"  # typ elementu Zotero dla stron WWW
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+_TITLE = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_local = threading.local()
+
+
+class HostRateLimiter:
+    """Ogranicza liczbę żądań na sekundę do każdego hosta, wspólnie dla wszystkich wątków.
+
+    Każde żądanie rezerwuje najbliższy wolny termin dla swojego hosta, więc
+    różne hosty są pobierane równolegle, a jeden host nie dostaje więcej niż
+    `rate` żądań na sekundę.
+    """
+
+    def __init__(self, rate: float = WEB_RATE_LIMIT):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def get_page_key(url: str) -> str:
+    """Stabilny klucz dokumentu strony (w polu zotero_key, jak klucze elementów Zotero)."""
+    return "web-" + hashlib.sha1(url.encode()).hexdigest()[:16]
+
+
+def get_page_cache_filename(key: str) -> str:
+    return f"{WEB_CACHE_DIR}/{key}.pkl"
+
+
+def get_page_title(content: bytes, url: str) -> str:
+    match = _TITLE.search(content)
+    if match:
+        title = html.unescape(match.group(1).decode("utf-8", errors="replace")).strip()
+        if title:
+            return " ".join(title.split())
+    return url
+
+
+def convert_html(content: bytes, key: str):
+    """Konwertuje stronę HTML na DoclingDocument (jeden konwerter na wątek)."""
+    from docling.datamodel.base_models import DocumentStream, InputFormat
+
+    converter = getattr(_local, "converter", None)
+    if converter is None:
+        from docling.document_converter import DocumentConverter
+
+        converter = _local.converter = DocumentConverter(allowed_formats=[InputFormat.HTML])
+    result = converter.convert(DocumentStream(name=f"{key}.html", stream=io.BytesIO(content)))
+    if not result.document:
+        raise ValueError("Konwersja nie zwróciła dokumentu")
+    return result.document
+
+
+def save_page_to_cache(doc_info: Dict[str, Any], cache_path: str):
+    """Zapisuje dokument strony do cache atomowo (plik tymczasowy + os.replace)."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with metrics.span("cache_write") as span, open(tmp_path, 'wb') as f:
+        pickle.dump(doc_info, f)
+        span["bytes"] = f.tell()
+    os.replace(tmp_path, cache_path)
+
+
+def process_page(
+    entry: SitemapEntry,
+    root: str,
+    previous: Dict[str, Any],
+    session: requests.Session,
+    limiter: HostRateLimiter,
+) -> Dict[str, Any]:
+    """Pobiera i konwertuje stronę, jeśli zmienił się jej lastmod lub treść.
+
+    Returns:
+        Słownik ze statusem ("changed", "unchanged", "skipped" lub "error")
+        i nowym wpisem stanu strony (`page`)
+    """
+    key = previous.get("key") or get_page_key(entry.url)
+    cache_path = get_page_cache_filename(key)
+    cached = os.path.exists(cache_path)
+    page = {**previous, "key": key, "lastmod": entry.lastmod, "sitemap": entry.sitemap, "root": root}
+
+    # lastmod z sitemapy bez zmian - strony nie trzeba nawet pobierać
+    if cached and entry.lastmod and entry.lastmod == previous.get("lastmod"):
+        metrics.inc("cache_requests", cache="web_pages", result="hit")
+        return {"status": "unchanged", "url": entry.url, "page": page}
+
+    try:
+        limiter.wait(entry.url)
+        with metrics.span("web_fetch", host=urlparse(entry.url).netloc) as span:
+            response = session.get(entry.url, timeout=WEB_TIMEOUT)
+            response.raise_for_status()
+            content = response.content
+            span["bytes"] = len(content)
+        metrics.inc("downloaded_bytes", len(content))
+
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            return {"status": "skipped", "url": entry.url, "error": f"typ treści {content_type}"}
+
+        digest = hashlib.sha256(content).hexdigest()
+        if cached and digest == previous.get("sha256"):
+            metrics.inc("cache_requests", cache="web_pages", result="hit")
+            return {"status": "unchanged", "url": entry.url, "page": page}
+        metrics.inc("cache_requests", cache="web_pages", result="miss")
+
+        title = get_page_title(content, entry.url)
+        with metrics.span("conversion", url=entry.url):
+            document = convert_html(content, key)
+        doc_info = {
+            'document': document,
+            'zotero_key': key,
+            'title': title,
+            'creators': None,
+            'date': entry.lastmod[:10] if entry.lastmod else None,
+            'parsed_date': parse_date(entry.lastmod),
+            'item_type': ITEM_TYPE,
+            'source_type': SOURCE_TYPE,
+            'url': entry.url,
+        }
+        save_page_to_cache(doc_info, cache_path)
+        page.update(sha256=digest, title=title)
+        return {"status": "changed", "url": entry.url, "page": page}
+
+    except Exception as e:
+        # Przy błędzie zostaje poprzednia wersja strony (jeśli była)
+        return {
+            "status": "error",
+            "url": entry.url,
+            "error": str(e),
+            "page": {**previous, "root": root} if cached and previous else None,
+        }
+
+
+def load_state(path: str = WEB_STATE_FILE) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state: Dict[str, Dict[str, Any]], path: str = WEB_STATE_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def extract_web_documents(
+    sitemaps: Optional[List[str]] = None,
+    max_workers: int = WEB_WORKERS,
+    rate_limit: float = WEB_RATE_LIMIT,
+    state_file: str = WEB_STATE_FILE,
+    sitemap_state_file: str = WEB_SITEMAP_STATE_FILE,
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Pobiera strony z sitemap i zwraca je jako dokumenty w formacie ekstrakcji Zotero.
+
+    Strony są pobierane równolegle wspólną sesją HTTP (ponowne użycie
+    połączeń) z limitem żądań na host. Konwertowane są tylko strony, których
+    `lastmod` w sitemapie lub skrót treści zmienił się od poprzedniego
+    przebiegu; pozostałe pochodzą z cache. Sitemapy bez zmian (304) nie są
+    nawet parsowane, a ich strony zostają z poprzedniego przebiegu.
+
+    Returns:
+        (dokumenty wszystkich bieżących stron posortowane po kluczu,
+         klucze stron zmienionych lub usuniętych - ich chunki są nieaktualne)
+    """
+    sitemaps = WEB_SITEMAPS if sitemaps is None else sitemaps
+    previous_state = load_state(state_file)
+    session = make_session(max_workers)
+    limiter = HostRateLimiter(rate_limit)
+    crawler = SitemapCrawler(state_file=sitemap_state_file, max_workers=max_workers, session=session)
+
+    state: Dict[str, Dict[str, Any]] = {}
+    counts = {"changed": 0, "unchanged": 0, "skipped": 0, "error": 0}
+    failed_roots = set()
+    changed_keys = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        seen = set()
+        for root in sitemaps:
+            print(f"Sitemapa: {root}")
+            try:
+                # Strony są zlecane do pobrania w trakcie parsowania sitemap
+                for entry in crawler.crawl(root):
+                    if entry.url in seen:
+                        continue
+                    seen.add(entry.url)
+                    futures.append(executor.submit(
+                        process_page, entry, root, previous_state.get(entry.url, {}), session, limiter
+                    ))
+            except ValueError as e:
+                print(f"  ❌ {e}")
+                failed_roots.add(root)
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Strony WWW"):
+            result = future.result()
+            counts[result["status"]] += 1
+            metrics.inc("documents", stage="web", status=result["status"])
+            if result.get("page"):
+                state[result["url"]] = result["page"]
+            if result["status"] == "changed":
+                changed_keys.append(result["page"]["key"])
+            elif result["status"] in ("error", "skipped"):
+                tqdm.write(f"  ❌ {result['url']}: {result['error']}")
+
+    # Strony nieobecne w tym przebiegu zostają, jeśli ich sitemapa się nie zmieniła
+    # albo nie udało się jej pobrać; pozostałe zniknęły z sitemap
+    removed = []
+    for url, page in previous_state.items():
+        if url in state:
+            continue
+        if page.get("root") in sitemaps and (
+            page.get("root") in failed_roots or page.get("sitemap") in crawler.not_modified
+        ):
+            state[url] = page
+        else:
+            removed.append(page["key"])
+            cache_path = get_page_cache_filename(page["key"])
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+
+    save_state(state, state_file)
+
+    docs = []
+    for page in state.values():
+        try:
+            with open(get_page_cache_filename(page["key"]), 'rb') as f:
+                docs.append(pickle.load(f))
+        except Exception as e:
+            print(f"  ❌ Nie można wczytać strony {page['key']} z cache: {e}")
+    docs.sort(key=lambda doc_info: doc_info['zotero_key'])
+
+    print(f"\nStrony WWW: {len(docs)} (zmienione: {counts['changed']}, bez zmian: {counts['unchanged']}, "
+          f"usunięte: {len(removed)}, pominięte: {counts['skipped']}, błędy: {counts['error']})")
+    print(f"Sitemapy: {crawler.stats['fetched']} pobrane, {crawler.stats['not_modified']} bez zmian (304)")
+    print(metrics.format_summary())
+    metrics.write_prometheus("web")
+    return docs, sorted(changed_keys + removed)
+
+
+def load_web_documents(path: str = WEB_DOCS_FILE) -> List[Dict[str, Any]]:
+    """Wczytuje dokumenty stron zapisane przez extract_web_documents() (pusta lista, gdy ich nie ma)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def main(argv: Optional[List[str]] = None):
+    from utils.pipeline import delete_chunk_caches, write_pickle
+
+    parser = argparse.ArgumentParser(description="Pobieranie stron WWW z sitemap do bazy wiedzy")
+    parser.add_argument("sitemaps", nargs="*", default=WEB_SITEMAPS, help="Adresy sitemap (domyślnie WEB_SITEMAPS)")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--rate-limit", type=float, default=WEB_RATE_LIMIT, help="Żądań na sekundę na host")
+    args = parser.parse_args(argv)
+
+    if not args.sitemaps:
+        parser.error("podaj adresy sitemap lub ustaw WEB_SITEMAPS")
+    docs, stale = extract_web_documents(args.sitemaps, args.workers, args.rate_limit)
+    delete_chunk_caches(stale)
+    write_pickle(docs, WEB_DOCS_FILE)
+    print(f"Zapisano {len(docs)} stron do {WEB_DOCS_FILE} - uruchom 2-chunking.py i 3-embedding.py")
+
+
+if __name__ == "__main__":
+    main()
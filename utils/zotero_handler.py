@@ -1,5 +1,5 @@
 import os
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterable, List, Tuple
 from docling.document_converter import DocumentConverter
 from pyzotero import zotero
 from dotenv import load_dotenv
@@ -8,18 +8,31 @@ import tempfile
 from tqdm import tqdm
 import pickle
 import hashlib
+import socket
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import multiprocessing
 
+from utils.dates import parse_date
+from utils.metrics import metrics
+from utils.profiling import PROFILING, ProfileReport, docling_timings, enable_docling_timings, profile_document
+
 load_dotenv()
 
+# Limit API Zotero dla parametru itemKey
+ITEM_KEYS_PER_REQUEST = 50
+
 def get_zotero_connection():
     """Tworzy połączenie z Zotero API."""
     ZOTERO_USER_ID = os.getenv('ZOTERO_USER_ID')
     ZOTERO_API_KEY = os.getenv('ZOTERO_API_KEY')
     ZOTERO_LIBRARY_TYPE = os.getenv('ZOTERO_LIBRARY_TYPE')
-    
-    return zotero.Zotero(ZOTERO_USER_ID, ZOTERO_LIBRARY_TYPE, ZOTERO_API_KEY)
+    # Inny adres API, np. lokalna atrapa z benchmarks/mock_zotero.py (domyślnie api.zotero.org)
+    ZOTERO_API_URL = os.getenv('ZOTERO_API_URL')
+
+    zot = zotero.Zotero(ZOTERO_USER_ID, ZOTERO_LIBRARY_TYPE, ZOTERO_API_KEY)
+    if ZOTERO_API_URL:
+        zot.endpoint = ZOTERO_API_URL.rstrip('/')
+    return zot
 
 def get_zotero_items_with_pdfs() -> List[Dict[str, Any]]:
     """Pobiera wszystkie elementy z biblioteki Zotero, które mają załączniki PDF."""
@@ -27,7 +40,9 @@ def get_zotero_items_with_pdfs() -> List[Dict[str, Any]]:
     
     zot = get_zotero_connection()
     # Pobierz wszystkie elementy, w tym załączniki
-    all_items = zot.everything(zot.items())
+    with metrics.span("zotero_items") as span:
+        all_items = zot.everything(zot.items())
+        span["items"] = len(all_items)
     
     # Słownik do mapowania kluczy rodziców na elementy
     items_map = {item['key']: item for item in all_items if item['data'].get('itemType') != 'attachment'}
@@ -35,19 +50,100 @@ def get_zotero_items_with_pdfs() -> List[Dict[str, Any]]:
     # Filtruj załączniki PDF i połącz je z ich rodzicami
     attachments_with_parents = []
     for item in all_items:
-        if item['data'].get('itemType') == 'attachment' and item['data'].get('contentType') == 'application/pdf':
+        if is_pdf_attachment(item['data']):
             parent_key = item['data'].get('parentItem')
             if parent_key in items_map:
-                parent_item = items_map[parent_key]
-                # Kopiujemy dane rodzica i dodajemy informacje o załączniku
-                combined_item = parent_item.copy()
-                combined_item['attachment'] = item['data']
-                combined_item['attachment_key'] = item['key']
-                attachments_with_parents.append(combined_item)
+                attachments_with_parents.append(with_attachment(items_map[parent_key], item))
 
     print(f"Znaleziono {len(attachments_with_parents)} elementów z załącznikami PDF")
     return attachments_with_parents
 
+def is_pdf_attachment(item_data: Dict[str, Any]) -> bool:
+    return item_data.get('itemType') == 'attachment' and item_data.get('contentType') == 'application/pdf'
+
+def with_attachment(parent_item: Dict[str, Any], attachment: Dict[str, Any]) -> Dict[str, Any]:
+    """Element rodzica z informacjami o załączniku PDF (postać elementów get_zotero_items_with_pdfs())."""
+    # Kopiujemy dane rodzica i dodajemy informacje o załączniku
+    combined_item = parent_item.copy()
+    combined_item['attachment'] = attachment['data']
+    combined_item['attachment_key'] = attachment['key']
+    return combined_item
+
+def get_items_with_pdfs(zot: zotero.Zotero, keys: Iterable[str]) -> List[Dict[str, Any]]:
+    """Elementy o podanych kluczach połączone z ich załącznikami PDF, jak w get_zotero_items_with_pdfs().
+
+    Pobierane są tylko te elementy (do ITEM_KEYS_PER_REQUEST kluczy na
+    zapytanie) i ich załączniki, bez listy całej biblioteki.
+    """
+    keys = sorted(set(keys))
+    items_with_pdfs = []
+    for start in range(0, len(keys), ITEM_KEYS_PER_REQUEST):
+        for parent in zot.items(itemKey=",".join(keys[start:start + ITEM_KEYS_PER_REQUEST])):
+            if parent['data'].get('itemType') == 'attachment':
+                continue
+            for child in zot.children(parent['key']):
+                if is_pdf_attachment(child['data']):
+                    items_with_pdfs.append(with_attachment(parent, child))
+    return items_with_pdfs
+
+def get_document_metadata(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Zwraca metadane elementu Zotero zapisywane razem z dokumentem.
+
+    Pole daty w Zotero jest dowolnym tekstem ("15.03.2019", "March 2019"),
+    więc do filtrów zapisywana jest też data znormalizowana (`parsed_date`)
+    z `meta.parsedDate` API Zotero, a gdy jej brak - z samego pola daty.
+    """
+    item_data = item['data']
+    return {
+        'title': item_data.get('title', 'Bez tytułu'),
+        'creators': item_data.get('creators', []),
+        'date': item_data.get('date', ''),
+        'parsed_date': parse_date(item.get('meta', {}).get('parsedDate') or item_data.get('date')),
+        'item_type': item_data.get('itemType', ''),
+    }
+
+def refresh_changed_documents(zot: zotero.Zotero, since: int) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Aktualizuje cache dokumentów elementów zmienionych w Zotero od wersji biblioteki `since`.
+
+    Pobierane są tylko zmienione elementy (parametr `since` API Zotero).
+    Zmieniony załącznik PDF usuwa dokument z cache, więc zostanie ponownie
+    pobrany i skonwertowany. Zmienione metadane elementu są poprawiane
+    w cache bez ponownej konwersji.
+
+    Returns:
+        Klucze elementów, których dokumenty w cache się zmieniły (ich chunki są nieaktualne),
+        oraz zmienione elementy z załącznikami PDF (jak w get_zotero_items_with_pdfs())
+    """
+    stale = set()
+    changed = set()
+    for item in zot.everything(zot.items(since=since)):
+        data = item['data']
+        if data.get('itemType') != 'attachment':
+            changed.add(item['key'])
+        elif is_pdf_attachment(data) and data.get('parentItem'):
+            cache_path = get_cache_filename(data['parentItem'], item['key'])
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+            stale.add(data['parentItem'])
+            changed.add(data['parentItem'])
+    
+    changed_items = get_items_with_pdfs(zot, changed)
+    for item in changed_items:
+        cache_path = get_cache_filename(item['key'], item['attachment_key'])
+        if not os.path.exists(cache_path):
+            continue
+        metadata = get_document_metadata(item)
+        doc_info = load_cached_document(cache_path)
+        if any(doc_info.get(field) != value for field, value in metadata.items()):
+            doc_info.update(metadata)
+            save_document_to_cache(doc_info, cache_path)
+            stale.add(item['key'])
+    return sorted(stale), changed_items
+
+def get_deleted_keys(zot: zotero.Zotero, since: int) -> List[str]:
+    """Klucze elementów usuniętych z biblioteki od wersji `since`."""
+    return list(zot.deleted(since=since).get('items', []))
+
 def download_pdf_from_zotero(zot: zotero.Zotero, attachment_key: str) -> str:
     """Pobiera PDF z Zotero API i zapisuje do pliku tymczasowego."""
     # Pobierz zawartość pliku PDF
@@ -112,10 +208,16 @@ def load_cached_document(cache_path: str) -> Dict[str, Any]:
         return pickle.load(f)
 
 def save_document_to_cache(doc_info: Dict[str, Any], cache_path: str):
-    """Zapisuje dokument do cache."""
+    """Zapisuje dokument do cache (atomowo)."""
     os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-    with open(cache_path, 'wb') as f:
-        pickle.dump(doc_info, f)
+    # Zapis atomowy: inne procesy (także na innych hostach, przy współdzielonym
+    # cache) widzą plik kompletny albo wcale
+    tmp_path = f"{cache_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with metrics.span("cache_write") as span:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(doc_info, f)
+            span["bytes"] = f.tell()
+        os.replace(tmp_path, cache_path)
 
 def process_single_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
     """Przetwarza pojedynczy dokument PDF z Zotero.
@@ -124,8 +226,25 @@ def process_single_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
         item_data: Słownik zawierający dane elementu Zotero
         
     Returns:
-        Słownik z przetworzonymi danymi dokumentu lub informacją o błędzie
+        Słownik z przetworzonymi danymi dokumentu lub informacją o błędzie,
+        metrykami procesu roboczego (`metrics`, do utils.metrics.merge)
+        i profilem dokumentu (`profile`, przy PIPELINE_PROFILE=1)
     """
+    zotero_key = item_data['item'].get('key')
+    with profile_document("extraction", zotero_key) as profile:
+        with metrics.span("extract_document", zotero_key=zotero_key):
+            result = _process_single_document(item_data)
+    status = ("cached" if result.get('cached') else "ok") if result['success'] else "error"
+    metrics.inc("documents", stage="extraction", status=status)
+    result['metrics'] = metrics.snapshot(reset=True)
+    if profile is not None:
+        # Fazy dokumentu to spany zmierzone w tym wywołaniu (metryki są zerowane po każdym dokumencie)
+        profile['title'] = result['title']
+        profile['phases'] = {stage: entry['sum'] for stage, entry in result['metrics']['durations'].items()}
+    result['profile'] = profile
+    return result
+
+def _process_single_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
     try:
         # Rozpakuj dane
         item = item_data['item']
@@ -135,7 +254,9 @@ def process_single_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
         # Sprawdź czy dokument już został przetworzony
         if os.path.exists(cache_path):
             try:
-                cached_doc = load_cached_document(cache_path)
+                with metrics.span("cache_load"):
+                    cached_doc = load_cached_document(cache_path)
+                metrics.inc("cache_requests", cache="documents", result="hit")
                 return {
                     'success': True,
                     'cached': True,
@@ -149,30 +270,43 @@ def process_single_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
                 except:
                     pass
         
+        metrics.inc("cache_requests", cache="documents", result="miss")
+        
         # Utwórz nowe połączenie Zotero dla tego procesu
         zot = get_zotero_connection()
+        if PROFILING:
+            enable_docling_timings()
         converter = DocumentConverter()
         pdf_path = None
         
         try:
             # Pobierz PDF używając klucza załącznika
-            pdf_path = download_pdf_from_zotero(zot, attachment_key)
+            with metrics.span("download", zotero_key=item['key']):
+                pdf_path = download_pdf_from_zotero(zot, attachment_key)
             
             # Sprawdź czy plik PDF jest poprawny
-            file_size = validate_pdf(pdf_path)
-            result = converter.convert(pdf_path)
+            with metrics.span("validation", zotero_key=item['key']) as span:
+                file_size = validate_pdf(pdf_path)
+                span["bytes"] = file_size
+            metrics.inc("downloaded_bytes", file_size)
+            
+            with metrics.span("conversion", zotero_key=item['key']) as span:
+                result = converter.convert(pdf_path)
+                page_count = len(result.document.pages) if result.document else 0
+                span["pages"] = page_count
             
             if not result.document:
                 raise ValueError("Konwersja nie zwróciła dokumentu")
+            metrics.inc("pages", page_count)
+            if PROFILING:
+                for name, seconds in docling_timings(result).items():
+                    metrics.observe(f"docling_{name}", seconds)
             
             # Dodaj metadane z Zotero
             doc_info = {
                 'document': result.document,
                 'zotero_key': item['key'],
-                'title': item['data'].get('title', 'Bez tytułu'),
-                'creators': item['data'].get('creators', []),
-                'date': item['data'].get('date', ''),
-                'item_type': item['data'].get('itemType', ''),
+                **get_document_metadata(item),
                 'pdf_size': file_size
             }
             
@@ -214,15 +348,17 @@ def process_single_document(item_data: Dict[str, Any]) -> Dict[str, Any]:
             'title': 'Nieznany dokument'
         }
 
-def extract_documents_from_zotero(max_workers: int = None) -> List[Dict[str, Any]]:
+def extract_documents_from_zotero(max_workers: int = None, items_with_pdfs: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """Ekstraktuje dokumenty z wszystkich PDFów w bibliotece Zotero używając multiprocessing.
     
     Args:
         max_workers: Maksymalna liczba procesów roboczych. Jeśli None, użyje liczby CPU.
+        items_with_pdfs: Elementy do przetworzenia (jak z get_zotero_items_with_pdfs()); domyślnie cała biblioteka
     
     Zapisuje każdy przetworzony dokument osobno i pomija już przetworzone.
     """
-    items_with_pdfs = get_zotero_items_with_pdfs()
+    if items_with_pdfs is None:
+        items_with_pdfs = get_zotero_items_with_pdfs()
     extracted_docs = []
     
     # Utwórz katalog cache jeśli nie istnieje
@@ -237,6 +373,7 @@ def extract_documents_from_zotero(max_workers: int = None) -> List[Dict[str, Any
     processed_count = 0
     skipped_count = 0
     error_count = 0
+    report = ProfileReport("extraction") if PROFILING else None
     
     # Przygotuj dane dla procesów roboczych
     items_data = [{'item': item} for item in items_with_pdfs]
@@ -252,6 +389,9 @@ def extract_documents_from_zotero(max_workers: int = None) -> List[Dict[str, Any
             for future in as_completed(future_to_item):
                 try:
                     result = future.result()
+                    metrics.merge(result.pop('metrics', None))
+                    if report:
+                        report.add(result.pop('profile', None))
                     
                     if result['success']:
                         extracted_docs.append(result['doc_info'])
@@ -279,4 +419,8 @@ def extract_documents_from_zotero(max_workers: int = None) -> List[Dict[str, Any
     print(f"  Błędów: {error_count}")
     print(f"  Łącznie dokumentów: {len(extracted_docs)}")
     print(f"  Użyto procesów: {max_workers}")
+    print(metrics.format_summary())
+    print(f"Metryki zapisano do {metrics.write_prometheus('extraction')}")
+    if report:
+        print(f"Raport profilowania: {report.write()}")
     return extracted_docs
\ No newline at end of file